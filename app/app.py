@@ -1,6 +1,5 @@
 import uuid
-import json
-from src.utils import NumpyArrayEncoder, load_mnist, preprocess_images, get_batch
+from src.utils import load_mnist, preprocess_images, iter_batches
 from src.Sender import send_cb
 from src.Receiver import receive_cb
 from src.Message import Message
@@ -10,14 +9,12 @@ def communicate_with(broker):
 
     # Setup application
     app = Application()
-    app.setup(broker=broker, config_path=f"config/{broker}")
+    app.setup(broker=broker, config_path=f"config/{broker}", topics_file="config/topics.json")
 
     # Creating topics
-    with open("config/topics.json", 'r') as file:
-        topic_conf = json.load(file)
-
-    for _, val in topic_conf.items():
-        app.sender.create_topic(val)
+    topic_conf = app.topics
+    for topic in (topic_conf["topic_in"], topic_conf["topic_out"]):
+        app.sender.create_topic(topic)
 
     # Consuming data
     topic_read = topic_conf["topic_in"]
@@ -30,17 +27,15 @@ def communicate_with(broker):
 
     # Producing data
     x, y = load_mnist('data/')
-    x = preprocess_images(x)
 
     batch_size = 1
-    x_batches = get_batch(x, batch_size)
+    x_batches = iter_batches(x, batch_size)
     topic_write = topic_read
     print(f'#### APP: Sending messages to topic {topic_write}@{app.broker}')
     for i in range(10):
         key = uuid.uuid4().hex[:4]
-        payload = {'ndarray': x_batches[i]}
-        encoded_payload = json.dumps(payload, cls=NumpyArrayEncoder)
-        msg = Message(key=key, value=encoded_payload)
+        # Encoded with the codec configured for the topic
+        msg = Message(key=key, value=preprocess_images(next(x_batches)))
         app.sender.send(topic=topic_write, msg=msg, callback=send_cb)
 
     app.sender.flush()
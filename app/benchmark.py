@@ -0,0 +1,201 @@
+import argparse
+import json
+import time
+import tracemalloc
+import numpy as np
+from src.utils import NumpyArrayEncoder, get_batch, iter_batches
+from src.codecs import CODECS
+from src.compression import COMPRESSORS
+from src.Message import Message
+from src.decorators import on_delivery, on_receive
+from src.memory.MemoryBroker import MemoryRecord
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    '--batch_sizes',
+    type=int,
+    nargs='+',
+    help='Images per message to benchmark',
+    default=[1, 8, 64])
+
+parser.add_argument(
+    '--iterations',
+    type=int,
+    help='Timed calls per benchmark',
+    default=200)
+
+parser.add_argument(
+    '--filter',
+    type=str,
+    help='Only run the benchmarks whose name contains this string',
+    default='')
+
+parser.add_argument(
+    '--save',
+    type=str,
+    help='Path to save the results to, to be used as a baseline',
+    default='')
+
+parser.add_argument(
+    '--baseline',
+    type=str,
+    help='Path to a baseline to compare the results with',
+    default='')
+
+parser.add_argument(
+    '--threshold',
+    type=float,
+    help='Relative msgs/s drop from the baseline reported as a regression',
+    default=0.1)
+
+args = parser.parse_args()
+
+class PSMessage:
+    """Stand-in for a received PubSub message
+    """
+    def __init__(self, data, attributes=None):
+        self.data = data
+        self.attributes = attributes or {}
+
+    def ack(self):
+        pass
+
+class PSFuture:
+    """Stand-in for a resolved PubSub publish future
+    """
+    def result(self):
+        return "1"
+
+def measure(fn, iterations, msgs_per_call=1, payload_bytes=0):
+    """Times fn and traces its peak allocations
+
+    Args:
+        fn (fn()): Benchmarked function
+        iterations (int): Timed calls
+        msgs_per_call (int, optional): Messages processed per call. Defaults to 1.
+        payload_bytes (int, optional): Bytes per message. Defaults to 0.
+
+    Returns:
+        dict: msgs/s, bytes/msg, p50/p99 latency (us) and peak allocated bytes
+    """
+    for _ in range(min(10, iterations)): # Warm-up
+        fn()
+
+    timings = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter_ns()
+        fn()
+        timings[i] = time.perf_counter_ns() - start
+
+    # Traced separately, tracemalloc slows down the calls
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Throughput from the median call, less sensitive to outliers than the mean
+    return {
+        "msgs_per_s": msgs_per_call / (np.median(timings) / 1e9),
+        "bytes_per_msg": payload_bytes,
+        "p50_us": float(np.percentile(timings, 50) / 1e3),
+        "p99_us": float(np.percentile(timings, 99) / 1e3),
+        "peak_alloc_bytes": peak,
+    }
+
+def _read(msg):
+    # Reads the fields of a received message, which are only decoded on first access
+    return msg.key, msg.value
+
+def benchmarks(batch_size):
+    """Benchmarked hot path functions for a batch size
+
+    Args:
+        batch_size (int): Images per message
+
+    Yields:
+        name, fn, msgs_per_call, payload_bytes
+    """
+    x = np.random.rand(batch_size, 1, 28, 28).astype("float32")
+    json_payload = json.dumps({'ndarray': x}, cls=NumpyArrayEncoder)
+
+    yield "json.dumps(NumpyArrayEncoder)", lambda: json.dumps({'ndarray': x}, cls=NumpyArrayEncoder), 1, len(json_payload)
+    yield "Message.toJSON", lambda: Message(key="abcd", value=json_payload).toJSON(), 1, len(json_payload)
+
+    for name in CODECS:
+        msg = Message.from_ndarray(key="abcd", array=x, codec=name)
+        yield f"encode[{name}]", lambda name=name: Message.from_ndarray(key="abcd", array=x, codec=name), 1, len(msg.value)
+        yield f"decode[{name}]", msg.to_ndarray, 1, len(msg.value)
+
+    for name in COMPRESSORS:
+        msg = Message.from_ndarray(key="abcd", array=x, codec="raw", compression=name)
+        yield f"encode[raw+{name}]", lambda name=name: Message.from_ndarray(key="abcd", array=x, codec="raw", compression=name), 1, len(msg.value)
+        yield f"decode[raw+{name}]", msg.to_ndarray, 1, len(msg.value)
+
+    msg = Message.from_ndarray(key="abcd", array=x, codec="raw")
+    headers = [(k, v.encode("utf-8")) for k, v in msg.headers.items()]
+    record = MemoryRecord("model-input", 0, 0, key=b"abcd", value=msg.value, headers=headers)
+    json_record = MemoryRecord("model-input", 0, 0, key=b"abcd", value=json_payload.encode("utf-8"))
+    # The received messages are read, as a consumer would, so that the decoding deferred to the first access is timed too
+    yield "Message.from_kafka[json]", lambda: _read(Message.from_kafka(json_record)), 1, len(json_payload)
+    yield "Message.from_kafka[raw]", lambda: _read(Message.from_kafka(record)), 1, len(msg.value)
+
+    ps_json = PSMessage(Message(key="abcd", value=json_payload).toJSON().encode("utf-8"))
+    ps_raw = PSMessage(msg.value, {"key": "abcd", **msg.headers})
+    yield "Message.from_PS[json]", lambda: _read(Message.from_PS(ps_json)), 1, len(ps_json.data)
+    yield "Message.from_PS[raw]", lambda: _read(Message.from_PS(ps_raw)), 1, len(msg.value)
+
+    delivery_cb = on_delivery(lambda err, msg_id: None)
+    receive_cb = on_receive(lambda err, msg: _read(msg))
+    future = PSFuture()
+    yield "on_delivery[kafka]", lambda: delivery_cb(None, record), 1, len(msg.value)
+    yield "on_delivery[pubsub]", lambda: delivery_cb(future), 1, len(msg.value)
+    yield "on_receive[kafka]", lambda: receive_cb(record, 0), 1, len(msg.value)
+    yield "on_receive[pubsub]", lambda: receive_cb(ps_raw), 1, len(msg.value)
+
+    images = np.random.rand(10000, 1, 28, 28).astype("float32")
+    n_batches = len(range(0, len(images), batch_size))
+    yield "get_batch", lambda: get_batch(images, batch_size), n_batches, x.nbytes
+    yield "iter_batches", lambda: list(iter_batches(images, batch_size)), n_batches, x.nbytes
+
+def compare(results, baseline, threshold):
+    """Prints the msgs/s change from the baseline
+
+    Returns:
+        list: Regressed benchmarks
+    """
+    regressions = []
+    for key, res in results.items():
+        if key not in baseline:
+            continue
+        change = res["msgs_per_s"] / baseline[key]["msgs_per_s"] - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(key)
+            flag = " REGRESSION"
+        print(f"{key:<45} {change:+7.1%}{flag}")
+    return regressions
+
+if __name__ == '__main__':
+    results = {}
+    print(f"{'benchmark':<45} {'msgs/s':>12} {'bytes/msg':>10} {'p50 us':>9} {'p99 us':>9} {'peak KB':>9}")
+    for batch_size in args.batch_sizes:
+        for name, fn, msgs_per_call, payload_bytes in benchmarks(batch_size):
+            if args.filter not in name:
+                continue
+            key = f"{name}@{batch_size}"
+            res = measure(fn, args.iterations, msgs_per_call, payload_bytes)
+            results[key] = res
+            print(f"{key:<45} {res['msgs_per_s']:>12.0f} {res['bytes_per_msg']:>10} {res['p50_us']:>9.1f} {res['p99_us']:>9.1f} {res['peak_alloc_bytes']/1024:>9.1f}")
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=4)
+        print(f"Saved results to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        print(f"\nChange from {args.baseline}:")
+        if compare(results, baseline, args.threshold):
+            exit(1)
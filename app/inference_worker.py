@@ -0,0 +1,64 @@
+import argparse
+import os
+import signal
+import sys
+from threading import Event
+from src.Application import Application
+from src.InferenceWorker import InferenceWorker
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    '--broker',
+    type=str,
+    help='Message broker to serve requests from',
+    default='kafka',
+    choices=('kafka', 'pubsub'))
+
+parser.add_argument(
+    '--model_dir',
+    type=str,
+    help='Path to the model server directory, containing FashionClassifier.py and model.onnx',
+    default='../model_server')
+
+parser.add_argument(
+    '--max_batch_size',
+    type=int,
+    help='Maximum number of requests per model batch',
+    default=64)
+
+parser.add_argument(
+    '--max_wait_ms',
+    type=float,
+    help='Maximum time in milliseconds to wait to fill a batch',
+    default=10)
+
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    app = Application()
+    app.setup(broker=args.broker, config_path=f"config/{args.broker}", topics_file="config/topics.json")
+    for topic in (app.topics["topic_in"], app.topics["topic_out"]):
+        app.sender.create_topic(topic)
+
+    # The model is loaded from its own directory, where model.onnx lives
+    sys.path.insert(0, args.model_dir)
+    from FashionClassifier import FashionClassifier
+    cwd = os.getcwd()
+    os.chdir(args.model_dir)
+    model = FashionClassifier()
+    model.load()
+    os.chdir(cwd)
+
+    worker = InferenceWorker(app, model, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    print(f"#### Worker: Serving {app.topics['topic_in']} -> {app.topics['topic_out']}@{app.broker}")
+    worker.start()
+
+    # Serves until interrupted
+    stopped = Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stopped.set())
+    stopped.wait()
+    print("#### Worker: Stopping")
+    worker.stop()
+    print("Finish")
@@ -1,12 +1,14 @@
 import json
 from src.Sender import Sender
 from src.Receiver import Receiver
+from src.utils import get_topic_encoding
 
 class Application:
     def __init__(self):
         self.broker = None
         self.sender = None
         self.receiver = None
+        self.topics = {}
         self.config_paths = {}
     
     def _get_conf(self, filename):
@@ -14,9 +16,14 @@ class Application:
             conf = json.load(f)
         return conf
 
-    def setup(self, broker, config_path=None):
+    def setup(self, broker, config_path=None, topics_file=None):
         self.broker = broker
 
+        if topics_file:
+            self.topics = self._get_conf(topics_file)
+        codecs = get_topic_encoding(self.topics, "codec")
+        compression = get_topic_encoding(self.topics, "compression")
+
         if broker not in self.config_paths:
             self.config_paths[broker] = config_path
 
@@ -27,14 +34,14 @@ class Application:
         sender_conf = self._get_conf(sender_file)
         
         self.receiver = Receiver(conf=receiver_conf, _from=self.broker)
-        self.sender = Sender(conf=sender_conf, to=self.broker)
+        self.sender = Sender(conf=sender_conf, to=self.broker, codecs=codecs, compression=compression)
             
         # Broker API differences handled here
         if broker == "kafka":
             admin_file = self.config_paths[broker]+"/admin.json"
             admin_conf = self._get_conf(admin_file)
             self.sender._sender._init_admin_config(conf=admin_conf)
-        elif broker == "pubsub":
+        elif broker in ("pubsub", "memory"):
             pass
         else:
             raise Exception("Non-supported broker")
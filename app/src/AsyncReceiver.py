@@ -0,0 +1,86 @@
+import asyncio
+from threading import Thread
+
+from src.Receiver import Receiver
+from src.decorators import on_receive_batch
+
+_END = object()
+
+class AsyncReceiver(Receiver):
+    """asyncio Receiver. Receives messages from whatever message broker it's been configurated with
+    on a background thread, and hands them to the event loop through a bounded buffer.
+    Kafka offsets are only committed for the messages the application is done with: a message is acknowledged
+    when the next one is requested, i.e. once the body of the async for loop has run for it.
+
+    Usage:
+        receiver.subscribe(topic)
+        async for msg in receiver:
+            ...
+
+        Attributes:
+            max_buffered (int): Maximum number of received messages waiting to be iterated,
+                                the background thread stops receiving when the buffer is full
+            max_messages (int): Maximum number of messages received per batch
+            max_wait (float): Maximum time to block waiting for a batch
+            stop_on_eof (bool): End the iteration once there are no new messages to read
+            _queue (asyncio.Queue): Buffer of received messages
+            _last (Message): Last message handed to the application, acknowledged on the next iteration
+    """
+    def __init__(self, conf, _from, max_buffered=1000, max_messages=100, max_wait=0.1, stop_on_eof=False, **kwargs):
+        super().__init__(conf=conf, _from=_from, auto_ack=False, **kwargs)
+        self.max_buffered = max_buffered
+        self.max_messages = max_messages
+        self.max_wait = max_wait
+        self.stop_on_eof = stop_on_eof
+        self._queue = None
+        self._loop = None
+        self._last = None
+
+    def __aiter__(self):
+        if self._queue is None:
+            self._loop = asyncio.get_running_loop()
+            self._queue = asyncio.Queue(maxsize=self.max_buffered)
+            self._thread = Thread(target=self._receive, daemon=True)
+            self._thread.start()
+        return self
+
+    async def __anext__(self):
+        if self._last is not None:
+            self.ack(self._last)
+            self._last = None
+        msg = await self._queue.get()
+        if msg is _END:
+            raise StopAsyncIteration
+        self._last = msg
+        return msg
+
+    async def close(self):
+        """Stops receiving and closes receiver without blocking the event loop
+        """
+        self.stop()
+        if self._thread is not None:
+            # Unblock the background thread if it's waiting on a full buffer
+            while self._thread.is_alive():
+                while not self._queue.empty():
+                    self._queue.get_nowait()
+                await asyncio.sleep(self.max_wait)
+        await asyncio.get_running_loop().run_in_executor(None, self._receiver.close)
+
+    def _put(self, item):
+        asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop).result()
+
+    def _receive(self):
+        @on_receive_batch
+        def callback(err, msgs):
+            if err:
+                print(f"Errors while receiving the batch: {err}")
+            for msg in msgs:
+                self._put(msg)
+
+        try:
+            self._receiver.receive_batch(callback=callback,
+                                         max_messages=self.max_messages,
+                                         max_wait=self.max_wait,
+                                         stop_on_eof=self.stop_on_eof)
+        finally:
+            self._put(_END)
@@ -0,0 +1,78 @@
+import asyncio
+from threading import Thread, Event
+
+from src.Sender import Sender
+from src.decorators import on_delivery
+
+class AsyncSender(Sender):
+    """asyncio Sender. Sends messages to whatever message broker it's been configurated with,
+    returning awaitables that complete once the broker acknowledges the delivery.
+    Sends wait asynchronously while the in-flight window is full.
+
+        Attributes:
+            _poll_interval (float): Maximum time the polling thread blocks waiting for delivery reports
+            _poller (Thread): Thread serving the Kafka (and in-memory) delivery callbacks, started on the first send.
+                              PubSub futures call back on their own threads.
+    """
+    def __init__(self, conf, to, codecs=None, compression=None, poll_interval=0.1, **kwargs):
+        super().__init__(conf=conf, to=to, codecs=codecs, compression=compression, **kwargs)
+        self._poll_interval = poll_interval
+        self._poller = None
+        self._stop = Event()
+
+    async def send(self, topic, msg):
+        """Sends a message to a specified topic and waits for its delivery.
+
+        Args:
+            topic (str): Topic
+            msg (Message): Message instance
+
+        Raises:
+            Exception: Message could not be sent or delivered
+
+        Returns:
+            str: ID of the delivered message
+        """
+        if self._poller is None and self._type in ("kafka", "memory"):
+            self._poller = Thread(target=self._poll, daemon=True)
+            self._poller.start()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def _resolve(err, msg_id):
+            if future.done():
+                return
+            if err is not None:
+                future.set_exception(Exception(f"Failed to deliver message: {err}"))
+            else:
+                future.set_result(msg_id)
+
+        @on_delivery
+        def callback(err, msg_id):
+            # Called on the polling or publisher threads
+            loop.call_soon_threadsafe(_resolve, err, msg_id)
+
+        msg = self._encode(topic, msg)
+        size = self._size(msg)
+        if not self._window.acquire(size, block=False):
+            await loop.run_in_executor(None, self._window.acquire, size)
+        self._send(topic, msg, size, callback)
+        return await future
+
+    async def flush(self):
+        """Flushes any messages still on-hold without blocking the event loop
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self._sender.flush)
+
+    async def close(self):
+        """Flushes any messages still on-hold and stops the polling thread
+        """
+        await self.flush()
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join()
+
+    def _poll(self):
+        while not self._stop.is_set():
+            self._sender.poll(self._poll_interval)
@@ -0,0 +1,123 @@
+import zlib
+from queue import Queue
+from threading import Thread, Lock
+from src.Message import Message
+
+class ConsumerPool:
+    """Partition-parallel consumer. The receiver thread consumes batches and dispatches their messages to a pool of worker threads,
+    each with its own queue. Kafka partitions are spread over the workers and follow the rebalances, PubSub messages are
+    spread by hash of their key. A partition (or key) is only ever processed by one worker at a time, preserving the per-key order.
+    The receiver keeps consuming while the workers process the previous batches, up to max_buffered messages per worker: the workers acknowledge
+    each Kafka message once processed, and only the highest processed offset of each partition is committed. PubSub batches are acknowledged
+    by the subscriber once the callback returns, so each one is processed by the workers before the next one is pulled.
+
+        Attributes:
+            receiver (Receiver): Receiver, not subscribed yet. Its auto_ack is turned off
+            callback (fn(err, msg)): Message processing callback, called on the worker threads
+            num_workers (int): Number of worker threads
+            max_messages (int): Maximum number of messages consumed per batch
+            max_wait (float): Maximum time to block waiting for a batch
+            _queues (list): Queue of messages of each worker, bounded by max_buffered to hold back the receiver
+            _workers (list): Worker threads
+            _partitions (dict): Worker index of each assigned (topic, partition)
+    """
+    def __init__(self, receiver, callback, num_workers=4, max_buffered=1000, max_messages=100, max_wait=1.0):
+        self.receiver = receiver
+        self.receiver.auto_ack = False
+        self.callback = callback
+        self.num_workers = num_workers
+        self.max_messages = max_messages
+        self.max_wait = max_wait
+        self._queues = [Queue(maxsize=max_buffered) for _ in range(num_workers)]
+        self._workers = []
+        self._partitions = {}
+        self._lock = Lock()
+
+    def subscribe(self, topic):
+        """Subscribes to topic, keeping track of the assigned partitions
+
+        Args:
+            topic (str): Topic name
+        """
+        self.receiver.subscribe(topic, on_assign=self._on_assign, on_revoke=self._on_revoke)
+
+    def start(self, stop_on_eof=True):
+        """Starts the workers and the receiver thread
+
+        Args:
+            stop_on_eof (bool, optional): Stop once every assigned partition has been drained, otherwise consume until stopped. Defaults to True.
+        """
+        self._workers = [Thread(target=self._work, args=(queue,), daemon=True) for queue in self._queues]
+        for worker in self._workers:
+            worker.start()
+        self.receiver.receive_batch(max_messages=self.max_messages, max_wait=self.max_wait, callback=self._dispatch, stop_on_eof=stop_on_eof)
+
+    def stop(self):
+        """Stops consuming, to be followed by close
+        """
+        self.receiver.stop()
+
+    def close(self):
+        """Waits for the receiver to return and for the workers to process the dispatched messages, then closes receiver,
+        committing the offsets processed last
+        """
+        self.receiver.join()
+        for queue in self._queues:
+            queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self.receiver.close()
+
+    def _worker(self, topic, partition):
+        # Assigns unknown partitions to the least loaded worker
+        with self._lock:
+            tp = (topic, partition)
+            if tp not in self._partitions:
+                load = [0] * self.num_workers
+                for i in self._partitions.values():
+                    load[i] += 1
+                self._partitions[tp] = load.index(min(load))
+            return self._partitions[tp]
+
+    def _on_assign(self, consumer, partitions):
+        for p in partitions:
+            self._worker(p.topic, p.partition)
+
+    def _on_revoke(self, consumer, partitions):
+        # Called on the receiver thread before the partitions are handed over, so nothing else is dispatched meanwhile.
+        # Waits for the workers to process what they hold of the revoked partitions, the next owner resumes after it
+        with self._lock:
+            workers = {self._partitions.pop((p.topic, p.partition), None) for p in partitions}
+        for i in workers - {None}:
+            self._queues[i].join()
+
+    def _dispatch(self, *args):
+        if len(args)==2: # Kafka
+            results, _ = args
+            for res in results:
+                if res.error():
+                    self.callback(res.error(), None)
+                    continue
+                self._queues[self._worker(res.topic(), res.partition())].put(Message.from_kafka(res))
+        else: # PubSub
+            results = args[0]
+            for res in results:
+                msg = Message.from_PS(res)
+                self._queues[zlib.crc32(str(msg.key).encode("utf-8")) % self.num_workers].put(msg)
+            # Acknowledged by the subscriber once the callback returns
+            for queue in self._queues:
+                queue.join()
+
+    def _work(self, queue):
+        while True:
+            msg = queue.get()
+            try:
+                if msg is None:
+                    return
+                self.callback(None, msg)
+            except Exception as e:
+                print(f"Failed to process message {msg.key}: {e}")
+            finally:
+                if msg is not None:
+                    self.receiver.ack(msg)
+                queue.task_done()
@@ -0,0 +1,57 @@
+from threading import Condition
+
+class InFlightWindow:
+    """In-flight window. Bounds the messages sent but not yet acknowledged by the broker, by count and by bytes.
+    A message bigger than max_bytes is still let through when the window is empty.
+
+        Attributes:
+            max_messages (int): Maximum number of messages in flight, None for no limit
+            max_bytes (int): Maximum number of payload bytes in flight, None for no limit
+            messages (int): Messages in flight
+            bytes (int): Payload bytes in flight
+    """
+    def __init__(self, max_messages=10000, max_bytes=64*1024*1024):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.messages = 0
+        self.bytes = 0
+        self._cond = Condition()
+
+    def _has_room(self, size):
+        if self.messages == 0:
+            return True
+        if self.max_messages is not None and self.messages >= self.max_messages:
+            return False
+        if self.max_bytes is not None and self.bytes + size > self.max_bytes:
+            return False
+        return True
+
+    def acquire(self, size, block=True, timeout=None):
+        """Reserves room for a message
+
+        Args:
+            size (int): Payload bytes
+            block (bool, optional): Wait for room, otherwise return immediately. Defaults to True.
+            timeout (float, optional): Maximum time to wait for room, None to wait forever. Defaults to None.
+
+        Returns:
+            bool: Whether the room has been reserved
+        """
+        with self._cond:
+            if not self._has_room(size):
+                if not block or not self._cond.wait_for(lambda: self._has_room(size), timeout=timeout):
+                    return False
+            self.messages += 1
+            self.bytes += size
+            return True
+
+    def release(self, size):
+        """Frees the room of an acknowledged (or failed) message
+
+        Args:
+            size (int): Payload bytes
+        """
+        with self._cond:
+            self.messages -= 1
+            self.bytes -= size
+            self._cond.notify_all()
@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import time
+import uuid
+from concurrent.futures import Future, InvalidStateError
+from threading import Thread, Condition, RLock, BoundedSemaphore
+
+from src.Message import Message
+from src.decorators import on_delivery, on_receive_batch
+
+class InferenceClient:
+    """Request/response client. Sends requests to the input topic and resolves a future per request
+    once the prediction with the same key is read from the output topic by a single shared consumer.
+
+    The receiver has to be the only member of its consumer group, results read by other members are missed.
+
+        Attributes:
+            app (Application): Set up application, providing sender, receiver and topics
+            topic_in (str): Topic to send requests to
+            topic_out (str): Topic to read predictions from
+            timeout (float): Seconds after which a pending request fails with TimeoutError, None to wait forever
+            _pending (dict): Future of each pending request, by key
+            _deadlines (list): Heap of (deadline, sequence number, key, future) of the pending requests
+            _slots (BoundedSemaphore): Bounds the number of outstanding requests
+    """
+    def __init__(self, app, max_outstanding=1000, timeout=30.0, max_batch_size=100, max_wait_ms=10):
+        self.app = app
+        self.topic_in = app.topics["topic_in"]
+        self.topic_out = app.topics["topic_out"]
+        self.timeout = timeout
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._pending = {}
+        self._deadlines = []
+        self._seq = itertools.count()
+        self._cond = Condition(RLock())
+        self._slots = BoundedSemaphore(max_outstanding)
+        self._closed = False
+        self._reaper = None
+
+    def start(self):
+        """Starts the shared consumer on the output topic and the request expiration thread
+        """
+        self.app.receiver.subscribe(self.topic_out)
+        self.app.receiver.receive_batch(max_messages=self.max_batch_size,
+                                        max_wait=self.max_wait,
+                                        callback=on_receive_batch(self._on_results),
+                                        stop_on_eof=False)
+        self._reaper = Thread(target=self._expire, daemon=True)
+        self._reaper.start()
+
+    def close(self):
+        """Stops the consumer and cancels the requests still pending
+        """
+        with self._cond:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+            self._cond.notify()
+        for future in pending.values():
+            future.cancel()
+        self.app.receiver.stop()
+        self.app.receiver.close()
+        self.app.sender.flush()
+
+    def submit(self, x, key=None, block=True):
+        """Sends a request
+
+        Args:
+            x (np.ndarray): Model input
+            key (str, optional): Request key, has to be unique among the pending requests. Defaults to a random one.
+            block (bool, optional): Wait for a slot when there are max_outstanding requests already, otherwise raise. Defaults to True.
+
+        Raises:
+            Exception: Too many outstanding requests, or a request with the same key is pending
+
+        Returns:
+            Future: Resolved with the prediction as np.ndarray
+        """
+        if not self._slots.acquire(blocking=block):
+            raise Exception("Too many outstanding requests")
+
+        key = key if key is not None else uuid.uuid4().hex
+        future = Future()
+        with self._cond:
+            if key in self._pending:
+                self._slots.release()
+                raise Exception(f"A request with key {key} is already pending")
+            future.add_done_callback(functools.partial(self._done, key))
+            self._pending[key] = future
+            if self.timeout is not None:
+                heapq.heappush(self._deadlines, (time.monotonic() + self.timeout, next(self._seq), key, future))
+                self._cond.notify()
+
+        callback = on_delivery(functools.partial(self._on_delivery, key, future))
+        if not self.app.sender.send(topic=self.topic_in, msg=Message(key=key, value=x), callback=callback):
+            self._resolve(key, exception=Exception(f"Failed to send request {key}"), future=future)
+        return future
+
+    def predict(self, x, key=None):
+        """Sends a request and waits for its prediction
+
+        Args:
+            x (np.ndarray): Model input
+            key (str, optional): Request key. Defaults to a random one.
+
+        Returns:
+            np.ndarray: Prediction
+        """
+        return self.submit(x, key=key).result()
+
+    async def predict_async(self, x, key=None):
+        """Sends a request and awaits its prediction. Doesn't wait for a slot, which would block the event loop
+
+        Args:
+            x (np.ndarray): Model input
+            key (str, optional): Request key. Defaults to a random one.
+
+        Raises:
+            Exception: Too many outstanding requests, or a request with the same key is pending
+
+        Returns:
+            np.ndarray: Prediction
+        """
+        return await asyncio.wrap_future(self.submit(x, key=key, block=False))
+
+    def _resolve(self, key, result=None, exception=None, future=None):
+        # Given a future, only resolves it if it's still the pending request of the key, and not a later one reusing it
+        with self._cond:
+            if future is not None and self._pending.get(key) is not future:
+                return
+            future = self._pending.pop(key, None)
+        if future is None:
+            return
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError: # Cancelled by the caller
+            pass
+
+    def _done(self, key, future):
+        # Frees the slot and the key of a resolved or cancelled request
+        with self._cond:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+        self._slots.release()
+
+    def _on_delivery(self, key, future, err, msg_id):
+        if err is not None:
+            self._resolve(key, exception=Exception(f"Failed to deliver request {key}: {err}"), future=future)
+
+    def _on_results(self, err, msgs):
+        if err:
+            print(f"Errors while receiving results: {err}")
+        for msg in msgs:
+            if msg.key not in self._pending: # Not one of ours
+                continue
+            try:
+                self._resolve(msg.key, result=msg.to_ndarray())
+            except Exception as e:
+                self._resolve(msg.key, exception=e)
+
+    def _expire(self):
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                expired = []
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    expired.append(heapq.heappop(self._deadlines)[2:])
+                for key, future in expired:
+                    self._resolve(key, exception=TimeoutError(f"No result for request {key} after {self.timeout}s"), future=future)
+                self._cond.wait(self._deadlines[0][0] - now if self._deadlines else None)
@@ -0,0 +1,102 @@
+import json
+import numpy as np
+from src.Message import Message
+from src.Sender import send_cb
+from src.decorators import on_receive_batch
+
+class InferenceWorker:
+    """Stream inference worker. Consumes requests from the input topic in micro-batches, runs them through
+    the model as a single batch and produces the predictions to the output topic, keyed as their requests.
+
+        Attributes:
+            app (Application): Set up application, providing sender, receiver and topics
+            model (object): Model exposing predict(x), e.g. FashionClassifier
+            topic_in (str): Topic to read requests from
+            topic_out (str): Topic to write predictions to
+            max_batch_size (int): Maximum number of requests per model batch
+            max_wait (float): Maximum time in seconds to wait to fill a batch
+            input_shape (tuple): Shape of a model input, requests are batches of them
+    """
+    def __init__(self, app, model, max_batch_size=64, max_wait_ms=10, input_shape=(1, 28, 28)):
+        self.app = app
+        self.model = model
+        self.topic_in = app.topics["topic_in"]
+        self.topic_out = app.topics["topic_out"]
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.input_shape = tuple(input_shape)
+        self.process = on_receive_batch(self._process)
+
+    def start(self):
+        """Subscribes to the input topic and starts serving requests on the receiver thread, until stopped
+        """
+        self.app.receiver.subscribe(self.topic_in)
+        self.app.receiver.receive_batch(max_messages=self.max_batch_size, max_wait=self.max_wait, callback=self.process, stop_on_eof=False)
+
+    def stop(self):
+        """Stops serving, waiting for the batch in progress, and flushes the pending predictions
+        """
+        self.app.receiver.stop()
+        self.app.receiver.close()
+        self.app.sender.flush()
+
+    def _process(self, err, msgs):
+        """Runs a batch of requests through the model and sends back the predictions. Requests that can't be decoded,
+        or aren't batches of input_shape numeric arrays, get an error result instead of failing the whole batch
+
+        Args:
+            err (list): Errors if there were any
+            msgs (list): Request messages, each holding one or more inputs
+        """
+        if err:
+            print(f"Errors while receiving the batch: {err}")
+
+        # Stacked per dtype, raw pixels and floats in [0, 1] aren't mixed in a model batch
+        batches = {}
+        for msg in msgs:
+            try:
+                x = msg.to_ndarray()
+            except Exception as e:
+                self._send_error(msg.key, f"Failed to decode request: {e}")
+                continue
+            if x.dtype.kind not in "uif" or x.shape[1:] != self.input_shape:
+                self._send_error(msg.key, f"Expected a batch of numeric inputs of shape {self.input_shape}, got {x.dtype} of shape {x.shape}")
+                continue
+            batches.setdefault(x.dtype, []).append((msg.key, x))
+
+        for requests in batches.values():
+            self._predict(requests)
+
+    def _predict(self, requests):
+        """Runs requests through the model as a single batch, one by one if the batch fails, and sends back the predictions
+
+        Args:
+            requests (list): (key, input) of each request
+        """
+        keys, inputs = zip(*requests)
+        # Offsets of each request in the stacked batch
+        sizes = [len(x) for x in inputs]
+        try:
+            preds = np.asarray(self.model.predict(np.concatenate(inputs)))
+        except Exception as e:
+            if len(requests) > 1:
+                print(f"Failed to run inference on a batch of {len(requests)} requests, retrying them one by one: {e}")
+                for request in requests:
+                    self._predict([request])
+            else:
+                self._send_error(keys[0], f"Failed to run inference: {e}")
+            return
+
+        for key, pred in zip(keys, np.split(preds, np.cumsum(sizes)[:-1])):
+            self.app.sender.send(topic=self.topic_out, msg=Message(key=key, value=pred), callback=send_cb)
+
+    def _send_error(self, key, error):
+        """Sends an error result for a request, in the Seldon format, so that its client doesn't wait for it until it times out
+
+        Args:
+            key (str): Request key
+            error (str): Error description
+        """
+        print(f"Request {key}: {error}")
+        value = json.dumps({"status": {"code": 400, "info": error, "status": "FAILURE"}})
+        self.app.sender.send(topic=self.topic_out, msg=Message(key=key, value=value), callback=send_cb)
@@ -1,33 +1,210 @@
 import json
+import numpy as np
+
+from src.codecs import get_codec, DEFAULT_CODEC
+from src.compression import get_compressor
 
 class Message:
-    """Message class.
+    """Message class. Received messages keep the raw key, value and headers (or JSON payload, for PubSub text messages) from the broker,
+    and decode them on first access: binary values are never copied, and text values are only decoded if they're read.
 
         Attributes:
             key (str): Identifier
-            value (str): Message payload
-    """     
-    def __init__(self, key, value):
-        self.key = key
-        self.value = value
+            value (str|bytes|memoryview|np.ndarray): Message payload
+            headers (dict): Message metadata, e.g. the codec and compression the value has been encoded with
+            source (tuple): (topic, partition, offset) the message has been consumed from, None if it hasn't been consumed from Kafka
+    """
+    __slots__ = ("_key", "_value", "_headers", "_raw_key", "_raw_value", "_raw_headers", "_raw_json", "source")
+
+    def __init__(self, key, value, headers=None):
+        self._key = key
+        self._value = value
+        self._headers = headers if headers is not None else {}
+        self._raw_key = self._raw_value = self._raw_headers = self._raw_json = None
+        self.source = None
+
+    @classmethod
+    def _from_raw(cls, key, value, headers):
+        """Creates a message from undecoded broker data
+
+        Args:
+            key (bytes): Key
+            value (bytes|memoryview): Value
+            headers (list): (key, bytes value) headers, None if there are none
+        """
+        msg = cls.__new__(cls)
+        msg._key = msg._value = msg._headers = None
+        msg._raw_key, msg._raw_value, msg._raw_headers = key, value, headers
+        msg._raw_json = msg.source = None
+        return msg
+
+    def _load_json(self):
+        # Parses a JSON payload on first access to any of its fields
+        payload = json.loads(self._raw_json)
+        self._raw_json = None
+        self._key, self._value, self._headers = payload["key"], payload["value"], payload.get("headers", {})
 
     def __str__(self):
         return f'Message: {self.key}->{self.value}'
 
-    def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__)
+    @property
+    def key(self):
+        if self._raw_json is not None:
+            self._load_json()
+        if self._key is None and self._raw_key is not None:
+            self._key = self._raw_key.decode("utf-8")
+            self._raw_key = None
+        return self._key
+
+    @key.setter
+    def key(self, key):
+        if self._raw_json is not None:
+            self._load_json()
+        self._key, self._raw_key = key, None
+
+    @property
+    def headers(self):
+        if self._raw_json is not None:
+            self._load_json()
+        if self._headers is None:
+            self._headers = {k: v.decode("utf-8") for k, v in (self._raw_headers or [])}
+            self._raw_headers = None
+        return self._headers
+
+    @headers.setter
+    def headers(self, headers):
+        if self._raw_json is not None:
+            self._load_json()
+        self._headers, self._raw_headers = headers, None
+
+    @property
+    def value(self):
+        if self._raw_json is not None:
+            self._load_json()
+        if self._value is None and self._raw_value is not None:
+            value = self._raw_value
+            if "codec" not in self.headers: # Plain text payload
+                value = str(value, "utf-8")
+            self._value, self._raw_value = value, None
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if self._raw_json is not None:
+            self._load_json()
+        self._value, self._raw_value = value, None
+
+    @property
+    def buffer(self):
+        """Value as a memoryview, which numpy can wrap without copying (np.frombuffer), None for array and text values
+        """
+        if self._raw_json is not None:
+            self._load_json()
+        value = self._raw_value if self._value is None else self._value
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return memoryview(value)
+        return None
+
+    @property
+    def codec(self):
+        """Name of the codec the value has been encoded with, None for plain text payloads
+        """
+        return self.headers.get("codec")
+
+    @property
+    def compression(self):
+        """Name of the compression applied to the encoded value, None if uncompressed
+        """
+        return self.headers.get("compression")
+
+    def encode(self, codec=DEFAULT_CODEC, compression=None):
+        """Encodes an array value with the given codec, optionally compressing it, and records both in the headers.
+        Values that aren't arrays are left untouched.
+
+        Args:
+            codec (str, optional): Codec name. Defaults to DEFAULT_CODEC.
+            compression (str, optional): Compression name, None to leave the value uncompressed. Defaults to None.
+
+        Returns:
+            Message: self
+        """
+        if isinstance(self.value, np.ndarray):
+            self.value = get_codec(codec).encode(self.value)
+            self.headers["codec"] = codec
+            if compression:
+                self.value = get_compressor(compression).compress(self.value)
+                self.headers["compression"] = compression
+        return self
+
+    def to_ndarray(self):
+        """Decodes the value to an array with the codec recorded in the headers
+
+        Returns:
+            np.ndarray: Decoded value
+        """
+        if isinstance(self._value, np.ndarray):
+            return self._value
+        value = self.buffer if self.codec else self.value
+        if self.compression:
+            value = get_compressor(self.compression).decompress(value)
+        return get_codec(self.codec or DEFAULT_CODEC).decode(value)
+
+    @staticmethod
+    def stack_ndarrays(messages):
+        """Decodes the values of a batch of messages and concatenates them along the first axis
+
+        Args:
+            messages (list): Messages with array payloads
+
+        Returns:
+            np.ndarray: Batch of arrays
+        """
+        return np.concatenate([msg.to_ndarray() for msg in messages])
+
+    def toJSON(self, headers=False):
+        """Serializes the message as a JSON object of its key and value, the format of PubSub text messages
+
+        Args:
+            headers (bool, optional): Include the headers, under the "headers" key. Defaults to False.
+
+        Returns:
+            str: JSON document
+        """
+        payload = {"key": self.key, "value": self.value}
+        if headers:
+            payload["headers"] = self.headers
+        return json.dumps(payload)
+
+    @classmethod
+    def from_ndarray(cls, key, array, codec=DEFAULT_CODEC, compression=None):
+        """Creates a message from an array, encoding it with codec
+
+        Args:
+            key (str): Identifier
+            array (np.ndarray): Payload
+            codec (str, optional): Codec name. Defaults to DEFAULT_CODEC.
+            compression (str, optional): Compression name. Defaults to None.
+
+        Returns:
+            Message: Encoded message
+        """
+        return cls(key=key, value=array).encode(codec, compression)
 
     @classmethod
     def from_PS(cls, payload):
-        payload = json.loads(payload.data)
-        # Process output to message class
-        msg = cls(key=payload["key"], value=payload["value"])
+        attributes = dict(payload.attributes)
+        if "codec" in attributes: # Binary payload, metadata is carried in the attributes
+            key = attributes.pop("key")
+            return cls(key=key, value=payload.data, headers=attributes)
+
+        # JSON payload, parsed on first access
+        msg = cls._from_raw(key=None, value=None, headers=None)
+        msg._raw_json = payload.data
         return msg
 
     @classmethod
     def from_kafka(cls, payload):
-        key = payload.key().decode("utf-8")
-        value = payload.value().decode("utf-8")
-        # Process output to Message class
-        msg = cls(key=key, value=value)
-        return msg
\ No newline at end of file
+        # Decoded on first access
+        msg = cls._from_raw(key=payload.key(), value=payload.value(), headers=payload.headers())
+        msg.source = (payload.topic(), payload.partition(), payload.offset())
+        return msg
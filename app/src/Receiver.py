@@ -1,6 +1,7 @@
 from src.kafka.KafkaConsumer import KafkaConsumer
 from src.pubsub.PSSubscriber import PSSubscriber
-from src.decorators import on_receive
+from src.memory.MemoryConsumer import MemoryConsumer
+from src.decorators import on_receive, on_receive_batch
 from threading import Thread
 
 @on_receive
@@ -15,6 +16,19 @@ def receive_cb(err, msg):
         print(f"Error while receiving the message: {err}")
     else:
         print(f"Received record ID {msg.key}")
+
+@on_receive_batch
+def receive_batch_cb(err, msgs):
+    """Receive callback called when a batch of messages is received, containing the formatted messages
+
+    Args:
+        err (list): Errors if there were any
+        msgs (list): Received messages
+    """
+    if err:
+        print(f"Errors while receiving the batch: {err}")
+    print(f"Received {len(msgs)} records")
+
 class Receiver:
     """Generic Receiver class. Receives messages from whatever message broker it's been configurated with.
 
@@ -23,27 +37,66 @@ class Receiver:
             _receiver (ReceiverInterface): Receiver object
             _thread (Thread): Instantiated thread
     """     
-    def __init__(self, conf, _from):
+    def __init__(self, conf, _from, commit_every=1000, commit_interval=5.0, auto_ack=True):
         self._type = _from
         self._thread = None
         if self._type == "kafka":
-            self._receiver = KafkaConsumer(conf)
+            self._receiver = KafkaConsumer(conf, commit_every=commit_every, commit_interval=commit_interval, auto_ack=auto_ack)
+        elif self._type == "memory":
+            self._receiver = MemoryConsumer(conf, commit_every=commit_every, commit_interval=commit_interval, auto_ack=auto_ack)
         else:
             self._receiver = PSSubscriber(conf)
 
+    @property
+    def auto_ack(self):
+        """Whether the Kafka offsets of the messages are committed once the callback returns, otherwise once acknowledged with ack.
+        PubSub messages are always acknowledged once the callback returns
+        """
+        return getattr(self._receiver, "auto_ack", True)
+
+    @auto_ack.setter
+    def auto_ack(self, auto_ack):
+        if self._type in ("kafka", "memory"):
+            self._receiver.auto_ack = auto_ack
+
+    def ack(self, msg):
+        """Acknowledges a message processed by the application, when auto_ack is off. Thread-safe
+
+        Args:
+            msg (Message): Received message
+        """
+        if self._type in ("kafka", "memory") and msg.source is not None:
+            self._receiver.ack(*msg.source)
+
+    def join(self):
+        """Waits for the listening thread to return
+        """
+        if self._thread is not None:
+            self._thread.join()
+
     def close(self):
         """Closes receiver
         """ 
-        self._thread.join()
+        self.join()
         self._receiver.close()
 
-    def subscribe(self, topic):
+    def stop(self):
+        """Stops listening to messages, to be followed by close
+        """
+        self._receiver.stop()
+
+    def subscribe(self, topic, on_assign=None, on_revoke=None):
         """Subscribes to topic
 
         Args:
             topic (str): Topic name
+            on_assign (fn(consumer, partitions), optional): Called when partitions are assigned, Kafka only. Defaults to None.
+            on_revoke (fn(consumer, partitions), optional): Called before partitions are revoked, Kafka only. Defaults to None.
         """        
-        self._receiver.subscribe(topic)
+        if self._type in ("kafka", "memory"):
+            self._receiver.subscribe(topic, callback=on_assign, on_revoke=on_revoke)
+        else:
+            self._receiver.subscribe(topic)
 
     def receive(self, timeout=None, callback=receive_cb):
         """Listen to messages on the subscribed topic by waiting on an instantiated thread.
@@ -57,3 +110,19 @@ class Receiver:
             self._thread.start()
         except Exception as e:
             print(e)
+
+    def receive_batch(self, max_messages=100, max_wait=1.0, callback=receive_batch_cb, stop_on_eof=True):
+        """Listen to batches of messages on the subscribed topic by waiting on an instantiated thread.
+
+        Args:
+            max_messages (int, optional): Maximum number of messages per batch. Defaults to 100.
+            max_wait (float, optional): Maximum time to block waiting for a full batch. Defaults to 1.0.
+            callback (fn(*args), optional): Batch handling callback. Defaults to receive_batch_cb.
+            stop_on_eof (bool, optional): Stop once there are no new messages to read, otherwise listen until stopped. Defaults to True.
+        """
+        try:
+            self._thread = Thread(target = self._receiver.receive_batch,
+                                  kwargs = {"callback": callback, "max_messages": max_messages, "max_wait": max_wait, "stop_on_eof": stop_on_eof})
+            self._thread.start()
+        except Exception as e:
+            print(e)
@@ -1,6 +1,10 @@
+import numpy as np
 from src.kafka.KafkaProducer import KafkaProducer
 from src.pubsub.PSPublisher import PSPublisher
+from src.memory.MemoryProducer import MemoryProducer
 from src.decorators import on_delivery
+from src.codecs import DEFAULT_CODEC
+from src.InFlightWindow import InFlightWindow
 
 @on_delivery
 def send_cb(err, msg_id):
@@ -21,11 +25,19 @@ class Sender:
         Attributes:
             _type (str): Message Broker target
             _sender (SenderInterface): Sender object
+            _codecs (dict): Codec name used to encode array payloads, per topic
+            _compression (dict): Compression applied to encoded array payloads, per topic
+            _window (InFlightWindow): Bounds the messages sent but not yet delivered
     """          
-    def __init__(self, conf, to):
+    def __init__(self, conf, to, codecs=None, compression=None, max_in_flight=10000, max_in_flight_bytes=64*1024*1024):
         self._type = to
+        self._codecs = codecs if codecs is not None else {}
+        self._compression = compression if compression is not None else {}
+        self._window = InFlightWindow(max_messages=max_in_flight, max_bytes=max_in_flight_bytes)
         if self._type == "kafka":
             self._sender = KafkaProducer(conf)
+        elif self._type == "memory":
+            self._sender = MemoryProducer(conf)
         else:
             self._sender = PSPublisher(conf)
 
@@ -35,17 +47,85 @@ class Sender:
         self._sender.flush()
 
     def send(self, topic, msg, callback=send_cb):
-        """Sends a message to a specified topic.
+        """Sends a message to a specified topic. Array payloads are encoded with the codec and compression configured for the topic.
+        Blocks while the in-flight window is full.
 
         Args:
             topic (str): Topic
             msg (Message): Message instance
             callback (optional): Delivery callback. Defaults to None.
+
+        Returns:
+            bool: Whether the message has been handed over to the broker client
         """ 
         try:
-            self._sender.send(topic=topic, msg=msg, callback=callback)
+            msg = self._encode(topic, msg)
+            size = self._size(msg)
+            # Delivery reports are what frees the window, keep serving them while waiting
+            while not self._window.acquire(size, timeout=0.05):
+                self._sender.poll(0)
+            self._send(topic, msg, size, callback)
+            return True
         except Exception as e:
-            print(e)
+            print(f"Failed to send message {msg.key}: {e}")
+            return False
+
+    def _send(self, topic, msg, size, callback):
+        """Sends a message whose room in the in-flight window has been reserved, freeing it on delivery
+
+        Args:
+            topic (str): Topic
+            msg (Message): Encoded message
+            size (int): Reserved payload bytes
+            callback (fn(*args)): Delivery callback
+        """
+        def release(*args):
+            self._window.release(size)
+            if callback:
+                callback(*args)
+
+        try:
+            self._sender.send(topic=topic, msg=msg, callback=release)
+        except Exception:
+            self._window.release(size)
+            raise
+
+    @staticmethod
+    def _size(msg):
+        """Payload bytes of an encoded message, as sent to the broker: its key and binary or text value,
+        or its JSON serialization for other values
+        """
+        key = len(msg.key.encode("utf-8")) if msg.key else 0
+        buffer = msg.buffer
+        if buffer is not None:
+            return key + buffer.nbytes
+        if isinstance(msg.value, str):
+            return key + len(msg.value.encode("utf-8"))
+        if msg.value is None:
+            return key
+        return len(msg.toJSON().encode("utf-8"))
+
+    def poll(self, timeout=0):
+        """Serves the delivery callbacks of the messages sent so far
+
+        Args:
+            timeout (float, optional): Maximum time to block waiting for delivery reports. Defaults to 0.
+        """
+        self._sender.poll(timeout)
+
+    def _encode(self, topic, msg):
+        """Encodes array payloads with the codec and compression configured for the topic
+
+        Args:
+            topic (str): Topic
+            msg (Message): Message instance
+
+        Returns:
+            Message: Encoded message
+        """
+        if isinstance(msg.value, np.ndarray):
+            msg.encode(self._codecs.get(topic, DEFAULT_CODEC), self._compression.get(topic))
+        return msg
 
     def create_topic(self, topic):
         """Creates topic if it doesn't exist already.
@@ -0,0 +1,75 @@
+from threading import Thread, Event, Lock
+
+class TopicRegistry:
+    """Topic metadata registry. Caches the topics present in a message broker so that existence checks
+    are in-memory lookups, refreshing them in the background every `ttl` seconds.
+
+        Attributes:
+            _fetch (fn()): Returns the topics currently present in the broker
+            _ttl (float): Seconds between background refreshes
+            _topics (frozenset): Cached topics
+            _thread (Thread): Background refresh thread, started on the first lookup
+    """
+    def __init__(self, fetch, ttl=30.0):
+        self._fetch = fetch
+        self._ttl = ttl
+        self._topics = frozenset()
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def __contains__(self, topic):
+        """Checks whether topic exists, refreshing the cache once on a miss in case it was created elsewhere
+
+        Args:
+            topic (str): Topic name
+
+        Returns:
+            bool: Whether the topic exists
+        """
+        if self._thread is None:
+            self.start()
+        if topic in self._topics:
+            return True
+        self.refresh()
+        return topic in self._topics
+
+    def start(self):
+        """Fetches the topics and starts the background refresh thread
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = Thread(target=self._run, daemon=True)
+        self.refresh()
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self._ttl):
+            try:
+                self.refresh()
+            except Exception as e: # Keep serving the cached topics until the broker is reachable again
+                print(f"Failed to refresh topic metadata: {e}")
+
+    def refresh(self):
+        """Replaces the cached topics with the ones currently present in the broker
+        """
+        topics = frozenset(self._fetch())
+        with self._lock:
+            self._topics = topics
+
+    def add(self, topic):
+        """Adds a topic to the cache, to be called once it has been created
+
+        Args:
+            topic (str): Topic name
+        """
+        with self._lock:
+            self._topics = self._topics | {topic}
+
+    def close(self):
+        """Stops the background refresh thread
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
@@ -0,0 +1,189 @@
+import io
+import json
+import struct
+import numpy as np
+
+from src.interfaces import CodecInterface
+from src.utils import NumpyArrayEncoder
+
+class JSONCodec(CodecInterface):
+    """JSON codec, encodes arrays as nested lists under the `ndarray` key (Seldon format).
+    """
+    name = "json"
+
+    def encode(self, array):
+        """Encodes an array to a JSON payload
+
+        Args:
+            array (np.ndarray): Array to encode
+
+        Returns:
+            bytes: Encoded payload
+        """
+        return json.dumps({'ndarray': array}, cls=NumpyArrayEncoder).encode("utf-8")
+
+    def decode(self, payload):
+        """Decodes a JSON payload to an array
+
+        Args:
+            payload (bytes|str): Encoded payload
+
+        Raises:
+            Exception: Seldon error response, with no array
+
+        Returns:
+            np.ndarray: Decoded array
+        """
+        if isinstance(payload, memoryview):
+            payload = payload.tobytes()
+        payload = json.loads(payload)
+        if 'ndarray' not in payload and 'status' in payload:
+            raise Exception(f"Request failed: {payload['status'].get('info')}")
+        return np.asarray(payload['ndarray'])
+
+class RawCodec(CodecInterface):
+    """Raw codec, encodes arrays as their little-endian buffer prefixed by a small header.
+
+    The header is laid out as `magic (2s) | dtype length (B) | ndim (B) | dtype (str) | shape (ndim * I)`.
+    """
+    name = "raw"
+    MAGIC = b"RT"
+    _PREFIX = struct.Struct("<2sBB")
+
+    def encode(self, array):
+        """Encodes an array to a raw payload
+
+        Args:
+            array (np.ndarray): Array to encode
+
+        Returns:
+            bytes: Encoded payload
+        """
+        array = np.asarray(array)
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+        dtype = array.dtype.str.encode("ascii")
+        header = self._PREFIX.pack(self.MAGIC, len(dtype), array.ndim) + dtype
+        header += struct.pack(f"<{array.ndim}I", *array.shape)
+        return b"".join((header, memoryview(array).cast("B")))
+
+    def decode(self, payload):
+        """Decodes a raw payload to an array without copying the buffer
+
+        Args:
+            payload (bytes|memoryview): Encoded payload
+
+        Raises:
+            ValueError: Payload was not encoded with this codec
+
+        Returns:
+            np.ndarray: Read-only array viewing the payload
+        """
+        magic, dtype_len, ndim = self._PREFIX.unpack_from(payload, 0)
+        if magic != self.MAGIC:
+            raise ValueError("Payload is not a raw tensor")
+        offset = self._PREFIX.size
+        dtype = np.dtype(bytes(payload[offset:offset+dtype_len]).decode("ascii"))
+        offset += dtype_len
+        shape = struct.unpack_from(f"<{ndim}I", payload, offset)
+        offset += 4*ndim
+        return np.frombuffer(payload, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+class NpyCodec(CodecInterface):
+    """NPY codec, encodes arrays in the standard `.npy` format.
+    """
+    name = "npy"
+
+    def encode(self, array):
+        """Encodes an array to a .npy payload
+
+        Args:
+            array (np.ndarray): Array to encode
+
+        Returns:
+            bytes: Encoded payload
+        """
+        buffer = io.BytesIO()
+        np.lib.format.write_array(buffer, np.asarray(array), allow_pickle=False)
+        return buffer.getvalue()
+
+    def decode(self, payload):
+        """Decodes a .npy payload to an array without copying the buffer
+
+        Args:
+            payload (bytes|memoryview): Encoded payload
+
+        Returns:
+            np.ndarray: Read-only array viewing the payload
+        """
+        # Only the header is copied, its length is stored after the 6 magic and 2 version bytes
+        major = payload[6]
+        header_len = struct.unpack_from("<H" if major == 1 else "<I", payload, 8)[0]
+        offset = (10 if major == 1 else 12) + header_len
+        header = io.BytesIO(bytes(payload[:offset]))
+        version = np.lib.format.read_magic(header)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+        array = np.frombuffer(payload, dtype=dtype, count=int(np.prod(shape)), offset=offset)
+        return array.reshape(shape, order="F" if fortran_order else "C")
+
+class MsgpackCodec(CodecInterface):
+    """Msgpack codec, encodes arrays as a map of dtype, shape and binary data. Needs `msgpack`.
+    """
+    name = "msgpack"
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError as e:
+            raise ImportError("The msgpack codec needs the 'msgpack' package") from e
+        self._msgpack = msgpack
+
+    def encode(self, array):
+        """Encodes an array to a msgpack payload
+
+        Args:
+            array (np.ndarray): Array to encode
+
+        Returns:
+            bytes: Encoded payload
+        """
+        array = np.ascontiguousarray(array)
+        return self._msgpack.packb({"dtype": array.dtype.str,
+                                    "shape": array.shape,
+                                    "data": memoryview(array).cast("B")}, use_bin_type=True)
+
+    def decode(self, payload):
+        """Decodes a msgpack payload to an array, wrapping the unpacked data without a further copy
+
+        Args:
+            payload (bytes|memoryview): Encoded payload
+
+        Returns:
+            np.ndarray: Read-only decoded array
+        """
+        obj = self._msgpack.unpackb(payload, raw=False)
+        return np.frombuffer(obj["data"], dtype=np.dtype(obj["dtype"])).reshape(obj["shape"])
+
+CODECS = {c.name: c for c in (JSONCodec, RawCodec, NpyCodec, MsgpackCodec)}
+DEFAULT_CODEC = JSONCodec.name
+_instances = {}
+
+def get_codec(name):
+    """Returns the (shared) codec instance registered under name
+
+    Args:
+        name (str): Codec name, one of CODECS
+
+    Raises:
+        Exception: Codec not supported
+
+    Returns:
+        CodecInterface: Codec instance
+    """
+    if name not in _instances:
+        if name not in CODECS:
+            raise Exception(f"Non-supported codec '{name}'")
+        _instances[name] = CODECS[name]()
+    return _instances[name]
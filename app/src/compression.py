@@ -0,0 +1,92 @@
+from src.interfaces import CompressorInterface
+
+class ZstdCompressor(CompressorInterface):
+    """Zstandard compressor. Needs `zstandard`.
+    """
+    name = "zstd"
+
+    def __init__(self, level=3):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("The zstd compression needs the 'zstandard' package") from e
+        self._zstd = zstandard
+        self._level = level
+
+    def compress(self, payload):
+        """Compresses a payload
+
+        Args:
+            payload (bytes): Payload
+
+        Returns:
+            bytes: Compressed payload
+        """
+        # Compressors aren't thread safe, and are cheap to create
+        return self._zstd.ZstdCompressor(level=self._level).compress(payload)
+
+    def decompress(self, payload):
+        """Decompresses a payload
+
+        Args:
+            payload (bytes): Compressed payload
+
+        Returns:
+            bytes: Payload
+        """
+        return self._zstd.ZstdDecompressor().decompress(payload)
+
+class LZ4Compressor(CompressorInterface):
+    """LZ4 frame compressor. Needs `lz4`.
+    """
+    name = "lz4"
+
+    def __init__(self):
+        try:
+            import lz4.frame
+        except ImportError as e:
+            raise ImportError("The lz4 compression needs the 'lz4' package") from e
+        self._lz4 = lz4.frame
+
+    def compress(self, payload):
+        """Compresses a payload
+
+        Args:
+            payload (bytes): Payload
+
+        Returns:
+            bytes: Compressed payload
+        """
+        return self._lz4.compress(payload)
+
+    def decompress(self, payload):
+        """Decompresses a payload
+
+        Args:
+            payload (bytes): Compressed payload
+
+        Returns:
+            bytes: Payload
+        """
+        return self._lz4.decompress(payload)
+
+COMPRESSORS = {c.name: c for c in (ZstdCompressor, LZ4Compressor)}
+_instances = {}
+
+def get_compressor(name):
+    """Returns the (shared) compressor instance registered under name
+
+    Args:
+        name (str): Compression name, one of COMPRESSORS
+
+    Raises:
+        Exception: Compression not supported
+
+    Returns:
+        CompressorInterface: Compressor instance
+    """
+    if name not in _instances:
+        if name not in COMPRESSORS:
+            raise Exception(f"Non-supported compression '{name}'")
+        _instances[name] = COMPRESSORS[name]()
+    return _instances[name]
@@ -43,4 +43,24 @@ def on_receive(func):
             res.ack()
 
         func(err, msg)
-    return wrapper_decorator
\ No newline at end of file
+    return wrapper_decorator
+
+def on_receive_batch(func):
+    """Process batches of responses from either Kafka or PubSub to the same format (list of Message objects)
+    """
+    @functools.wraps(func)
+    def wrapper_decorator(*args):
+        errors, msgs = [], []
+        if len(args)==2: # Kafka
+            results, _ = args
+            for res in results:
+                if res.error():
+                    errors.append(res.error())
+                else:
+                    msgs.append(Message.from_kafka(res))
+        else: # PubSub, acknowledged by the subscriber once the batch has been processed
+            results = args[0]
+            msgs = [Message.from_PS(res) for res in results]
+
+        func(errors or None, msgs)
+    return wrapper_decorator
@@ -9,6 +9,8 @@ class SenderInterface(metaclass=abc.ABCMeta):
                 callable(subclass.create_topic) and
                 hasattr(subclass, 'list_topics') and 
                 callable(subclass.list_topics) and
+                hasattr(subclass, 'poll') and 
+                callable(subclass.poll) and
                 hasattr(subclass, 'flush') and 
                 callable(subclass.flush) 
                 or NotImplemented)
@@ -25,6 +27,10 @@ class SenderInterface(metaclass=abc.ABCMeta):
     def list_topics(self):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def poll(self, timeout):
+        raise NotImplementedError
+
     @abc.abstractmethod
     def flush(self):
         raise NotImplementedError
@@ -33,8 +39,12 @@ class ReceiverInterface(metaclass=abc.ABCMeta):
     def __subclasshook__(cls, subclass):
         return (hasattr(subclass, 'receive') and 
                 callable(subclass.receive) and 
+                hasattr(subclass, 'receive_batch') and 
+                callable(subclass.receive_batch) and 
                 hasattr(subclass, 'subscribe') and 
                 callable(subclass.subscribe) and 
+                hasattr(subclass, 'stop') and 
+                callable(subclass.stop) and 
                 hasattr(subclass, 'close') and 
                 callable(subclass.close)  
                 or NotImplemented)
@@ -43,10 +53,50 @@ class ReceiverInterface(metaclass=abc.ABCMeta):
     def receive(self, timeout, callback):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def receive_batch(self, callback, max_messages, max_wait, stop_on_eof):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def stop(self):
+        raise NotImplementedError
+
     @abc.abstractmethod
     def subscribe(self, topic):
         raise NotImplementedError
     
     @abc.abstractmethod
     def close(self):
+        raise NotImplementedError
+class CodecInterface(metaclass=abc.ABCMeta):
+    @classmethod
+    def __subclasshook__(cls, subclass):
+        return (hasattr(subclass, 'encode') and
+                callable(subclass.encode) and
+                hasattr(subclass, 'decode') and
+                callable(subclass.decode)
+                or NotImplemented)
+
+    @abc.abstractmethod
+    def encode(self, array):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def decode(self, payload):
+        raise NotImplementedError
+class CompressorInterface(metaclass=abc.ABCMeta):
+    @classmethod
+    def __subclasshook__(cls, subclass):
+        return (hasattr(subclass, 'compress') and
+                callable(subclass.compress) and
+                hasattr(subclass, 'decompress') and
+                callable(subclass.decompress)
+                or NotImplemented)
+
+    @abc.abstractmethod
+    def compress(self, payload):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def decompress(self, payload):
         raise NotImplementedError
\ No newline at end of file
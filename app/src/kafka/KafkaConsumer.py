@@ -1,33 +1,104 @@
+from threading import Event
 from confluent_kafka import Consumer
 from src.interfaces import ReceiverInterface
+from src.kafka.OffsetTracker import OffsetTracker
 
 class KafkaConsumer(ReceiverInterface):
     """Kafka Consumer for consuming messages from a Kafka broker.
+    The offsets of the messages are committed in batches once the callback has returned (enable.auto.commit should be false),
+    or with auto_ack false once the application acknowledges them with ack, for callbacks handing the messages over to other threads.
 
     Attributes:
         _conf (object): Configuration object
         _consumer (Consumer): Consumer object
+        _stop (Event): Set to stop consuming
+        _assigned (set): Assigned (topic, partition)
+        _eof (set): Assigned (topic, partition) that reached PARTITION_EOF since their last message
+        _offsets (OffsetTracker): Processed offsets, committed in batches
+        auto_ack (bool): Mark the messages processed once the callback returns, otherwise only when acknowledged with ack
     """ 
-    def __init__(self, conf):
+    def __init__(self, conf, commit_every=1000, commit_interval=5.0, auto_ack=True):
         self._conf = conf
-        self._consumer = Consumer(conf)
+        self.auto_ack = auto_ack
+        self._consumer = self._create_consumer(conf)
+        self._offsets = OffsetTracker(self._consumer, commit_every=commit_every, commit_interval=commit_interval)
+        self._stop = Event()
+        self._assigned = set()
+        self._eof = set()
+        self._on_assign = None
+        self._on_revoke = None
 
-    def subscribe(self, topic, callback=None):
+    def _create_consumer(self, conf):
+        """Creates the underlying client
+
+        Args:
+            conf (object): Configuration object
+
+        Returns:
+            Consumer: Consumer object
+        """
+        return Consumer(conf)
+
+    def subscribe(self, topic, callback=None, on_revoke=None):
         """Subscribe to a topic
 
         Args:
             topic (str): Topic name
-            callback (fn(*args), optional): Callback to be called on_assign of topic partition. Defaults to None.
+            callback (fn(consumer, partitions), optional): Callback to be called on_assign of topic partition. Defaults to None.
+            on_revoke (fn(consumer, partitions), optional): Callback to be called on_revoke of topic partition. Defaults to None.
         """        
         if not isinstance(topic, list):
             topic = [topic]
-        self._consumer.subscribe(topic)
+        self._on_assign = callback
+        self._on_revoke = on_revoke
+        self._consumer.subscribe(topic, on_assign=self._assign, on_revoke=self._revoke)
+
+    def _assign(self, consumer, partitions):
+        self._assigned |= {(p.topic, p.partition) for p in partitions}
+        self._offsets.assign([(p.topic, p.partition) for p in partitions])
+        if self._on_assign:
+            self._on_assign(consumer, partitions)
+
+    def _revoke(self, consumer, partitions):
+        if self._on_revoke:
+            self._on_revoke(consumer, partitions)
+        revoked = {(p.topic, p.partition) for p in partitions}
+        self._offsets.revoke(revoked)
+        self._assigned -= revoked
+        self._eof -= revoked
+
+    def _reached_eof(self, res):
+        """Tracks PARTITION_EOF events and new messages per partition
+
+        Args:
+            res (Message): Consumed message or event
+
+        Returns:
+            bool: Whether res is a PARTITION_EOF event
+        """
+        tp = (res.topic(), res.partition())
+        if res.error() and res.error().code() == -191: # PARTITION_EOF, needs to be set in the configuration!
+            self._eof.add(tp)
+            return True
+        self._eof.discard(tp)
+        return False
+
+    def _drained(self):
+        """Whether every assigned partition reached PARTITION_EOF, i.e. there are no new messages to read
+        """
+        return bool(self._assigned) and self._eof >= self._assigned
 
     def close(self):
-        """Closes consumer connection.
+        """Commits the processed offsets and closes consumer connection.
         """        
+        self._offsets.commit()
         self._consumer.close()
 
+    def stop(self):
+        """Stops consuming, making the running receive or receive_batch return
+        """
+        self._stop.set()
+
     def receive(self, callback, timeout=None):
         """Consumes message from Kafka broker from the subscribed topic
 
@@ -38,15 +109,54 @@ class KafkaConsumer(ReceiverInterface):
         polling = True
         res = None
         if not timeout: timeout=0
-        while polling:
+        while polling and not self._stop.is_set():
+            self._offsets.maybe_commit()
             res = self._consumer.poll(timeout=timeout)
-            if res and res.error():
-                if res.error().code() == -191: # Stops polling when reaching PARTITION_EOF, no new messages to read. Need to set it in the configuration!
+            if res is None:
+                continue
+            if self._reached_eof(res):
+                if self._drained(): # Stops polling when every assigned partition reached PARTITION_EOF
                     print("PARTITION_EOF")
                     break
-            if res is None:
                 continue
             callback(res, 0) #TODO: see config rd_kafka_conf_set_consume_cb()
+            if self.auto_ack:
+                self._offsets.processed([res])
+
+    def receive_batch(self, callback, max_messages=100, max_wait=1.0, stop_on_eof=True):
+        """Consumes batches of messages from Kafka broker from the subscribed topic
+
+        Args:
+            callback (fn(*args)): Batch processing callback, called with the list of consumed messages
+            max_messages (int, optional): Maximum number of messages per batch. Defaults to 100.
+            max_wait (float, optional): Maximum time to block waiting for a full batch. Defaults to 1.0.
+            stop_on_eof (bool, optional): Stop when every assigned partition reached PARTITION_EOF, otherwise consume until stopped. Defaults to True.
+        """
+        polling = True
+        while polling and not self._stop.is_set():
+            batch = []
+            for res in self._consumer.consume(num_messages=max_messages, timeout=max_wait):
+                if not self._reached_eof(res):
+                    batch.append(res)
+            # Stops polling after this batch when every assigned partition reached PARTITION_EOF
+            polling = not (stop_on_eof and self._drained())
+            if batch:
+                callback(batch, 0)
+                if self.auto_ack:
+                    self._offsets.processed(batch)
+            self._offsets.maybe_commit()
+        if not polling:
+            print("PARTITION_EOF")
+
+    def ack(self, topic, partition, offset):
+        """Acknowledges a message processed by the application, its offset is committed with the next batch. Thread-safe
+
+        Args:
+            topic (str): Topic of the message
+            partition (int): Partition of the message
+            offset (int): Offset of the message
+        """
+        self._offsets.ack(topic, partition, offset)
 
     def unsubscribe(self, topic, callback=None):
         pass
\ No newline at end of file
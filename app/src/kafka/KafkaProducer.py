@@ -2,6 +2,7 @@ import json
 from confluent_kafka import Producer
 
 from src.kafka.KafkaAdmin import KafkaAdmin
+from src.TopicRegistry import TopicRegistry
 from src.interfaces import SenderInterface
 
 class KafkaProducer(SenderInterface):
@@ -11,11 +12,24 @@ class KafkaProducer(SenderInterface):
             _prod_conf (object): Producer configuration object
             _admin_con (obj): Admin configuration object, needed to create topics
             _producer (Producer): Producer object
+            _topics (TopicRegistry): Cached topic metadata
     """         
-    def __init__(self, conf):
+    def __init__(self, conf, metadata_ttl=30.0):
         self._prod_conf = conf
         self._admin_conf = None
-        self._producer = Producer(self._prod_conf)
+        self._producer = self._create_producer(self._prod_conf)
+        self._topics = TopicRegistry(fetch=self.list_topics, ttl=metadata_ttl)
+
+    def _create_producer(self, conf):
+        """Creates the underlying client
+
+        Args:
+            conf (object): Configuration object
+
+        Returns:
+            Producer: Producer object
+        """
+        return Producer(conf)
 
     def send(self, topic, msg, callback=None):
         """Sends message to topic
@@ -28,15 +42,29 @@ class KafkaProducer(SenderInterface):
         Raises:
             Exception: Topic does not exist
         """        
-        if topic not in self.list_topics():
+        if topic not in self._topics:
             raise Exception(f"Topic '{topic}' does not exist, aborting send")
         
-        self._producer.produce(topic, 
-                                key=msg.key, 
-                                value=msg.value,
-                                on_delivery=callback)
+        while True:
+            try:
+                self._producer.produce(topic, 
+                                        key=msg.key, 
+                                        value=msg.value,
+                                        headers=msg.headers or None,
+                                        on_delivery=callback)
+                break
+            except BufferError: # Local queue is full, serve delivery reports to make room
+                self._producer.poll(0.1)
         self._producer.poll(0)
 
+    def poll(self, timeout=0):
+        """Serves the delivery callbacks of the produced messages
+
+        Args:
+            timeout (float, optional): Maximum time to block waiting for delivery reports. Defaults to 0.
+        """
+        self._producer.poll(timeout)
+
     def flush(self):
         """Wait for all messages in the Producer queue to be delivered.
         """
@@ -61,6 +89,7 @@ class KafkaProducer(SenderInterface):
             for topic, f in futures.items():
                 try:
                     f.result()
+                    self._topics.add(topic)
                     yield None, topic
                 except Exception as e:
                     yield e, topic
@@ -0,0 +1,111 @@
+import time
+from threading import Lock
+from confluent_kafka import TopicPartition
+
+class OffsetTracker:
+    """Offset tracker. Keeps the next offset to read of every partition whose messages have been processed,
+    marked by the consumer once its callback returns, or acknowledged by the application one by one, and commits them in batches: asynchronously once commit_every messages are uncommitted or commit_interval seconds have passed,
+    synchronously on close and rebalance. A restart replays at most the uncommitted messages (at-least-once delivery).
+
+        Attributes:
+            commit_every (int): Uncommitted messages triggering a commit, None to only commit on the timer
+            commit_interval (float): Seconds between commits while there are uncommitted messages, None to only commit by count
+            _consumer (Consumer): Consumer committing the offsets
+            _offsets (dict): Next offset to read by processed (topic, partition), not committed yet
+            _acked (dict): Highest next offset to read by processed (topic, partition), offsets never move backwards
+            _assigned (set): Assigned (topic, partition), acknowledgements of other partitions are ignored
+            _uncommitted (int): Messages processed since the last commit
+            _last_commit (float): Time of the last commit
+    """
+    def __init__(self, consumer, commit_every=1000, commit_interval=5.0):
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self._consumer = consumer
+        self._offsets = {}
+        self._acked = {}
+        self._assigned = set()
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+        self._lock = Lock()
+
+    def processed(self, results):
+        """Marks messages as processed, to be called once the callback has returned
+
+        Args:
+            results (list): Consumed messages, errors are skipped
+        """
+        with self._lock:
+            for res in results:
+                if res.error():
+                    continue
+                self._mark((res.topic(), res.partition()), res.offset())
+
+    def ack(self, topic, partition, offset):
+        """Marks a message as processed once the application is done with it, from any thread.
+        Messages of partitions that have been revoked since they were consumed are ignored, the new owner reads them again
+
+        Args:
+            topic (str): Topic of the message
+            partition (int): Partition of the message
+            offset (int): Offset of the message
+        """
+        with self._lock:
+            if (topic, partition) in self._assigned:
+                self._mark((topic, partition), offset)
+
+    def _mark(self, tp, offset):
+        if offset + 1 > self._acked.get(tp, -1):
+            self._acked[tp] = self._offsets[tp] = offset + 1
+        self._uncommitted += 1
+
+    def assign(self, partitions):
+        """Tracks newly assigned partitions
+
+        Args:
+            partitions (list): Assigned (topic, partition)
+        """
+        with self._lock:
+            self._assigned |= set(partitions)
+
+    def maybe_commit(self):
+        """Commits asynchronously if enough messages are uncommitted or the commit interval has passed
+        """
+        if not self._uncommitted:
+            return
+        due = self.commit_every is not None and self._uncommitted >= self.commit_every
+        due = due or (self.commit_interval is not None and time.monotonic() - self._last_commit >= self.commit_interval)
+        if due:
+            self.commit(asynchronous=True)
+
+    def commit(self, partitions=None, asynchronous=False):
+        """Commits the processed offsets
+
+        Args:
+            partitions (list, optional): (topic, partition) to commit, None for all. Defaults to None.
+            asynchronous (bool, optional): Return without waiting for the broker. Defaults to False.
+        """
+        with self._lock:
+            tps = list(self._offsets) if partitions is None else [tp for tp in partitions if tp in self._offsets]
+            offsets = [TopicPartition(topic, partition, self._offsets.pop((topic, partition))) for topic, partition in tps]
+            if partitions is None or not self._offsets:
+                self._uncommitted = 0
+            self._last_commit = time.monotonic()
+        if not offsets:
+            return
+        try:
+            self._consumer.commit(offsets=offsets, asynchronous=asynchronous)
+        except Exception as e:
+            print(f"Failed to commit offsets: {e}")
+
+    def revoke(self, partitions):
+        """Commits synchronously the processed offsets of revoked partitions, before another consumer takes them over
+
+        Args:
+            partitions (list): Revoked (topic, partition)
+        """
+        with self._lock:
+            self._assigned -= set(partitions)
+        self.commit(partitions=partitions)
+        with self._lock:
+            for tp in partitions:
+                self._acked.pop(tp, None)
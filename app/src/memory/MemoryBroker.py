@@ -0,0 +1,368 @@
+import time
+import uuid
+import zlib
+from threading import Condition, Lock
+
+PARTITION_EOF = -191
+
+class MemoryTopicPartition:
+    """Topic partition handed to the rebalance callbacks, mirroring confluent_kafka.TopicPartition.
+
+        Attributes:
+            topic (str): Topic name
+            partition (int): Partition
+            offset (int): Next offset to read
+    """
+    def __init__(self, topic, partition, offset=-1001):
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+
+class BrokerError:
+    """Error reported by the in-memory broker, mirroring confluent_kafka.KafkaError.
+
+        Attributes:
+            _code (int): Error code
+            _str (str): Description
+    """
+    def __init__(self, code, description):
+        self._code = code
+        self._str = description
+
+    def code(self):
+        return self._code
+
+    def str(self):
+        return self._str
+
+    def __str__(self):
+        return self._str
+
+class MemoryRecord:
+    """Record stored in the in-memory broker, mirroring confluent_kafka.Message.
+
+        Attributes:
+            _topic (str): Topic name
+            _partition (int): Partition
+            _offset (int): Offset in the partition
+            _key (bytes): Key
+            _value (bytes): Value
+            _headers (list): (key, bytes value) headers, None if there are none
+            _error (BrokerError): Error, for events such as PARTITION_EOF
+    """
+    def __init__(self, topic, partition, offset, key=None, value=None, headers=None, error=None):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._headers = headers
+        self._error = error
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def headers(self):
+        return self._headers
+
+    def error(self):
+        return self._error
+
+class MemoryBroker:
+    """In-process message broker. Topics are lists of partitions, each an append-only list of records.
+    Consumers in the same group split the partitions of the topics they subscribe to, and resume from the group's committed offsets.
+
+        Attributes:
+            cond (Condition): Guards the broker state, notified when records are appended or the groups rebalance
+            _topics (dict): Partitions of each topic
+            _committed (dict): Committed offset by (group, topic, partition)
+            _members (dict): Subscribed topics of each member, by group
+            _assignments (dict): Assigned (topic, partition) of each member, by group
+            _generation (int): Incremented on every rebalance
+    """
+    _instances = {}
+    _instances_lock = Lock()
+
+    def __init__(self):
+        self.cond = Condition()
+        self._topics = {}
+        self._committed = {}
+        self._members = {}
+        self._assignments = {}
+        self._generation = 0
+
+    @classmethod
+    def get(cls, name="default"):
+        """Returns the broker registered under name, creating it if needed
+
+        Args:
+            name (str, optional): Broker name. Defaults to "default".
+
+        Returns:
+            MemoryBroker: Broker
+        """
+        with cls._instances_lock:
+            if name not in cls._instances:
+                cls._instances[name] = cls()
+            return cls._instances[name]
+
+    def create_topic(self, topic, partitions=1):
+        """Creates a topic
+
+        Args:
+            topic (str): Topic name
+            partitions (int, optional): # Partitions. Defaults to 1.
+
+        Raises:
+            Exception: Topic already exists
+        """
+        with self.cond:
+            if topic in self._topics:
+                raise Exception(f"Topic '{topic}' already exists")
+            self._topics[topic] = [[] for _ in range(partitions)]
+            self._rebalance()
+
+    def list_topics(self):
+        with self.cond:
+            return list(self._topics)
+
+    def append(self, topic, key, value, headers):
+        """Appends a record to the partition of its key, or to a random one if it has no key
+
+        Returns:
+            MemoryRecord: Stored record
+        """
+        with self.cond:
+            partitions = self._topics[topic]
+            if key is not None:
+                partition = zlib.crc32(key) % len(partitions)
+            else:
+                partition = uuid.uuid4().int % len(partitions)
+            record = MemoryRecord(topic, partition, len(partitions[partition]), key, value, headers)
+            partitions[partition].append(record)
+            self.cond.notify_all()
+            return record
+
+    def fetch(self, topic, partition, offset, max_records):
+        """Reads records from a partition, starting at offset
+
+        Returns:
+            list: Records
+        """
+        with self.cond:
+            return self._topics[topic][partition][offset:offset+max_records]
+
+    def end_offset(self, topic, partition):
+        with self.cond:
+            return len(self._topics[topic][partition])
+
+    def join(self, group, member, topics):
+        with self.cond:
+            self._members.setdefault(group, {})[member] = list(topics)
+            self._rebalance()
+
+    def leave(self, group, member):
+        with self.cond:
+            self._members.get(group, {}).pop(member, None)
+            self._rebalance()
+
+    def assignment(self, group, member):
+        """Returns the partitions currently assigned to a group member
+
+        Returns:
+            int, list: Rebalance generation and assigned (topic, partition)
+        """
+        with self.cond:
+            return self._generation, self._assignments.get(group, {}).get(member, [])
+
+    def commit(self, group, topic, partition, offset):
+        with self.cond:
+            self._committed[(group, topic, partition)] = offset
+
+    def committed(self, group, topic, partition):
+        """Returns the committed offset of a partition for a group, None if nothing has been committed
+        """
+        with self.cond:
+            return self._committed.get((group, topic, partition))
+
+    def _rebalance(self):
+        # Round-robin the partitions of each topic over the group members subscribed to it
+        self._generation += 1
+        for group, members in self._members.items():
+            assignments = {member: [] for member in members}
+            for topic, partitions in self._topics.items():
+                subscribed = sorted(m for m, topics in members.items() if topic in topics)
+                for partition in range(len(partitions)):
+                    if subscribed:
+                        assignments[subscribed[partition % len(subscribed)]].append((topic, partition))
+            self._assignments[group] = assignments
+        self.cond.notify_all()
+
+class _TopicMetadata:
+    def __init__(self, topics):
+        self.topics = {topic: None for topic in topics}
+
+class MemoryProducerClient:
+    """Producer client of the in-memory broker, mirroring confluent_kafka.Producer.
+    Delivery callbacks are queued and served by poll() and flush(), as in librdkafka.
+
+        Attributes:
+            _broker (MemoryBroker): Broker
+            _deliveries (list): Pending (callback, record)
+    """
+    def __init__(self, conf):
+        self._broker = MemoryBroker.get(conf.get("broker", "default"))
+        self._deliveries = []
+        self._lock = Lock()
+
+    def produce(self, topic, key=None, value=None, headers=None, on_delivery=None):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        if isinstance(headers, dict):
+            headers = [(k, v.encode("utf-8") if isinstance(v, str) else v) for k, v in headers.items()]
+        record = self._broker.append(topic, key, value, headers)
+        if on_delivery:
+            with self._lock:
+                self._deliveries.append((on_delivery, record))
+
+    def poll(self, timeout=0):
+        with self._lock:
+            deliveries, self._deliveries = self._deliveries, []
+        for callback, record in deliveries:
+            callback(None, record)
+        return len(deliveries)
+
+    def flush(self, timeout=None):
+        self.poll()
+        return 0
+
+    def list_topics(self, timeout=-1):
+        return _TopicMetadata(self._broker.list_topics())
+
+    def __len__(self):
+        return len(self._deliveries)
+
+class MemoryConsumerClient:
+    """Consumer client of the in-memory broker, mirroring confluent_kafka.Consumer.
+    Rebalance callbacks are called from consume() and poll(), with the partitions added to or removed from the assignment.
+
+        Attributes:
+            _broker (MemoryBroker): Broker
+            _group (str): Consumer group
+            _member (str): Member ID in the group
+            _reset (str): Where to start when the group has no committed offset, "smallest" or "largest"
+            _eof (bool): Whether to report PARTITION_EOF events
+            _positions (dict): Next offset to read, by assigned (topic, partition)
+            _eof_sent (set): Partitions whose EOF has been reported since their last record
+            _on_assign (fn(consumer, partitions)): Called with the newly assigned partitions
+            _on_revoke (fn(consumer, partitions)): Called with the revoked partitions, before they are dropped
+    """
+    def __init__(self, conf):
+        self._broker = MemoryBroker.get(conf.get("broker", "default"))
+        self._group = conf.get("group.id", "default")
+        self._member = uuid.uuid4().hex
+        topic_conf = conf.get("default.topic.config", {})
+        self._reset = conf.get("auto.offset.reset", topic_conf.get("auto.offset.reset", "smallest"))
+        self._eof = conf.get("enable.partition.eof", False)
+        self._positions = {}
+        self._eof_sent = set()
+        self._generation = None
+        self._next = 0
+        self._on_assign = None
+        self._on_revoke = None
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        self._on_assign = on_assign
+        self._on_revoke = on_revoke
+        self._broker.join(self._group, self._member, topics)
+
+    def close(self):
+        self._broker.leave(self._group, self._member)
+
+    def commit(self, offsets=None, asynchronous=True):
+        # Commits the given TopicPartition offsets, or the current positions
+        if offsets is None:
+            offsets = [MemoryTopicPartition(topic, partition, offset) for (topic, partition), offset in self._positions.items()]
+        for tp in offsets:
+            self._broker.commit(self._group, tp.topic, tp.partition, tp.offset)
+
+    def _sync_assignment(self):
+        # Called without holding the broker lock, the callbacks may wait on threads producing to the broker
+        generation, assigned = self._broker.assignment(self._group, self._member)
+        if generation == self._generation:
+            return False
+        revoked = [tp for tp in self._positions if tp not in assigned]
+        if revoked and self._on_revoke:
+            self._on_revoke(self, [MemoryTopicPartition(*tp, self._positions[tp]) for tp in revoked])
+        added = [tp for tp in assigned if tp not in self._positions]
+        positions = {}
+        for topic, partition in assigned:
+            if (topic, partition) in self._positions:
+                positions[(topic, partition)] = self._positions[(topic, partition)]
+                continue
+            offset = self._broker.committed(self._group, topic, partition)
+            if offset is None:
+                offset = 0 if self._reset in ("smallest", "earliest", "beginning") else self._broker.end_offset(topic, partition)
+            positions[(topic, partition)] = offset
+        self._positions = positions
+        self._eof_sent &= set(positions)
+        self._generation = generation
+        if added and self._on_assign:
+            self._on_assign(self, [MemoryTopicPartition(*tp, positions[tp]) for tp in added])
+        return True
+
+    def _fetch(self, num_messages):
+        out = []
+        assigned = list(self._positions)
+        # Rotate the starting partition so that a busy partition doesn't starve the others
+        for i in range(len(assigned)):
+            tp = assigned[(self._next + i) % len(assigned)]
+            records = self._broker.fetch(*tp, self._positions[tp], num_messages - len(out))
+            if records:
+                self._positions[tp] += len(records)
+                self._eof_sent.discard(tp)
+                out.extend(records)
+            if self._eof and tp not in self._eof_sent and self._positions[tp] == self._broker.end_offset(*tp):
+                out.append(MemoryRecord(*tp, self._positions[tp], error=BrokerError(PARTITION_EOF, "Broker: No more messages")))
+                self._eof_sent.add(tp)
+            if len(out) >= num_messages:
+                break
+        self._next += 1
+        return out
+
+    def consume(self, num_messages=1, timeout=-1):
+        # As in librdkafka, returns once num_messages have been read or timeout has expired
+        deadline = None if timeout is None or timeout < 0 else time.monotonic() + timeout
+        out = []
+        while True:
+            if self._sync_assignment():
+                # As librdkafka, drops the records of revoked partitions still to be returned
+                out = [res for res in out if (res.topic(), res.partition()) in self._positions]
+            with self._broker.cond:
+                if self._broker.assignment(self._group, self._member)[0] != self._generation:
+                    continue # Rebalanced in the meantime
+                out.extend(self._fetch(num_messages - len(out)))
+                if len(out) >= num_messages:
+                    return out
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return out
+                self._broker.cond.wait(remaining)
+
+    def poll(self, timeout=-1):
+        records = self.consume(num_messages=1, timeout=timeout)
+        return records[0] if records else None
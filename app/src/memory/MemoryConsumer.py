@@ -0,0 +1,8 @@
+from src.kafka.KafkaConsumer import KafkaConsumer
+from src.memory.MemoryBroker import MemoryConsumerClient
+
+class MemoryConsumer(KafkaConsumer):
+    """In-memory Consumer for consuming messages from an in-process broker, with the same semantics as the Kafka backend.
+    """
+    def _create_consumer(self, conf):
+        return MemoryConsumerClient(conf)
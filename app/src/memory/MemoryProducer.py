@@ -0,0 +1,33 @@
+from src.kafka.KafkaProducer import KafkaProducer
+from src.memory.MemoryBroker import MemoryBroker, MemoryProducerClient
+
+class MemoryProducer(KafkaProducer):
+    """In-memory Producer for producing messages to an in-process broker, with the same semantics as the Kafka backend.
+
+        Attributes:
+            _broker (MemoryBroker): Broker
+            _partitions (int): # Partitions of the created topics
+    """
+    def __init__(self, conf, metadata_ttl=30.0):
+        self._broker = MemoryBroker.get(conf.get("broker", "default"))
+        self._partitions = conf.get("num_partitions", 1)
+        super().__init__(conf, metadata_ttl=metadata_ttl)
+
+    def _create_producer(self, conf):
+        return MemoryProducerClient(conf)
+
+    def create_topic(self, topic):
+        """Creates topic
+
+        Args:
+            topic (str): Topic name
+
+        Yields:
+            err, topic: Yields error if there is and a Topic name
+        """
+        try:
+            self._broker.create_topic(topic, partitions=self._partitions)
+            self._topics.add(topic)
+            yield None, topic
+        except Exception as e:
+            yield e, topic
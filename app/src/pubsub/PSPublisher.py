@@ -1,7 +1,9 @@
 from google.cloud import pubsub_v1
 from concurrent import futures
+from threading import Lock
 
 from src.interfaces import SenderInterface
+from src.TopicRegistry import TopicRegistry
 
 class PSPublisher(SenderInterface):
     """PubSub Publisher for sending messages to a PubSub broker.
@@ -11,15 +13,18 @@ class PSPublisher(SenderInterface):
         _publisher (PublisherClient): Publisher object
         _project_id (str): GC compliant Project ID
         _project_path (str): GC compliant Project path
-        futures (list): List of futures from sent messages
+        futures (set): Futures of the sent messages still pending
+        _topics (TopicRegistry): Cached topic metadata (topic paths)
     """
-    def __init__(self, conf):
+    def __init__(self, conf, metadata_ttl=30.0):
         self._conf = conf
         self._project_id = self._conf['project_id']
         self._project_path = f"projects/{self._project_id}"
 
         self._publisher = pubsub_v1.PublisherClient()
-        self.futures = []
+        self.futures = set()
+        self._futures_lock = Lock()
+        self._topics = TopicRegistry(fetch=self.list_topics, ttl=metadata_ttl)
 
     def send(self, topic, msg, callback=None):
         """Sends messages to a PubSub topic.
@@ -34,18 +39,37 @@ class PSPublisher(SenderInterface):
         """        
         topic_path = self._publisher.topic_path(self._project_id, topic)
         
-        if topic_path not in self.list_topics():
+        if topic_path not in self._topics:
             raise Exception(f"Topic '{topic}' does not exist, aborting send")
         
-        future = self._publisher.publish(topic_path, msg.toJSON().encode("utf8"))
-        future.add_done_callback(callback)
+        if msg.codec: # Binary payload, key and headers travel as attributes
+            future = self._publisher.publish(topic_path, msg.value, key=msg.key, **msg.headers)
+        else:
+            future = self._publisher.publish(topic_path, msg.toJSON().encode("utf8"))
+        with self._futures_lock:
+            self.futures.add(future)
+        future.add_done_callback(self._discard)
+        if callback:
+            future.add_done_callback(callback)
 
-        self.futures.append(future)
+    def poll(self, timeout=0):
+        """No-op, delivery callbacks are called by the publisher futures as soon as they resolve
+
+        Args:
+            timeout (float, optional): Unused. Defaults to 0.
+        """
+        pass
 
     def flush(self):
         """Wait for all messages in the Publisher queue to be delivered.
         """    
-        futures.wait(self.futures, return_when=futures.ALL_COMPLETED)
+        with self._futures_lock:
+            pending = list(self.futures)
+        futures.wait(pending, return_when=futures.ALL_COMPLETED)
+
+    def _discard(self, future):
+        with self._futures_lock:
+            self.futures.discard(future)
 
     def list_topics(self):
         """Lists topic in broker
@@ -67,6 +91,7 @@ class PSPublisher(SenderInterface):
         topic_path = self._publisher.topic_path(self._project_id, topic)
         try:
             topic = self._publisher.create_topic(name=topic_path)
+            self._topics.add(topic.name)
             yield None, topic.name
         except Exception as e:
             yield e, topic_path
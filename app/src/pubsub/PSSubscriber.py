@@ -1,5 +1,7 @@
 from google.cloud import pubsub_v1
+from google.api_core.exceptions import DeadlineExceeded
 import uuid
+from threading import Event
 
 from src.interfaces import ReceiverInterface
 
@@ -12,6 +14,7 @@ class PSSubscriber(ReceiverInterface):
         _project_id (str): GC compliant Project ID
         _project_path (str): GC compliant Project path
         _sub_id (str): GC compliant Subscription ID
+        _stop (Event): Set to stop receiving
     """
     def __init__(self, conf):
         self._conf = conf
@@ -20,6 +23,8 @@ class PSSubscriber(ReceiverInterface):
         self._sub_id = self._conf['subscriber_id_prefix']+"-"+uuid.uuid4().hex[:4]
         self._subscriber = pubsub_v1.SubscriberClient()
         self.futures = []
+        self._stop = Event()
+        self._future = None
 
     def subscribe(self, topic, type="pull", callback=None):
         """Subscribes to topic
@@ -42,6 +47,13 @@ class PSSubscriber(ReceiverInterface):
         """Close the underlying channel to release socket resources.
         """
         self._subscriber.close()
+
+    def stop(self):
+        """Stops receiving, making the running receive or receive_batch return
+        """
+        self._stop.set()
+        if self._future is not None:
+            self._future.cancel()
     
     def receive(self, callback, timeout=None):
         """Consumes message from PubSub broker from the subscribed topic
@@ -52,6 +64,7 @@ class PSSubscriber(ReceiverInterface):
         """
         
         future = self._subscriber.subscribe(subscription=self.subscription_path, callback=callback)
+        self._future = future
         #self.futures.append(future)
         try: # TODO: delegate error handling to Receiver.receive, move result() to a flush method
             future.result(timeout=timeout)
@@ -60,6 +73,33 @@ class PSSubscriber(ReceiverInterface):
             future.cancel()
             future.result()
 
+    def receive_batch(self, callback, max_messages=100, max_wait=1.0, stop_on_eof=True):
+        """Pulls batches of messages from PubSub broker from the subscribed topic, by default until a pull returns no messages.
+        Each batch is acknowledged once the callback returns.
+
+        Args:
+            callback (fn(*args)): Batch processing callback, called with the list of pulled messages
+            max_messages (int, optional): Maximum number of messages per batch. Defaults to 100.
+            max_wait (float, optional): Maximum time to block waiting for a batch. Defaults to 1.0.
+            stop_on_eof (bool, optional): Stop when a pull returns no messages, otherwise pull until stopped. Defaults to True.
+        """
+        while not self._stop.is_set():
+            try:
+                response = self._subscriber.pull(
+                    request={"subscription": self.subscription_path, "max_messages": max_messages},
+                    timeout=max_wait)
+            except DeadlineExceeded:
+                response = None
+            if not response or not response.received_messages:
+                if stop_on_eof:
+                    break
+                continue
+
+            callback([res.message for res in response.received_messages])
+            self._subscriber.acknowledge(
+                request={"subscription": self.subscription_path,
+                         "ack_ids": [res.ack_id for res in response.received_messages]})
+
     def unsubscribe(self, topic, callback=None):
         pass
 
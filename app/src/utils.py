@@ -1,13 +1,18 @@
 import os
 import gzip
+import hashlib
+import struct
+import tempfile
 import numpy as np
 from json import JSONEncoder
 
-def load_mnist(path):
+def load_mnist(path, cache=True):
     """Load MNIST from path
 
     Args:
         path (str): Path where the archive is saved
+        cache (bool, optional): Decompress the archive once to .npy files and memory-map them, see cache_idx,
+                                otherwise read the whole archive in memory. Defaults to True.
 
     Returns:
         images (mp.ndarray), labels (np.ndarray): examples and labels 
@@ -17,6 +22,14 @@ def load_mnist(path):
     images_path = os.path.join(path,
                             't10k-images-idx3-ubyte.gz')
 
+    if cache:
+        try:
+            labels = np.load(cache_idx(labels_path), mmap_mode='r')
+            images = np.load(cache_idx(images_path), mmap_mode='r')
+            return images.reshape(len(labels), 784), labels
+        except OSError as e:
+            print(f"Failed to cache the dataset, loading it in memory: {e}")
+
     with gzip.open(labels_path, 'rb') as lbpath:
         labels = np.frombuffer(lbpath.read(), dtype=np.uint8,
                             offset=8)
@@ -27,6 +40,75 @@ def load_mnist(path):
 
     return images, labels
 
+def cache_paths(idx_path):
+    """Candidate .npy cache paths of a gzipped IDX file: next to it, and under the temporary directory
+    for archives in read-only directories, in a subdirectory named after the directory of the archive
+
+    Args:
+        idx_path (str): Path of the .gz IDX file
+
+    Returns:
+        list: Paths of the .npy file, in order of preference
+    """
+    name = os.path.basename(idx_path)
+    name = (name[:-len('.gz')] if name.endswith('.gz') else name) + '.npy'
+    archive_dir = os.path.dirname(os.path.abspath(idx_path))
+    fallback_dir = os.path.join(tempfile.gettempdir(), 'mnist-cache', hashlib.sha1(archive_dir.encode('utf-8')).hexdigest()[:16])
+    return [os.path.join(archive_dir, name), os.path.join(fallback_dir, name)]
+
+def cache_idx(idx_path, chunk_size=1024*1024):
+    """Decompresses a gzipped IDX (uint8) file to a .npy file, unless it's already there and up to date.
+    The .npy file is written next to the archive, or under the temporary directory when that fails (see cache_paths).
+    The archive is streamed to the .npy file, without holding it in memory.
+
+    Args:
+        idx_path (str): Path of the .gz IDX file
+        chunk_size (int, optional): Bytes decompressed at a time. Defaults to 1MB.
+
+    Raises:
+        Exception: Not a uint8 IDX file
+        OSError: The .npy file couldn't be written anywhere
+
+    Returns:
+        str: Path of the .npy file
+    """
+    npy_paths = cache_paths(idx_path)
+    for npy_path in npy_paths:
+        if os.path.exists(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(idx_path):
+            return npy_path
+
+    for npy_path in npy_paths:
+        try:
+            os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+            _write_npy(idx_path, npy_path, chunk_size)
+            return npy_path
+        except OSError as e:
+            error = e
+    raise error
+
+def _write_npy(idx_path, npy_path, chunk_size):
+    tmp_path = npy_path + '.tmp'
+    try:
+        with gzip.open(idx_path, 'rb') as file:
+            # Magic number: 2 zero bytes, data type (0x08 for uint8) and number of dimensions, followed by the big-endian dimensions
+            _, dtype, ndim = struct.unpack('>HBB', file.read(4))
+            if dtype != 0x08:
+                raise Exception(f"Unsupported IDX data type {dtype:#x} in {idx_path}")
+            shape = struct.unpack(f'>{ndim}I', file.read(4 * ndim))
+
+            out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=shape)
+            flat = out.reshape(-1)
+            for start in range(0, flat.size, chunk_size):
+                chunk = file.read(min(chunk_size, flat.size - start))
+                flat[start:start+len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+            out.flush()
+            del flat, out
+        # Renamed once complete, an interrupted run doesn't leave a truncated cache behind
+        os.replace(tmp_path, npy_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 def preprocess_images(x):
     """Preprocess images for usage by casting to float and reshaping them as CWH
 
@@ -52,6 +134,32 @@ def get_batch(x, batch_size):
     """    
     return np.split(x, np.arange(batch_size, len(x), batch_size))
 
+def iter_batches(x, batch_size):
+    """Lazily splits images in batches, as views of x. Unlike get_batch, no array is built before it's needed,
+    and batches of a memory-mapped x are only read from disk when used.
+
+    Args:
+        x (np.ndarray): Images
+        batch_size (int): Batch size
+
+    Yields:
+        np.ndarray: Batch of images (with remainder)
+    """
+    for start in range(0, len(x), batch_size):
+        yield x[start:start+batch_size]
+
+def get_topic_encoding(topic_conf, field):
+    """Extracts a per-topic encoding setting from the topic configuration
+
+    Args:
+        topic_conf (dict): Topic configuration, with the settings under "encoding", e.g. {"encoding": {"model-input": {"codec": "raw"}}}
+        field (str): Setting name, e.g. "codec"
+
+    Returns:
+        dict: Setting value per topic
+    """
+    return {topic: enc[field] for topic, enc in topic_conf.get("encoding", {}).items() if field in enc}
+
 class NumpyArrayEncoder(JSONEncoder):
     """Numpy Encoder to JSON for serialization
     """    
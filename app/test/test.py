@@ -1,11 +1,132 @@
+import asyncio
+import gzip
+import json
+import os
+import struct
+import tempfile
+import time
 import unittest
-from unittest.mock import MagicMock
+import uuid
+from threading import Event, Lock, current_thread
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from src.codecs import CODECS, get_codec
+from src.compression import COMPRESSORS
+from src.Message import Message
+from src.TopicRegistry import TopicRegistry
+from src.kafka.KafkaConsumer import KafkaConsumer
+from src.decorators import on_delivery, on_receive_batch
+from src.InferenceWorker import InferenceWorker
+from src.InferenceClient import InferenceClient
+from src.AsyncSender import AsyncSender
+from src.AsyncReceiver import AsyncReceiver
+from src.InFlightWindow import InFlightWindow
+from src.Sender import Sender
+from src.Receiver import Receiver
+from src.utils import load_mnist, cache_idx, iter_batches, get_batch
+from src.ConsumerPool import ConsumerPool
+from src.memory.MemoryBroker import MemoryBroker, MemoryRecord, MemoryTopicPartition
 
 class TestKafkaProducer(unittest.TestCase):
     pass
 
+def _kafka_message(key, value, error_code=None, partition=0, offset=0):
+    res = MagicMock()
+    res.topic.return_value = "model-input"
+    res.partition.return_value = partition
+    res.offset.return_value = offset
+    res.key.return_value = key.encode("utf-8")
+    res.value.return_value = value.encode("utf-8")
+    res.headers.return_value = None
+    if error_code is None:
+        res.error.return_value = None
+    else:
+        res.error.return_value.code.return_value = error_code
+    return res
+
+class TestInFlightWindow(unittest.TestCase):
+    def test_limits(self):
+        window = InFlightWindow(max_messages=2, max_bytes=100)
+        self.assertTrue(window.acquire(10, block=False))
+        self.assertFalse(window.acquire(95, block=False))
+        self.assertTrue(window.acquire(90, block=False))
+        self.assertFalse(window.acquire(0, block=False))
+        window.release(10)
+        window.release(90)
+        self.assertEqual((0, 0), (window.messages, window.bytes))
+
+    def test_oversized_message_when_empty(self):
+        window = InFlightWindow(max_messages=2, max_bytes=100)
+        self.assertTrue(window.acquire(1000, block=False))
+
+    @patch("src.Sender.KafkaProducer")
+    def test_sender_waits_for_deliveries(self, producer_cls):
+        pending = []
+        producer_cls.return_value.send.side_effect = lambda topic, msg, callback: pending.append(callback)
+        def poll(timeout):
+            while pending:
+                pending.pop()(None, MagicMock())
+        producer_cls.return_value.poll.side_effect = poll
+
+        sender = Sender(conf={}, to="kafka", max_in_flight=3)
+        for i in range(10):
+            self.assertTrue(sender.send("model-input", Message(key=str(i), value="x"), callback=None))
+            self.assertLessEqual(sender._window.messages, 3)
+        self.assertEqual(10, producer_cls.return_value.send.call_count)
+
+    def test_encoded_size(self):
+        array = np.zeros((2, 1, 28, 28), dtype=np.float32)
+        for codec in CODECS:
+            with self.subTest(codec=codec):
+                msg = Message.from_ndarray(key="ab", array=array, codec=codec)
+                self.assertEqual(2 + len(bytes(msg.buffer)), Sender._size(msg))
+        self.assertEqual(2 + 4, Sender._size(Message(key="ab", value="éé"))) # UTF-8 bytes, not characters
+        msg = Message(key="ab", value={"Hello": "World"})
+        self.assertEqual(len(msg.toJSON().encode("utf-8")), Sender._size(msg))
+
+def _assign(consumer_cls, partitions):
+    # Assigns the partitions of model-input on subscribe
+    def subscribe(topics, on_assign, on_revoke):
+        on_assign(consumer_cls.return_value, [MemoryTopicPartition("model-input", p) for p in partitions])
+    consumer_cls.return_value.subscribe.side_effect = subscribe
+
 class TestKafkaReceiver(unittest.TestCase):
-    pass
+    @patch("src.kafka.KafkaConsumer.Consumer")
+    def test_receive_batch(self, consumer_cls):
+        _assign(consumer_cls, [0])
+        consumer_cls.return_value.consume.side_effect = [
+            [_kafka_message("a", "1"), _kafka_message("b", "2")],
+            [_kafka_message("c", "3"), _kafka_message("", "", error_code=-191)],
+        ]
+        batches = []
+
+        @on_receive_batch
+        def callback(err, msgs):
+            self.assertIsNone(err)
+            batches.append([msg.key for msg in msgs])
+
+        receiver = KafkaConsumer(conf={})
+        receiver.subscribe("model-input")
+        receiver.receive_batch(callback=callback, max_messages=2, max_wait=0.1)
+        self.assertEqual([["a", "b"], ["c"]], batches)
+        consumer_cls.return_value.consume.assert_called_with(num_messages=2, timeout=0.1)
+
+    @patch("src.kafka.KafkaConsumer.Consumer")
+    def test_drained_when_every_partition_reached_eof(self, consumer_cls):
+        _assign(consumer_cls, [0, 1])
+        consumer_cls.return_value.poll.side_effect = [
+            _kafka_message("a", "1", partition=0),
+            _kafka_message("", "", error_code=-191, partition=0),
+            _kafka_message("b", "2", partition=1),
+            _kafka_message("", "", error_code=-191, partition=1),
+        ]
+        keys = []
+        receiver = KafkaConsumer(conf={})
+        receiver.subscribe("model-input")
+        receiver.receive(callback=lambda res, _: keys.append(res.key().decode("utf-8")))
+        self.assertEqual(["a", "b"], keys)
 
 class TestPSPublisher(unittest.TestCase):
     pass
@@ -13,5 +134,554 @@ class TestPSPublisher(unittest.TestCase):
 class TestPSSubscriber(unittest.TestCase):
     pass
 
+class TestCodecs(unittest.TestCase):
+    def setUp(self):
+        self.array = np.random.rand(2, 1, 28, 28).astype("float32")
+
+    def test_roundtrip(self):
+        for name in CODECS:
+            with self.subTest(codec=name):
+                codec = get_codec(name)
+                decoded = codec.decode(codec.encode(self.array))
+                self.assertEqual(self.array.shape, decoded.shape)
+                np.testing.assert_allclose(self.array, decoded)
+
+    def test_zero_copy_decode(self):
+        for name in ["raw", "npy"]:
+            with self.subTest(codec=name):
+                payload = get_codec(name).encode(self.array)
+                decoded = get_codec(name).decode(payload)
+                self.assertFalse(decoded.flags.owndata)
+                self.assertEqual(self.array.dtype, decoded.dtype)
+
+    def test_raw_big_endian(self):
+        array = np.arange(6, dtype=">i4").reshape(2, 3)
+        codec = get_codec("raw")
+        np.testing.assert_array_equal(array, codec.decode(codec.encode(array)))
+
+class TestMessage(unittest.TestCase):
+    def test_kafka_binary_roundtrip(self):
+        array = np.ones((1, 1, 28, 28), dtype="float32")
+        msg = Message.from_ndarray(key="abcd", array=array, codec="raw")
+
+        res = MagicMock()
+        res.key.return_value = msg.key.encode("utf-8")
+        res.value.return_value = msg.value
+        res.headers.return_value = [(k, v.encode("utf-8")) for k, v in msg.headers.items()]
+
+        received = Message.from_kafka(res)
+        self.assertEqual("raw", received.codec)
+        np.testing.assert_array_equal(array, received.to_ndarray())
+
+    def test_compressed_roundtrip(self):
+        array = np.zeros((4, 1, 28, 28), dtype="float32")
+        array[:, :, 10:14, 10:14] = 1
+        for name in COMPRESSORS:
+            with self.subTest(compression=name):
+                msg = Message.from_ndarray(key="abcd", array=array, codec="raw", compression=name)
+                self.assertEqual(name, msg.compression)
+                self.assertLess(len(msg.value), array.nbytes // 10)
+                np.testing.assert_array_equal(array, Message(key="abcd", value=msg.value, headers=msg.headers).to_ndarray())
+
+    def test_stack_ndarrays(self):
+        msgs = [Message.from_ndarray(key=str(i), array=np.full((1, 1, 28, 28), i, dtype="float32"), codec="raw") for i in range(3)]
+        batch = Message.stack_ndarrays(msgs)
+        self.assertEqual((3, 1, 28, 28), batch.shape)
+        np.testing.assert_array_equal([0, 1, 2], batch[:, 0, 0, 0])
+
+    def test_kafka_text(self):
+        res = MagicMock()
+        res.key.return_value = b"abcd"
+        res.value.return_value = b"Hello"
+        res.headers.return_value = None
+
+        received = Message.from_kafka(res)
+        self.assertIsNone(received.codec)
+        self.assertEqual("Hello", received.value)
+
+    def test_lazy_zero_copy(self):
+        array = np.arange(16, dtype="float32").reshape(2, 8)
+        payload = Message.from_ndarray(key="abcd", array=array, codec="raw")
+        record = MemoryRecord("model-input", 0, 0, key=b"abcd", value=payload.value,
+                              headers=[(k, v.encode("utf-8")) for k, v in payload.headers.items()])
+
+        received = Message.from_kafka(record)
+        self.assertFalse(hasattr(received, "__dict__"))
+        self.assertIsNone(received._key) # Not decoded until accessed
+        self.assertEqual("abcd", received.key)
+        self.assertIs(record.value(), received.value)
+        decoded = received.to_ndarray()
+        np.testing.assert_array_equal(array, decoded)
+        self.assertTrue(np.shares_memory(np.frombuffer(record.value(), dtype="uint8"), decoded))
+        self.assertTrue(np.shares_memory(np.frombuffer(received.buffer, dtype="uint8"), decoded))
+
+    def test_to_json(self):
+        msg = Message(key="abcd", value="Hello", headers={"trace": "1"})
+        self.assertEqual({"key": "abcd", "value": "Hello"}, json.loads(msg.toJSON()))
+        self.assertEqual({"key": "abcd", "value": "Hello", "headers": {"trace": "1"}}, json.loads(msg.toJSON(headers=True)))
+
+    def test_lazy_from_ps(self):
+        payload = MagicMock(attributes={}, data=Message(key="abcd", value=[[1, 2]]).toJSON().encode("utf-8"))
+        with patch("src.Message.json.loads", wraps=json.loads) as loads:
+            received = Message.from_PS(payload)
+            loads.assert_not_called() # Not parsed until accessed
+            self.assertEqual("abcd", received.key)
+            self.assertEqual([[1, 2]], received.value)
+            self.assertEqual({}, received.headers)
+        loads.assert_called_once()
+        received = Message.from_PS(payload)
+        received.key = "efgh"
+        self.assertEqual(("efgh", [[1, 2]]), (received.key, received.value))
+
+def _write_idx(path, array):
+    with gzip.open(path, 'wb') as file:
+        file.write(struct.pack(f'>HBB{array.ndim}I', 0, 0x08, array.ndim, *array.shape))
+        file.write(array.tobytes())
+
+class TestDatasetCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.images = np.random.randint(0, 256, (10, 28, 28), dtype=np.uint8)
+        self.labels = np.arange(10, dtype=np.uint8)
+        _write_idx(os.path.join(self.dir.name, 't10k-images-idx3-ubyte.gz'), self.images)
+        _write_idx(os.path.join(self.dir.name, 't10k-labels-idx1-ubyte.gz'), self.labels)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_memory_mapped(self):
+        images, labels = load_mnist(self.dir.name)
+        self.assertIsInstance(images.base, np.memmap)
+        np.testing.assert_array_equal(self.images.reshape(10, 784), images)
+        np.testing.assert_array_equal(self.labels, labels)
+        np.testing.assert_array_equal(images, load_mnist(self.dir.name, cache=False)[0])
+
+    def test_cache_reused(self):
+        npy_path = cache_idx(os.path.join(self.dir.name, 't10k-labels-idx1-ubyte.gz'), chunk_size=3)
+        np.testing.assert_array_equal(self.labels, np.load(npy_path))
+        mtime = os.path.getmtime(npy_path)
+        self.assertEqual(npy_path, cache_idx(os.path.join(self.dir.name, 't10k-labels-idx1-ubyte.gz')))
+        self.assertEqual(mtime, os.path.getmtime(npy_path))
+
+    def test_read_only_fallback(self):
+        replace = os.replace
+        def replace_outside(src, dst): # The archive directory can't be written to
+            if os.path.dirname(dst) == self.dir.name:
+                raise PermissionError(f"Read-only: {dst}")
+            replace(src, dst)
+
+        with tempfile.TemporaryDirectory() as tmp_dir, patch("src.utils.tempfile.gettempdir", return_value=tmp_dir):
+            with patch("src.utils.os.replace", side_effect=replace_outside):
+                npy_path = cache_idx(os.path.join(self.dir.name, 't10k-labels-idx1-ubyte.gz'))
+            self.assertTrue(npy_path.startswith(tmp_dir))
+            np.testing.assert_array_equal(self.labels, np.load(npy_path))
+            self.assertEqual(["t10k-images-idx3-ubyte.gz", "t10k-labels-idx1-ubyte.gz"], sorted(os.listdir(self.dir.name)))
+            # Found there by later runs
+            self.assertEqual(npy_path, cache_idx(os.path.join(self.dir.name, 't10k-labels-idx1-ubyte.gz')))
+
+            # Loaded in memory when no cache can be written
+            with patch("src.utils.os.replace", side_effect=PermissionError("Read-only")):
+                images, labels = load_mnist(self.dir.name)
+            self.assertNotIsInstance(images.base, np.memmap)
+            np.testing.assert_array_equal(self.images.reshape(10, 784), images)
+
+    def test_iter_batches(self):
+        images, _ = load_mnist(self.dir.name)
+        batches = list(iter_batches(images, 4))
+        self.assertEqual([4, 4, 2], [len(batch) for batch in batches])
+        for batch, split in zip(batches, get_batch(images, 4)):
+            np.testing.assert_array_equal(split, batch)
+            self.assertTrue(np.shares_memory(images, batch))
+
+class TestTopicRegistry(unittest.TestCase):
+    def setUp(self):
+        self.fetch = MagicMock(return_value=["model-input"])
+        self.registry = TopicRegistry(fetch=self.fetch, ttl=60)
+
+    def tearDown(self):
+        self.registry.close()
+
+    def test_cached_lookup(self):
+        for _ in range(10):
+            self.assertIn("model-input", self.registry)
+        self.fetch.assert_called_once()
+
+    def test_miss_refreshes(self):
+        self.assertIn("model-input", self.registry)
+        self.fetch.return_value = ["model-input", "model-output"]
+        self.assertIn("model-output", self.registry)
+        self.assertEqual(2, self.fetch.call_count)
+
+    def test_add(self):
+        self.assertIn("model-input", self.registry)
+        self.registry.add("model-output")
+        self.assertIn("model-output", self.registry)
+        self.fetch.assert_called_once()
+
+class TestInferenceWorker(unittest.TestCase):
+    def setUp(self):
+        self.app = MagicMock()
+        self.app.topics = {"topic_in": "model-input", "topic_out": "model-output"}
+        self.model = MagicMock()
+        self.model.predict.side_effect = lambda x: x[:, 0, 0, 0].astype(int)
+        self.worker = InferenceWorker(self.app, self.model, max_batch_size=8)
+
+    def test_single_model_batch(self):
+        sizes = {"a": 1, "b": 3, "c": 2}
+        msgs = [Message.from_ndarray(key=k, array=np.full((n, 1, 28, 28), n, dtype="float32"), codec="raw") for k, n in sizes.items()]
+
+        self.worker._process(None, msgs)
+
+        self.model.predict.assert_called_once()
+        self.assertEqual((6, 1, 28, 28), self.model.predict.call_args[0][0].shape)
+        sent = {c.kwargs["msg"].key: c.kwargs["msg"].value for c in self.app.sender.send.call_args_list}
+        self.assertEqual(sizes.keys(), sent.keys())
+        for key, n in sizes.items():
+            np.testing.assert_array_equal(np.full(n, n), sent[key])
+
+    def _results(self):
+        results = {}
+        for c in self.app.sender.send.call_args_list:
+            msg = c.kwargs["msg"]
+            try:
+                results[msg.key] = Message(key=msg.key, value=msg.value).to_ndarray()
+            except Exception as e:
+                results[msg.key] = e
+        return results
+
+    def test_malformed_request(self):
+        msgs = [Message.from_ndarray(key="a", array=np.ones((1, 1, 28, 28), dtype="float32"), codec="raw"),
+                Message.from_ndarray(key="b", array=np.ones((1, 28, 28), dtype="float32"), codec="raw"),
+                Message(key="c", value="not an array")]
+        self.worker._process(None, msgs)
+
+        results = self._results()
+        np.testing.assert_array_equal([1], results["a"])
+        # The others get an error result, which fails their request on the client
+        for key in ["b", "c"]:
+            with self.subTest(key=key):
+                self.assertIsInstance(results[key], Exception)
+
+    def test_failed_batch_retried_per_request(self):
+        def predict(x):
+            if (x == 2).any():
+                raise Exception("Model failed")
+            return x[:, 0, 0, 0].astype(int)
+        self.model.predict.side_effect = predict
+        msgs = [Message.from_ndarray(key=str(n), array=np.full((1, 1, 28, 28), n, dtype="float32"), codec="raw") for n in range(1, 4)]
+        self.worker._process(None, msgs)
+
+        results = self._results()
+        np.testing.assert_array_equal([1], results["1"])
+        self.assertIsInstance(results["2"], Exception)
+        np.testing.assert_array_equal([3], results["3"])
+
+    def test_serves_until_stopped(self):
+        self.worker.start()
+        self.assertFalse(self.app.receiver.receive_batch.call_args.kwargs["stop_on_eof"])
+        self.worker.stop()
+        self.app.receiver.stop.assert_called_once()
+        self.app.sender.flush.assert_called_once()
+
+class TestInferenceClient(unittest.TestCase):
+    def setUp(self):
+        self.app = MagicMock()
+        self.app.topics = {"topic_in": "model-input", "topic_out": "model-output"}
+        self.client = InferenceClient(self.app, max_outstanding=2, timeout=0.2)
+        self.client.start()
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_resolve_by_key(self):
+        futures = {key: self.client.submit(np.zeros((1, 1, 28, 28)), key=key) for key in ["a", "b"]}
+        results = [Message(key="c", value=np.array([9])), Message(key="b", value=np.array([2])), Message(key="a", value=np.array([1]))]
+        self.client._on_results(None, results)
+
+        self.assertEqual([1], futures["a"].result(timeout=1).tolist())
+        self.assertEqual([2], futures["b"].result(timeout=1).tolist())
+        self.assertEqual(2, self.app.sender.send.call_count)
+
+    def test_timeout(self):
+        future = self.client.submit(np.zeros((1, 1, 28, 28)))
+        with self.assertRaises(TimeoutError):
+            future.result(timeout=1)
+
+    def test_max_outstanding(self):
+        self.client.submit(np.zeros(1))
+        self.client.submit(np.zeros(1))
+        with self.assertRaises(Exception):
+            self.client.submit(np.zeros(1), block=False)
+        # Doesn't block the event loop waiting for a slot
+        with self.assertRaises(Exception):
+            asyncio.run(self.client.predict_async(np.zeros(1)))
+
+    def test_send_failure(self):
+        client = InferenceClient(self.app, max_outstanding=1, timeout=None)
+        self.app.sender.send.return_value = False
+        future = client.submit(np.zeros(1))
+        with self.assertRaises(Exception):
+            future.result(timeout=1)
+        # The slot is released
+        self.app.sender.send.return_value = True
+        self.assertFalse(client.submit(np.zeros(1), block=False).done())
+
+    def test_duplicate_key(self):
+        future = self.client.submit(np.zeros(1), key="a")
+        with self.assertRaises(Exception):
+            self.client.submit(np.zeros(1), key="a")
+        self.assertFalse(future.done())
+        # The key can be reused once its request is done, and its slot is released
+        future.cancel()
+        self.client.submit(np.zeros(1), key="a")
+        self.client.submit(np.zeros(1), key="b")
+
+    def test_reused_key_deadline(self):
+        first = self.client.submit(np.zeros(1), key="a")
+        self.client._on_results(None, [Message(key="a", value=np.array([1]))])
+        self.assertEqual([1], first.result(timeout=1).tolist())
+        time.sleep(0.1)
+        second = self.client.submit(np.zeros(1), key="a")
+        # Past the deadline of the first request, not of the second
+        time.sleep(0.15)
+        self.assertFalse(second.done())
+        with self.assertRaises(TimeoutError):
+            second.result(timeout=1)
+
+class TestAsyncAdapters(unittest.TestCase):
+    @patch("src.Sender.KafkaProducer")
+    def test_send_completes_on_delivery(self, producer_cls):
+        delivered = []
+        producer_cls.return_value.send.side_effect = lambda topic, msg, callback: delivered.append((callback, msg))
+        def poll(timeout):
+            while delivered:
+                callback, msg = delivered.pop()
+                res = MagicMock()
+                res.key.return_value = msg.key.encode("utf-8")
+                callback(None, res)
+        producer_cls.return_value.poll.side_effect = poll
+
+        async def run():
+            sender = AsyncSender(conf={}, to="kafka", poll_interval=0.01)
+            ids = await asyncio.gather(*[sender.send("model-input", Message(key=str(i), value="x")) for i in range(5)])
+            await sender.close()
+            return ids
+
+        self.assertEqual([str(i) for i in range(5)], asyncio.run(run()))
+
+    @patch("src.Receiver.KafkaConsumer")
+    def test_async_iteration(self, consumer_cls):
+        def receive_batch(callback, max_messages, max_wait, stop_on_eof):
+            for i in range(0, 10, max_messages):
+                callback([_kafka_message(str(j), "v") for j in range(i, i+max_messages)], 0)
+        consumer_cls.return_value.receive_batch.side_effect = receive_batch
+
+        async def run():
+            receiver = AsyncReceiver(conf={}, _from="kafka", max_buffered=3, max_messages=5)
+            keys = [msg.key async for msg in receiver]
+            await receiver.close()
+            return keys
+
+        self.assertEqual([str(i) for i in range(10)], asyncio.run(run()))
+
+class TestMemoryBroker(unittest.TestCase):
+    def setUp(self):
+        self.broker = uuid.uuid4().hex
+        self.receiver_conf = {"broker": self.broker, "group.id": "test", "auto.offset.reset": "smallest", "enable.partition.eof": True}
+        self.sender = Sender(conf={"broker": self.broker, "num_partitions": 1}, to="memory")
+        for err, _ in self.sender._sender.create_topic("model-input"):
+            self.assertIsNone(err)
+
+    def _send(self, n, sender=None, topic="model-input"):
+        sender = sender or self.sender
+        delivered = []
+        @on_delivery
+        def callback(err, msg_id):
+            self.assertIsNone(err)
+            delivered.append(msg_id)
+        for i in range(n):
+            sender.send(topic, Message.from_ndarray(key=str(i), array=np.full((1, 2), i), codec="raw"), callback=callback)
+        sender.flush()
+        return delivered
+
+    def _receive(self, receiver, topic="model-input"):
+        received = []
+        @on_receive_batch
+        def callback(err, msgs):
+            received.extend(msgs)
+        receiver.subscribe(topic)
+        receiver.receive_batch(max_messages=4, max_wait=0.1, callback=callback)
+        receiver._thread.join()
+        return received
+
+    def test_delivery_and_consume(self):
+        self.assertEqual([str(i) for i in range(10)], self._send(10))
+        received = self._receive(Receiver(conf=self.receiver_conf, _from="memory"))
+        self.assertEqual([str(i) for i in range(10)], [msg.key for msg in received])
+        for msg in received:
+            np.testing.assert_array_equal(np.full((1, 2), int(msg.key)), msg.to_ndarray())
+
+    def test_consumer_group_split(self):
+        sender = Sender(conf={"broker": self.broker, "num_partitions": 2}, to="memory")
+        list(sender._sender.create_topic("model-output"))
+        self._send(20, sender=sender, topic="model-output")
+
+        first = Receiver(conf=self.receiver_conf, _from="memory")
+        second = Receiver(conf=self.receiver_conf, _from="memory")
+        second.subscribe("model-output")
+        keys = [msg.key for msg in self._receive(first, "model-output")] + [msg.key for msg in self._receive(second, "model-output")]
+        self.assertEqual(sorted(str(i) for i in range(20)), sorted(keys))
+
+    def test_committed_offsets(self):
+        self._send(5)
+        receiver = Receiver(conf=self.receiver_conf, _from="memory")
+        self.assertEqual(5, len(self._receive(receiver)))
+        receiver._receiver._consumer.commit()
+        receiver._receiver.close()
+
+        self._send(3)
+        self.assertEqual(3, len(self._receive(Receiver(conf=self.receiver_conf, _from="memory"))))
+
+    def test_batched_commits(self):
+        self._send(10)
+        receiver = Receiver(conf=self.receiver_conf, _from="memory", commit_every=4, commit_interval=None)
+        self.assertEqual(10, len(self._receive(receiver)))
+        broker = MemoryBroker.get(self.broker)
+        # Committed after the first two batches of 4, the last 2 messages are still uncommitted
+        self.assertEqual(8, broker.committed("test", "model-input", 0))
+        receiver._receiver.close()
+        self.assertEqual(10, broker.committed("test", "model-input", 0))
+
+    def test_restart_resumes_from_committed_offsets(self):
+        self._send(5)
+        receiver = Receiver(conf=self.receiver_conf, _from="memory")
+        self.assertEqual(5, len(self._receive(receiver)))
+        receiver.close()
+
+        self._send(3)
+        self.assertEqual(3, len(self._receive(Receiver(conf=self.receiver_conf, _from="memory"))))
+
+    def test_commit_on_revoke(self):
+        sender = Sender(conf={"broker": self.broker, "num_partitions": 2}, to="memory")
+        list(sender._sender.create_topic("model-output"))
+        self._send(20, sender=sender, topic="model-output")
+        first = Receiver(conf=self.receiver_conf, _from="memory", commit_interval=None)
+        self._receive(first, "model-output")
+        # A second member takes one of the partitions over, from the offset processed by the first one
+        second = Receiver(conf=self.receiver_conf, _from="memory")
+        second.subscribe("model-output")
+        first._receiver._consumer.consume(num_messages=1, timeout=0)
+        broker = MemoryBroker.get(self.broker)
+        (topic, partition), = broker.assignment("test", second._receiver._consumer._member)[1]
+        self.assertEqual(broker.end_offset(topic, partition), broker.committed("test", topic, partition))
+
+    def test_async_receiver_commits_acked_messages(self):
+        self._send(10)
+        async def run():
+            receiver = AsyncReceiver(conf=self.receiver_conf, _from="memory", max_buffered=100, max_messages=10)
+            receiver.subscribe("model-input")
+            keys = []
+            async for msg in receiver:
+                keys.append(msg.key)
+                if len(keys) == 4: # Stops while handling the 4th message, the rest is only buffered
+                    break
+            await receiver.close()
+            return keys
+
+        self.assertEqual(["0", "1", "2", "3"], asyncio.run(run()))
+        # Only the messages the loop is done with are committed, the 4th one is delivered again
+        self.assertEqual(3, MemoryBroker.get(self.broker).committed("test", "model-input", 0))
+        received = self._receive(Receiver(conf=self.receiver_conf, _from="memory"))
+        self.assertEqual([str(i) for i in range(3, 10)], [msg.key for msg in received])
+
+    def test_receive_drains_every_partition(self):
+        sender = Sender(conf={"broker": self.broker, "num_partitions": 4}, to="memory")
+        list(sender._sender.create_topic("model-output"))
+        self._send(20, sender=sender, topic="model-output")
+        received = self._receive(Receiver(conf=self.receiver_conf, _from="memory"), "model-output")
+        self.assertEqual(sorted(str(i) for i in range(20)), sorted(msg.key for msg in received))
+
+class TestConsumerPool(unittest.TestCase):
+    def setUp(self):
+        self.broker = uuid.uuid4().hex
+        self.receiver_conf = {"broker": self.broker, "group.id": "test", "auto.offset.reset": "smallest", "enable.partition.eof": True}
+        self.sender = Sender(conf={"broker": self.broker, "num_partitions": 4}, to="memory")
+        list(self.sender._sender.create_topic("model-input"))
+        # 5 keys, 10 messages each, sequence number as value
+        for seq in range(10):
+            for key in "abcde":
+                self.sender.send("model-input", Message.from_ndarray(key=key, array=np.array([seq]), codec="raw"), callback=None)
+        self.sender.flush()
+
+    def _pool(self, received, num_workers=3):
+        lock = Lock()
+        def callback(err, msg):
+            self.assertIsNone(err)
+            with lock:
+                received.setdefault(msg.key, []).append((current_thread().name, int(msg.to_ndarray()[0])))
+        return ConsumerPool(Receiver(conf=self.receiver_conf, _from="memory"), callback, num_workers=num_workers, max_messages=7, max_wait=0.1)
+
+    def test_per_key_order(self):
+        received = {}
+        pool = self._pool(received)
+        pool.subscribe("model-input")
+        pool.start()
+        pool.close()
+        self.assertEqual(set("abcde"), set(received))
+        for key, processed in received.items():
+            self.assertEqual(list(range(10)), [seq for _, seq in processed])
+            self.assertEqual(1, len({thread for thread, _ in processed}))
+
+    def test_partitions_spread_over_workers(self):
+        pool = self._pool({}, num_workers=2)
+        pool.subscribe("model-input")
+        pool.start()
+        pool.close()
+        self.assertEqual(4, len(pool._partitions))
+        self.assertEqual([2, 2], [list(pool._partitions.values()).count(i) for i in range(2)])
+
+    def test_pipelined_dispatch(self):
+        processed, blocked_msg, blocked, release = [], [], Event(), Event()
+        def callback(err, msg):
+            if msg.key == "a" and not blocked.is_set():
+                blocked_msg.append(msg)
+                blocked.set()
+                release.wait()
+            processed.append(msg)
+        pool = ConsumerPool(Receiver(conf=self.receiver_conf, _from="memory"), callback, num_workers=3, max_messages=7, max_wait=0.1)
+        pool.subscribe("model-input")
+        pool.start()
+        # A busy worker doesn't hold back the others, nor the consumption of the next batches
+        deadline = time.monotonic() + 5
+        while sum(queue.qsize() for queue in pool._queues) + len(processed) + 1 < 50 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(50, sum(queue.qsize() for queue in pool._queues) + len(processed) + 1)
+        # The offsets of the partition of the blocked message are only committed up to it
+        pool.receiver._receiver._offsets.commit()
+        broker = MemoryBroker.get(self.broker)
+        topic, partition, offset = blocked_msg[0].source
+        self.assertGreaterEqual(offset, broker.committed("test", topic, partition) or 0)
+        release.set()
+        pool.close()
+        self.assertEqual(50, len(processed))
+        for partition in range(4):
+            self.assertEqual(broker.end_offset("model-input", partition), broker.committed("test", "model-input", partition))
+
+    def test_rebalance_revokes_partitions(self):
+        received = {}
+        pool = self._pool(received)
+        pool.subscribe("model-input")
+        pool.start(stop_on_eof=False)
+        # A second member of the group takes half of the partitions
+        other = Receiver(conf=self.receiver_conf, _from="memory")
+        other.subscribe("model-input")
+        other._receiver._consumer.consume(num_messages=1, timeout=0)
+        deadline = time.monotonic() + 5
+        while len(pool._partitions) != 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        pool.stop()
+        pool.close()
+        self.assertEqual(2, len(pool._partitions))
+
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -1,7 +1,7 @@
 import argparse
 import uuid
 import json
-from src.utils import NumpyArrayEncoder, load_mnist, preprocess_images, get_batch
+from src.utils import get_topic_encoding, load_mnist, preprocess_images, iter_batches
 from src.Sender import Sender, send_cb
 from src.Receiver import Receiver, receive_cb
 from src.Message import Message
@@ -13,14 +13,14 @@ parser.add_argument(
     type=str,
     help='Default message broker to send to',
     default='kafka',
-    choices=('kafka', 'pubsub'))
+    choices=('kafka', 'pubsub', 'memory'))
 
 parser.add_argument(
     '--From',
     type=str,
     default='kafka',
     help='Default message broker to receive from',
-    choices=('kafka', 'pubsub'))
+    choices=('kafka', 'pubsub', 'memory'))
 
 parser.add_argument(
     '--sender_conf',
@@ -60,7 +60,10 @@ if __name__ == '__main__':
     with open(args.topic_conf, 'r') as file:
         topic_conf = json.load(file)
 
-    sender = Sender(conf=sender_conf, to=args.To)
+    sender = Sender(conf=sender_conf,
+                    to=args.To,
+                    codecs=get_topic_encoding(topic_conf, "codec"),
+                    compression=get_topic_encoding(topic_conf, "compression"))
 
     if args.To != args.From:
         raise Exception("Message broker FROM and TO have to be the same")
@@ -70,8 +73,8 @@ if __name__ == '__main__':
             admin_conf = json.load(file)
         sender._sender._init_admin_config(conf=admin_conf) # Needed to create topics for Kafka
 
-    for _, val in topic_conf.items():
-        sender.create_topic(val)
+    for topic in (topic_conf['topic_in'], topic_conf['topic_out']):
+        sender.create_topic(topic)
 
     topic_in = topic_conf['topic_in']
 
@@ -86,16 +89,14 @@ if __name__ == '__main__':
 
     ####### Producing data
     x, y = load_mnist('data/')
-    x = preprocess_images(x)
 
     batch_size = 1
-    x_batches = get_batch(x, batch_size)
+    x_batches = iter_batches(x, batch_size)
     print('#### Producer: Sending messages...')
     for i in range(10):
         key = uuid.uuid4().hex[:4]
-        payload = {'ndarray': x_batches[i]}
-        encoded_payload = json.dumps(payload, cls=NumpyArrayEncoder)
-        msg = Message(key=key, value=encoded_payload)
+        # Encoded with the codec configured for the topic
+        msg = Message(key=key, value=preprocess_images(next(x_batches)))
         sender.send(topic=topic_in, msg=msg, callback=send_cb)
 
     sender.flush()
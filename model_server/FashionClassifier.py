@@ -1,36 +1,216 @@
 import onnxruntime as onnxrt
 import numpy as np
 import os
+import time
+from queue import Queue
+from threading import Event, Thread, Lock
+from PredictionCache import PredictionCache
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": onnxrt.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxrt.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxrt.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxrt.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    "sequential": onnxrt.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxrt.ExecutionMode.ORT_PARALLEL,
+}
+
+def _param(value, env, default, cast=str):
+    """Resolves a setting from its Seldon parameter, falling back to the environment variable and then to the default
+
+    Args:
+        value (object): Seldon parameter, None if not set
+        env (str): Environment variable
+        default (object): Default value
+        cast (type, optional): Type of the setting. Defaults to str.
+    """
+    if value is None:
+        value = os.environ.get(env)
+    if value is None:
+        return default
+    if cast is bool and isinstance(value, str):
+        return value.lower() in ("1", "true", "yes")
+    return cast(value)
 
 class FashionClassifier:
-    def __init__(self):
+    def __init__(self, cache_size=None, cache_ttl=None, intra_op_threads=None, inter_op_threads=None, graph_optimization_level=None,
+                 execution_mode=None, enable_cpu_mem_arena=None, enable_mem_pattern=None, session_pool_size=None,
+                 warmup_batch_sizes=None, warmup_iterations=None, health_check_interval=None, model_path=None):
         self.loaded = False
+        self.model_path = _param(model_path, "MODEL_PATH", "model.onnx")
         self.classes = ['T-shirt/top', 'Trouser', 'Pullover', 'Dress', 'Coat', 'Sandal', 'Shirt', 'Sneaker', 'Bag', 'Ankle boot']
         self.model = None
+        # Seldon parameters, falling back to the environment. A cache size of 0 disables the cache, a TTL of 0 never expires
+        cache_size = _param(cache_size, "PREDICTION_CACHE_SIZE", 0, int)
+        cache_ttl = _param(cache_ttl, "PREDICTION_CACHE_TTL", 0, float)
+        self.cache = PredictionCache(max_size=cache_size, ttl=cache_ttl or None) if cache_size > 0 else None
+
+        # ONNX Runtime session options, 0 threads lets ONNX Runtime use one per physical core
+        self.intra_op_threads = _param(intra_op_threads, "ORT_INTRA_OP_THREADS", 0, int)
+        self.inter_op_threads = _param(inter_op_threads, "ORT_INTER_OP_THREADS", 0, int)
+        self.graph_optimization_level = _param(graph_optimization_level, "ORT_GRAPH_OPTIMIZATION_LEVEL", "all")
+        self.execution_mode = _param(execution_mode, "ORT_EXECUTION_MODE", "sequential")
+        self.enable_cpu_mem_arena = _param(enable_cpu_mem_arena, "ORT_ENABLE_CPU_MEM_ARENA", True, bool)
+        self.enable_mem_pattern = _param(enable_mem_pattern, "ORT_ENABLE_MEM_PATTERN", True, bool)
+        self.session_pool_size = max(1, _param(session_pool_size, "ORT_SESSION_POOL_SIZE", 1, int))
+        self._sessions = None
+        self.input_name = None
+        self.output_name = None
+        self.input_dtype = None
+        self.normalized = False
+        self.mean, self.std = 0.445, 0.269
+
+        # Warmup runs each batch size on every session at load, the model isn't ready (loaded) until it's done
+        self.warmup_batch_sizes = [int(size) for size in str(_param(warmup_batch_sizes, "WARMUP_BATCH_SIZES", "1,8,32")).split(",") if size.strip()]
+        self.warmup_iterations = _param(warmup_iterations, "WARMUP_ITERATIONS", 3, int)
+        # Health probes are answered with the result of the last check, refreshed in the background
+        self.health_check_interval = _param(health_check_interval, "HEALTH_CHECK_INTERVAL", 10, float)
+        self._health = None
+        self._health_thread = None
+        self._health_lock = Lock()
+        self._health_stop = Event()
+
+    def session_options(self):
+        if self.graph_optimization_level not in GRAPH_OPTIMIZATION_LEVELS:
+            raise Exception(f"Unsupported graph optimization level '{self.graph_optimization_level}', choose one of {list(GRAPH_OPTIMIZATION_LEVELS)}")
+        if self.execution_mode not in EXECUTION_MODES:
+            raise Exception(f"Unsupported execution mode '{self.execution_mode}', choose one of {list(EXECUTION_MODES)}")
+        options = onnxrt.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization_level]
+        options.execution_mode = EXECUTION_MODES[self.execution_mode]
+        options.enable_cpu_mem_arena = self.enable_cpu_mem_arena
+        options.enable_mem_pattern = self.enable_mem_pattern
+        return options
 
     def load(self):
         print(f"Loading model @{os.getpid()}")
-        self.model = onnxrt.InferenceSession("model.onnx")
-        print("Loaded model")
+        options = self.session_options()
+        # Concurrent requests each take a session from the pool instead of contending on a single one
+        self._sessions = Queue()
+        for _ in range(self.session_pool_size):
+            self._sessions.put(onnxrt.InferenceSession(self.model_path, sess_options=options))
+        self.model = self._sessions.queue[0]
+        self.input_name = self.model.get_inputs()[0].name
+        self.output_name = self.model.get_outputs()[0].name
+        # Models exported by training/export.py normalize their input in the graph, and take raw pixels (uint8) or floats in [0, 1]
+        meta = self.model.get_modelmeta().custom_metadata_map
+        self.normalized = meta.get("preprocessing") == "normalize"
+        self.input_dtype = np.dtype(meta.get("input_dtype", "float32"))
+        # Normalization the model has been trained with, as saved by the export, the ImageNet greyscale one for older models
+        self.mean, self.std = float(meta.get("mean", 0.445)), float(meta.get("std", 0.269))
+        print(f"Loaded model ({self.session_pool_size} sessions, {'normalized ' + str(self.input_dtype) if self.normalized else 'float32'} input)")
+        self.warmup()
+        self._check_health()
+        self.loaded = True
+
+    def warmup(self):
+        # Runs the configured batch sizes on every session, so that the first requests don't pay for the allocations and kernel selection
+        start = time.perf_counter()
+        shape = [dim if isinstance(dim, int) else 1 for dim in self.model.get_inputs()[0].shape[1:]] or [1, 28, 28]
+        dtype = self.input_dtype if self.normalized else np.float32
+        for session in list(self._sessions.queue):
+            for batch_size in self.warmup_batch_sizes:
+                x = np.zeros([batch_size] + shape, dtype=dtype)
+                for _ in range(self.warmup_iterations):
+                    session.run([self.output_name], {self.input_name: x})
+        print(f"Warmed up batch sizes {self.warmup_batch_sizes} in {time.perf_counter() - start:.2f}s")
 
     def predict(self, x, names=None, meta=None):
-        x = self.transform_input(x)
-        onnx_inputs = {self.model.get_inputs()[0].name: x}
-        logits = self.model.run(None, onnx_inputs)[0]
+        if not self.loaded:
+            raise Exception("Model not ready")
+        x = np.asarray(x)
+        if self.cache is None:
+            return self._predict(x)
+
+        # Each input of the batch is looked up separately, only the misses are run through the model
+        keys = [self.cache.key(item) for item in x]
+        preds = [self.cache.get(key) for key in keys]
+        misses = [i for i, pred in enumerate(preds) if pred is None]
+        if misses:
+            for i, pred in zip(misses, self._predict(x[misses])):
+                self.cache.put(keys[i], pred)
+                preds[i] = pred
+        return np.array(preds)
+
+    def _predict(self, x):
+        if self.normalized:
+            x = self.to_model_input(x)
+        else:
+            x = self.transform_input(x)
+        session = self._sessions.get()
+        try:
+            logits = session.run([self.output_name], {self.input_name: x})[0]
+        finally:
+            self._sessions.put(session)
         preds = np.argmax(logits, axis=1)
         preds = self.transform_output(preds)
         return preds
 
+    def to_model_input(self, x):
+        # Models taking raw pixels get the floats in [0, 1] sent by the app scaled back to pixels, instead of truncated to 0 or 1,
+        # and models taking floats in [0, 1] get raw pixels scaled down to them
+        x = np.asarray(x)
+        if self.input_dtype == np.uint8 and x.dtype != np.uint8:
+            return np.clip(np.rint(x * 255), 0, 255).astype(np.uint8)
+        if self.input_dtype != np.uint8 and x.dtype == np.uint8:
+            return x.astype(self.input_dtype) / self.input_dtype.type(255)
+        return np.asarray(x, dtype=self.input_dtype) # No copy if x already has the input dtype
+
     def transform_input(self, x, names=None, meta=None):
-        mean = 255 * 0.1307
-        stdDev = 255 * 0.3081
-        x = (x - mean) / stdDev
-        return x.astype("float32")
+        # Normalization of raw pixels for models exported without it, as in training (ToTensor and Normalize((mean,), (std,)))
+        mean = 255 * self.mean
+        stdDev = 255 * self.std
+        x = np.array(x, dtype="float32")
+        x -= mean
+        x /= stdDev
+        return x
 
     def transform_output(self, y, names=None, meta=None):
         return y
 
+    def metrics(self):
+        # Custom metrics exposed by Seldon
+        if self.cache is None:
+            return []
+        return [
+            {"type": "GAUGE", "key": "prediction_cache_hits", "value": self.cache.hits},
+            {"type": "GAUGE", "key": "prediction_cache_misses", "value": self.cache.misses},
+            {"type": "GAUGE", "key": "prediction_cache_size", "value": len(self.cache)},
+        ]
+
+    def _check_health(self):
+        # Bypasses the prediction cache, so that the model is actually run
+        try:
+            response = self._predict(np.random.rand(*[2, 1, 28, 28]))
+            assert len(response) > 0, "Health Check failed, no response"
+            self._health = (response, None)
+        except Exception as e:
+            self._health = (None, e)
+
+    def _refresh_health(self):
+        while not self._health_stop.wait(self.health_check_interval):
+            self._check_health()
+
+    def close(self):
+        # Stops the background health checks
+        self._health_stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+
     def health_status(self):
-        response = self.predict(np.random.rand(*[2, 1, 28, 28]))
-        assert len(response) > 0, "Health Check failed, no response"
+        if not self.loaded:
+            raise Exception("Model not ready, warming up")
+        # Started on the first probe, in the serving process
+        with self._health_lock:
+            if not self._health_stop.is_set() and (self._health_thread is None or not self._health_thread.is_alive()):
+                self._health_thread = Thread(target=self._refresh_health, daemon=True)
+                self._health_thread.start()
+        response, error = self._health
+        if error is not None:
+            raise error
         return response
\ No newline at end of file
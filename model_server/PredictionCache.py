@@ -0,0 +1,76 @@
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+
+class PredictionCache:
+    """Bounded LRU cache of predictions, keyed by the content of the input: a hash of its bytes, shape and dtype.
+    Entries optionally expire ttl seconds after being stored. Safe to share between threads.
+
+        Attributes:
+            max_size (int): Maximum number of cached predictions
+            ttl (float): Seconds a prediction stays valid, None to never expire
+            hits (int): Lookups served from the cache
+            misses (int): Lookups not in the cache (or expired)
+            _entries (OrderedDict): (prediction, expiry time) by key, least recently used first
+    """
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(x):
+        """Content key of an input
+
+        Args:
+            x (np.ndarray): Input
+
+        Returns:
+            bytes: Key
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{x.dtype.str}{x.shape}".encode("utf-8"))
+        h.update(x.tobytes() if not x.flags.c_contiguous else x.data)
+        return h.digest()
+
+    def get(self, key):
+        """Looks up a prediction, marking it as recently used
+
+        Args:
+            key (bytes): Input key
+
+        Returns:
+            object: Cached prediction, None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, prediction):
+        """Stores a prediction, evicting the least recently used ones beyond max_size
+
+        Args:
+            key (bytes): Input key
+            prediction (object): Prediction
+        """
+        expiry = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (prediction, expiry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
@@ -0,0 +1,168 @@
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+from FashionClassifier import FashionClassifier
+from PredictionCache import PredictionCache
+
+MEAN, STD = 0.445, 0.269
+
+def make_model(path, input_dtype="uint8"):
+    """Writes a linear classifier over the pixels, exported as training/export.py does: normalized in the graph, with its input dtype in the metadata
+
+    Returns:
+        np.ndarray: Weights, 784 x 10, applied to the normalized images
+    """
+    weights = np.random.RandomState(0).randn(784, 10).astype(np.float32)
+    # Normalization folded in a multiply-add, the shift makes the predictions depend on the input scale
+    scale = (1/255 if input_dtype == "uint8" else 1.) / STD
+    graph = helper.make_graph(
+        [
+            helper.make_node("Cast", ["input"], ["cast"], to=TensorProto.FLOAT),
+            helper.make_node("Mul", ["cast", "scale"], ["scaled"]),
+            helper.make_node("Add", ["scaled", "shift"], ["normalized"]),
+            helper.make_node("Flatten", ["normalized"], ["flat"]),
+            helper.make_node("MatMul", ["flat", "weights"], ["logits"]),
+        ],
+        "linear",
+        [helper.make_tensor_value_info("input", TensorProto.UINT8 if input_dtype == "uint8" else TensorProto.FLOAT, ["batch_size", 1, 28, 28])],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["batch_size", 10])],
+        initializer=[numpy_helper.from_array(np.array(scale, dtype=np.float32), "scale"),
+                     numpy_helper.from_array(np.array(-MEAN / STD, dtype=np.float32), "shift"),
+                     numpy_helper.from_array(weights, "weights")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    helper.set_model_props(model, {"preprocessing": "normalize", "input_dtype": input_dtype})
+    onnx.save(model, path)
+    return weights
+
+class PredictionCacheTest(unittest.TestCase):
+    def test_key(self):
+        x = np.arange(4, dtype=np.uint8)
+        self.assertEqual(PredictionCache.key(x), PredictionCache.key(x.copy()))
+        self.assertNotEqual(PredictionCache.key(x), PredictionCache.key(x.astype(np.float32)))
+        self.assertNotEqual(PredictionCache.key(x), PredictionCache.key(x.reshape(2, 2)))
+
+    def test_eviction_order(self):
+        cache = PredictionCache(max_size=2)
+        cache.put(b"a", 1)
+        cache.put(b"b", 2)
+        self.assertEqual(1, cache.get(b"a")) # b is now the least recently used
+        cache.put(b"c", 3)
+        self.assertIsNone(cache.get(b"b"))
+        self.assertEqual((1, 3), (cache.get(b"a"), cache.get(b"c")))
+        self.assertEqual(2, len(cache))
+        self.assertEqual((3, 1), (cache.hits, cache.misses))
+
+    def test_ttl(self):
+        cache = PredictionCache(ttl=10)
+        with mock.patch("PredictionCache.time.monotonic", return_value=100.):
+            cache.put(b"a", 1)
+        with mock.patch("PredictionCache.time.monotonic", return_value=109.):
+            self.assertEqual(1, cache.get(b"a"))
+        with mock.patch("PredictionCache.time.monotonic", return_value=111.):
+            self.assertIsNone(cache.get(b"a"))
+        self.assertEqual(0, len(cache))
+
+class ClassifierTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "model.onnx")
+        self.weights = make_model(self.path)
+        self.pixels = np.random.RandomState(1).randint(0, 256, (16, 1, 28, 28)).astype(np.uint8)
+        self.expected = np.argmax((self.pixels.reshape(16, -1) / 255 - MEAN) / STD @ self.weights, axis=1)
+        # Rescaling the input changes the predictions, a wrong scale is caught
+        self.assertFalse((self.expected == np.argmax((self.pixels.reshape(16, -1) - MEAN) / STD @ self.weights, axis=1)).all())
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _classifier(self, **kwargs):
+        classifier = FashionClassifier(model_path=self.path, warmup_batch_sizes="1", warmup_iterations=1, **kwargs)
+        classifier.load()
+        return classifier
+
+    def test_float_input_to_uint8_model(self):
+        # The app sends floats in [0, 1]
+        classifier = self._classifier()
+        np.testing.assert_array_equal(self.expected, classifier.predict(self.pixels.astype(np.float32) / 255))
+        np.testing.assert_array_equal(self.expected, classifier.predict(self.pixels))
+
+    def test_float_model(self):
+        make_model(self.path, input_dtype="float32")
+        classifier = self._classifier()
+        np.testing.assert_array_equal(self.expected, classifier.predict(self.pixels.astype(np.float32) / 255))
+        # Raw pixels are scaled to [0, 1]
+        np.testing.assert_array_equal(self.expected, classifier.predict(self.pixels))
+
+    def test_cached_batch(self):
+        classifier = self._classifier(cache_size=64)
+        classifier.predict(self.pixels[::2])
+        with mock.patch.object(classifier, "_predict", wraps=classifier._predict) as predict:
+            np.testing.assert_array_equal(self.expected, classifier.predict(self.pixels))
+        # Only the misses, in their order in the batch, are run through the model
+        np.testing.assert_array_equal(self.pixels[1::2], predict.call_args[0][0])
+        self.assertEqual((8, 16), (classifier.cache.hits, classifier.cache.misses))
+        classifier.predict(self.pixels)
+        self.assertEqual(24, classifier.cache.hits)
+
+    def test_not_ready_before_warmup(self):
+        classifier = FashionClassifier(model_path=self.path)
+        with self.assertRaises(Exception):
+            classifier.predict(self.pixels)
+        with self.assertRaises(Exception):
+            classifier.health_status()
+        with mock.patch.object(classifier, "warmup", wraps=classifier.warmup) as warmup:
+            classifier.load()
+        warmup.assert_called_once()
+        self.assertTrue(classifier.loaded)
+
+    def test_cached_health(self):
+        classifier = self._classifier(health_check_interval=3600)
+        with mock.patch.object(classifier, "_predict") as predict:
+            self.assertEqual(2, len(classifier.health_status()))
+            self.assertEqual(2, len(classifier.health_status()))
+        predict.assert_not_called()
+        classifier.close()
+        self.assertFalse(classifier._health_thread.is_alive())
+
+    def test_health_refreshed(self):
+        classifier = self._classifier(health_check_interval=0.01)
+        classifier.health_status()
+        with mock.patch.object(classifier, "_predict", side_effect=Exception("Model failed")):
+            time.sleep(0.1)
+            with self.assertRaises(Exception):
+                classifier.health_status()
+        classifier.close()
+
+    def test_session_pool(self):
+        single = self._classifier()
+        pooled = self._classifier(session_pool_size=3, intra_op_threads=1, execution_mode="parallel", graph_optimization_level="basic")
+        self.assertEqual(3, pooled._sessions.qsize())
+        batches = [np.random.RandomState(seed).randint(0, 256, (8, 1, 28, 28)).astype(np.uint8) for seed in range(24)]
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(executor.map(pooled.predict, batches))
+        for batch, result in zip(batches, results):
+            np.testing.assert_array_equal(single.predict(batch), result)
+        # Every session is back in the pool
+        self.assertEqual(3, pooled._sessions.qsize())
+
+    def test_session_options(self):
+        with self.assertRaises(Exception):
+            FashionClassifier(model_path=self.path, graph_optimization_level="fast").session_options()
+        with mock.patch.dict(os.environ, {"ORT_INTRA_OP_THREADS": "2", "ORT_ENABLE_MEM_PATTERN": "false"}):
+            classifier = FashionClassifier(model_path=self.path, intra_op_threads=1)
+        options = classifier.session_options()
+        self.assertEqual(1, options.intra_op_num_threads) # Seldon parameters take precedence over the environment
+        self.assertFalse(options.enable_mem_pattern)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import argparse
+import os
+import json
+import wandb
+
+from src.models import *
+from src.export import *
+from src.benchmark import *
+
+import warnings
+warnings.filterwarnings("ignore") # A lot of deprecated warnings in the last version of PyTorch
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    '--checkpoint',
+    type=str,
+    help='Checkpoint to benchmark, or directory of a training run to pick the checkpoint with the lowest validation loss from',
+    default="./data/training_run/models/"
+)
+
+parser.add_argument(
+    '--onnx',
+    type=str,
+    help='ONNX model exported by export.py from the same checkpoint, the checkpoint is exported to the output directory if not given',
+    default=""
+)
+
+parser.add_argument(
+    '--batch_sizes',
+    type=str,
+    help='Comma separated batch sizes',
+    default="1,8,32,128"
+)
+
+parser.add_argument(
+    '--threads',
+    type=str,
+    help='Comma separated intra-op thread counts',
+    default=f"1,{os.cpu_count()}"
+)
+
+parser.add_argument(
+    '--repetitions',
+    help='Timed runs of each configuration',
+    type=int,
+    default=100
+)
+
+parser.add_argument(
+    '--output_dir',
+    type=str,
+    help='Where to store the report',
+    default="./data/benchmark/"
+)
+
+parser.add_argument(
+    '--wandb',
+    help='Whether to log the results to wandb',
+    type=bool,
+    default=False
+)
+
+args = parser.parse_args()
+
+def run():
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    ########## Loading best model, on CPU
+    checkpoint = best_checkpoint(args.checkpoint)
+    print(f"Benchmarking {checkpoint}")
+    model = ResNet18.load_from_checkpoint(checkpoint, map_location="cpu")
+    onnx_path = args.onnx
+    if onnx_path == "":
+        onnx_path = os.path.join(args.output_dir, "model.onnx")
+        export_onnx(model, onnx_path)
+
+    ########## Sweeping backends, batch sizes and threads
+    results = benchmark(model, onnx_path=onnx_path,
+                        batch_sizes=[int(size) for size in args.batch_sizes.split(",")],
+                        threads=[int(num) for num in args.threads.split(",")],
+                        repetitions=args.repetitions)
+
+    print(f"{'backend':<12} {'batch':>6} {'threads':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'img/s':>10}")
+    for res in results:
+        print(f"{res['backend']:<12} {res['batch_size']:>6} {res['threads']:>8} {res['latency_p50_ms']:>8.2f} "
+              f"{res['latency_p90_ms']:>8.2f} {res['latency_p99_ms']:>8.2f} {res['throughput']:>10.0f}")
+
+    report = {"checkpoint": checkpoint, "onnx": onnx_path, "system": system_info(), "results": results}
+    with open(os.path.join(args.output_dir, "benchmark.json"), "w") as file:
+        json.dump(report, file, indent=4)
+
+    if args.wandb:
+        wandb.login()
+        wb_run = wandb.init(project='mlops-project', job_type='benchmark', config={"checkpoint": checkpoint, **report["system"]})
+        log_wandb(results, wb_run)
+        wb_run.finish()
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,127 @@
+import argparse
+import os
+import json
+
+from src.models import *
+from src.data import *
+from src.export import *
+
+import warnings
+warnings.filterwarnings("ignore") # A lot of deprecated warnings in the last version of PyTorch
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    '--checkpoint',
+    type=str,
+    help='Checkpoint to export, or directory of a training run to pick the checkpoint with the lowest validation loss from',
+    default="./data/training_run/models/"
+)
+
+parser.add_argument(
+    '--json',
+    type=str,
+    help='Path to the configuration JSON file the model has been trained with, to calibrate and evaluate on its dataset. Defaults to Fashion MNIST',
+    default=""
+)
+
+parser.add_argument(
+    '--output_dir',
+    type=str,
+    help='Where to store the exported models and the report',
+    default="./data/export/"
+)
+
+parser.add_argument(
+    '--input_dtype',
+    type=str,
+    choices=["uint8", "float32"],
+    help='Input of the exported models, the normalization is folded in the graph: raw pixels (uint8) or floats in [0, 1] (float32)',
+    default="uint8"
+)
+
+parser.add_argument(
+    '--batch_size',
+    help='Batch size used for calibration, evaluation and throughput',
+    type=int,
+    default=128
+)
+
+parser.add_argument(
+    '--calibration_batches',
+    help='Number of validation batches used to calibrate the static quantization',
+    type=int,
+    default=10
+)
+
+parser.add_argument(
+    '--threads',
+    help='ONNX Runtime intra-op threads used for benchmarking, 0 for one per physical core',
+    type=int,
+    default=0
+)
+
+args = parser.parse_args()
+
+custom_ds_info = None
+cache_dir = None
+split_seed = 0
+if args.json != "":
+    with open(args.json, "r") as file:
+        conf = json.load(file)
+    if conf["custom_ds"]:
+        custom_ds_info = {
+            "csv_file": conf["csv_file"],
+            "ds_dir": conf["ds_dir"],
+            "split": conf["split"]
+        }
+        cache_dir = conf.get("cache_dir") or None
+    split_seed = conf.get("split_seed", 0)
+
+def export():
+    os.makedirs(args.output_dir, exist_ok=True)
+    paths = {
+        "fp32": os.path.join(args.output_dir, "model.onnx"),
+        "int8_dynamic": os.path.join(args.output_dir, "model-int8-dynamic.onnx"),
+        "int8_static": os.path.join(args.output_dir, "model-int8-static.onnx"),
+    }
+
+    ########## Loading best model and its dataset split, used for calibration and evaluation on the images it hasn't been trained on
+    checkpoint = best_checkpoint(args.checkpoint)
+    model = ResNet18.load_from_checkpoint(checkpoint)
+    seed = model.hparams.get("split_seed")
+    if seed is None:
+        print(f"{checkpoint} doesn't record its dataset split, assuming it was drawn with seed {split_seed}")
+        seed = split_seed
+    dm = FashionDataModule(num_classes=model.num_classes, batch_size=args.batch_size, custom_ds_info=custom_ds_info, num_workers=4, cache_dir=cache_dir, split_seed=seed)
+    dm.setup()
+
+    ########## Exporting best model, normalized as in training
+    mean, std = model_stats(model)
+    print(f"Exporting {checkpoint} (mean {mean:.4f}, std {std:.4f})")
+    export_onnx(model, paths["fp32"], input_dtype=args.input_dtype, mean=mean, std=std)
+
+    ########## Quantizing, calibrating on the validation set
+    quantize_int8(paths["fp32"], paths["int8_dynamic"], paths["int8_static"], dm.val_dataloader(), num_batches=args.calibration_batches, input_dtype=args.input_dtype, mean=dm.mean, std=dm.std)
+
+    ########## Comparing with the fp32 model
+    report = {"checkpoint": checkpoint}
+    for name, path in paths.items():
+        session = onnx_session(path, intra_op_threads=args.threads)
+        report[name] = {"path": path, "size_mb": os.path.getsize(path) / 1e6, "accuracy": float(evaluate_onnx(session, dm.test_dataloader(), input_dtype=args.input_dtype, mean=dm.mean, std=dm.std))}
+        report[name].update(measure_onnx(session, batch_size=args.batch_size, input_dtype=args.input_dtype))
+
+    fp32 = report["fp32"]
+    print(f"{'model':<14} {'size MB':>8} {'accuracy':>9} {'Δ acc':>7} {'p50 ms':>7} {'p99 ms':>7} {'img/s':>9} {'speedup':>8}")
+    for name in paths:
+        res = report[name]
+        res["accuracy_delta"] = res["accuracy"] - fp32["accuracy"]
+        res["speedup"] = res["throughput"] / fp32["throughput"]
+        print(f"{name:<14} {res['size_mb']:>8.1f} {res['accuracy']:>9.4f} {res['accuracy_delta']:>+7.4f} "
+              f"{res['latency_p50_ms']:>7.2f} {res['latency_p99_ms']:>7.2f} {res['throughput']:>9.0f} {res['speedup']:>7.2f}x")
+
+    with open(os.path.join(args.output_dir, "report.json"), "w") as file:
+        json.dump(report, file, indent=4)
+
+if __name__ == '__main__':
+    export()
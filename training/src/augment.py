@@ -0,0 +1,131 @@
+import math
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+class BatchAugmentation(nn.Module):
+    """Augmentation policies of FashionDataModule applied to whole batches with tensor ops, instead of one PIL image at a time in the dataloader workers.
+    Every sample draws its own random parameters, as with the per-sample transforms, and the policies are applied in the same order:
+    horizontal flip, affine, resized crop, erasing and perspective. Images are expected square, the areas outside of the source image are filled with 0.
+
+        Attributes:
+            random_affine (bool): Rotate by up to 15 degrees and translate by up to 10%
+            random_crop (bool): Crop 50-100% of the area with an aspect ratio of 0.8-1.3, resized to 24x24
+            random_erasing (bool): Erase a rectangle of 1-20% of the area, with probability 0.3
+            random_perspective (bool): Perspective distortion of scale 0.3, with probability 0.3
+            mean (float): Mean used to normalize uint8 batches
+            std (float): STD used to normalize uint8 batches
+    """
+    def __init__(self, random_affine=False, random_crop=False, random_erasing=False, random_perspective=False, mean=0., std=1.):
+        super().__init__()
+        self.random_affine = random_affine
+        self.random_crop = random_crop
+        self.random_erasing = random_erasing
+        self.random_perspective = random_perspective
+        self.mean = mean
+        self.std = std
+
+    def forward(self, x):
+        """Augments a batch
+
+        Args:
+            x (torch.Tensor): Batch of images, N x C x H x W. Normalized floats, or raw uint8 pixels normalized with mean and std first
+
+        Returns:
+            torch.Tensor: Augmented batch
+        """
+        if x.dtype == torch.uint8:
+            x = (x.float() / 255 - self.mean) / self.std
+        x = horizontal_flip(x)
+        if self.random_affine:
+            x = random_affine(x)
+        if self.random_crop:
+            x = random_resized_crop(x)
+        if self.random_erasing:
+            x = random_erasing(x)
+        if self.random_perspective:
+            x = random_perspective(x)
+        return x
+
+def _uniform(low, high, n, device):
+    return torch.empty(n, device=device).uniform_(low, high)
+
+def _apply(x, augmented, p):
+    # Keeps the augmented version of each sample with probability p
+    apply = torch.rand(x.shape[0], device=x.device) < p
+    return torch.where(apply[:, None, None, None], augmented, x)
+
+def _sample(x, theta, size=None):
+    # Resamples each image at the positions given by its affine transform of the output grid, in normalized [-1, 1] coordinates
+    size = size or x.shape[-2:]
+    grid = F.affine_grid(theta, [x.shape[0], x.shape[1], *size], align_corners=False)
+    return F.grid_sample(x, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+
+def horizontal_flip(x, p=0.5):
+    return _apply(x, x.flip(-1), p)
+
+def random_affine(x, degrees=15, translate=(0.1, 0.1)):
+    n = x.shape[0]
+    angle = _uniform(-degrees, degrees, n, x.device) * math.pi / 180
+    # Translations as fractions of the size, doubled in normalized coordinates
+    t = torch.stack([_uniform(-translate[0], translate[0], n, x.device), _uniform(-translate[1], translate[1], n, x.device)], dim=1) * 2
+    # The grid maps output to input positions: inverse rotation of the output position minus the translation
+    cos, sin = torch.cos(angle), torch.sin(angle)
+    rotation = torch.stack([torch.stack([cos, sin], dim=1), torch.stack([-sin, cos], dim=1)], dim=1)
+    theta = torch.cat([rotation, -(rotation @ t[:, :, None])], dim=2)
+    return _sample(x, theta)
+
+def random_resized_crop(x, size=24, scale=(0.5, 1.0), ratio=(0.8, 1.3)):
+    n = x.shape[0]
+    area = _uniform(scale[0], scale[1], n, x.device)
+    aspect = torch.exp(_uniform(math.log(ratio[0]), math.log(ratio[1]), n, x.device))
+    # Width and height as fractions of the image, centered anywhere the crop fits
+    w = torch.sqrt(area * aspect).clamp(max=1)
+    h = torch.sqrt(area / aspect).clamp(max=1)
+    cx = (torch.rand(n, device=x.device) * 2 - 1) * (1 - w)
+    cy = (torch.rand(n, device=x.device) * 2 - 1) * (1 - h)
+    zeros = torch.zeros_like(w)
+    theta = torch.stack([torch.stack([w, zeros, cx], dim=1), torch.stack([zeros, h, cy], dim=1)], dim=1)
+    return _sample(x, theta, size=(size, size))
+
+def random_erasing(x, p=0.3, scale=(0.01, 0.2), ratio=(0.3, 3.3), value=0):
+    n, _, height, width = x.shape
+    area = _uniform(scale[0], scale[1], n, x.device) * height * width
+    aspect = torch.exp(_uniform(math.log(ratio[0]), math.log(ratio[1]), n, x.device))
+    h = torch.sqrt(area * aspect).round().clamp(1, height)
+    w = torch.sqrt(area / aspect).round().clamp(1, width)
+    top = (torch.rand(n, device=x.device) * (height - h + 1)).floor()
+    left = (torch.rand(n, device=x.device) * (width - w + 1)).floor()
+    rows = torch.arange(height, device=x.device)[None, :, None]
+    cols = torch.arange(width, device=x.device)[None, None, :]
+    mask = (rows >= top[:, None, None]) & (rows < (top + h)[:, None, None]) & (cols >= left[:, None, None]) & (cols < (left + w)[:, None, None])
+    mask &= (torch.rand(n, device=x.device) < p)[:, None, None]
+    return x.masked_fill(mask[:, None], value)
+
+def random_perspective(x, p=0.3, distortion_scale=0.3):
+    n, _, height, width = x.shape
+    # Corners of the image (top-left, top-right, bottom-right, bottom-left) and where they are moved to, inwards by up to distortion_scale of the half size
+    start = torch.tensor([[-1., -1.], [1., -1.], [1., 1.], [-1., 1.]], device=x.device).expand(n, 4, 2)
+    end = start - start * torch.rand(n, 4, 2, device=x.device) * distortion_scale
+
+    # Homographies mapping the moved corners (output) back to the corners (input), one 8x8 linear system per sample
+    ex, ey, sx, sy = end[..., 0], end[..., 1], start[..., 0], start[..., 1]
+    ones, zeros = torch.ones_like(ex), torch.zeros_like(ex)
+    a = torch.cat([
+        torch.stack([ex, ey, ones, zeros, zeros, zeros, -sx * ex, -sx * ey], dim=2),
+        torch.stack([zeros, zeros, zeros, ex, ey, ones, -sy * ex, -sy * ey], dim=2),
+    ], dim=1)
+    coeffs = torch.linalg.solve(a, torch.cat([sx, sy], dim=1)[..., None])[..., 0]
+
+    # Output grid in normalized coordinates, at the pixel centers
+    ys = (torch.arange(height, device=x.device, dtype=x.dtype) * 2 + 1) / height - 1
+    xs = (torch.arange(width, device=x.device, dtype=x.dtype) * 2 + 1) / width - 1
+    gy, gx = torch.meshgrid(ys, xs)
+    gx, gy = gx[None], gy[None]
+    c = coeffs[:, :, None, None]
+    denominator = c[:, 6] * gx + c[:, 7] * gy + 1
+    grid = torch.stack([(c[:, 0] * gx + c[:, 1] * gy + c[:, 2]) / denominator,
+                        (c[:, 3] * gx + c[:, 4] * gy + c[:, 5]) / denominator], dim=3)
+    augmented = F.grid_sample(x, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+    return _apply(x, augmented, p)
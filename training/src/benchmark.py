@@ -0,0 +1,111 @@
+import os
+import platform
+
+import numpy as np
+import torch
+import wandb
+
+from .export import onnx_session
+from .utils import time_runs
+
+def latency_stats(timings, batch_size):
+    """Latency percentiles and throughput of timed runs
+
+    Args:
+        timings (np.ndarray): Timing of each run in ms
+        batch_size (int): Images per run
+
+    Returns:
+        dict: Mean, p50, p90 and p99 latency in ms, and throughput in images/s
+    """
+    return {
+        "latency_mean_ms": float(timings.mean()),
+        "latency_p50_ms": float(np.percentile(timings, 50)),
+        "latency_p90_ms": float(np.percentile(timings, 90)),
+        "latency_p99_ms": float(np.percentile(timings, 99)),
+        "throughput": float(batch_size * len(timings) / (timings.sum() / 1000)),
+    }
+
+def torchscript(model, input_size=[1, 28, 28]):
+    """Traces and freezes a model for inference
+
+    Args:
+        model (nn.Module): Model
+        input_size (list, optional): Input size, without the batch axis. Defaults to [1, 28, 28].
+
+    Returns:
+        torch.jit.ScriptModule: Frozen TorchScript model
+    """
+    model.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.randn([1]+input_size))
+    return torch.jit.freeze(traced)
+
+def _onnx_input(session, shape):
+    # Models exported by export.py take raw pixels (uint8) or floats in [0, 1], older ones normalized floats
+    meta = session.get_modelmeta().custom_metadata_map
+    if meta.get("input_dtype") == "uint8":
+        return np.random.randint(0, 256, shape).astype(np.uint8)
+    return np.random.rand(*shape).astype(np.float32)
+
+def benchmark(model, onnx_path=None, batch_sizes=[1, 8, 32, 128], threads=[1, os.cpu_count()], input_size=[1, 28, 28], repetitions=100, warmup=10):
+    """CPU latency and throughput of a model over batch sizes and thread counts, run eagerly, with TorchScript and, given its exported model, with ONNX Runtime.
+    Timed with wall-clock timers, the torch intra-op threads are restored afterwards.
+
+    Args:
+        model (nn.Module): Model, on CPU
+        onnx_path (str, optional): Model exported by export.py, None to skip ONNX Runtime. Defaults to None.
+        batch_sizes (list, optional): Batch sizes. Defaults to [1, 8, 32, 128].
+        threads (list, optional): Intra-op thread counts. Defaults to 1 and one per CPU.
+        input_size (list, optional): Input size, without the batch axis. Defaults to [1, 28, 28].
+        repetitions (int, optional): Timed runs of each configuration. Defaults to 100.
+        warmup (int, optional): Untimed runs before. Defaults to 10.
+
+    Returns:
+        list: Result of each configuration, as a dict with its backend, batch size and threads, and its latency_stats
+    """
+    model.eval()
+    backends = {"eager": model, "torchscript": torchscript(model, input_size)}
+    default_threads = torch.get_num_threads()
+    results = []
+    try:
+        for num_threads in threads:
+            torch.set_num_threads(num_threads)
+            sessions = {"onnx": onnx_session(onnx_path, intra_op_threads=num_threads)} if onnx_path else {}
+            for batch_size in batch_sizes:
+                shape = [batch_size]+input_size
+                x = torch.randn(shape)
+                with torch.no_grad():
+                    for name, module in backends.items():
+                        timings = time_runs(lambda: module(x), repetitions=repetitions, warmup=warmup)
+                        results.append({"backend": name, "batch_size": batch_size, "threads": num_threads, **latency_stats(timings, batch_size)})
+                for name, session in sessions.items():
+                    feed = {session.get_inputs()[0].name: _onnx_input(session, shape)}
+                    timings = time_runs(lambda: session.run(None, feed), repetitions=repetitions, warmup=warmup)
+                    results.append({"backend": name, "batch_size": batch_size, "threads": num_threads, **latency_stats(timings, batch_size)})
+    finally:
+        torch.set_num_threads(default_threads)
+    return results
+
+def system_info():
+    """Description of the machine the benchmark ran on, stored along with the results"""
+    return {
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+    }
+
+def log_wandb(results, run):
+    """Logs benchmark results to wandb, as a table and as a summary metric per configuration
+
+    Args:
+        results (list): Results of benchmark
+        run (wandb.Run): Run to log to
+    """
+    columns = list(results[0].keys())
+    run.log({"benchmark": wandb.Table(columns=columns, data=[[res[col] for col in columns] for res in results])})
+    for res in results:
+        prefix = f"{res['backend']}/batch_{res['batch_size']}/threads_{res['threads']}"
+        for key in ("latency_p50_ms", "latency_p99_ms", "throughput"):
+            run.summary[f"{prefix}/{key}"] = res[key]
@@ -1,4 +1,8 @@
 from logging import root
+import copy
+import hashlib
+import json
+import os
 import torch
 import torchvision
 import torchvision.transforms as transforms
@@ -9,7 +13,12 @@ from PIL import Image
 import numpy as np
 import pandas as pd
 
-from .utils import LabelEncoder
+from .utils import LabelEncoder, RunningStats, batch_stats
+from .augment import BatchAugmentation
+
+# Mean and STD of ImageNet greyscaled, used to normalize the images unless FashionDataModule uses the statistics of its dataset
+MEAN = 0.445
+STD = 0.269
 
 class FashionDataModule(pl.LightningDataModule):
     """DataModule class, sets up the dataset and creates dataloader
@@ -25,12 +34,25 @@ class FashionDataModule(pl.LightningDataModule):
                                         "split": list_of_splits such as [0.7, 0.15, 0.15]
                                     }
             num_classes (int): Number of classes
+            cache_dir (str): Directory of the pre-decoded image shards of the custom dataset, None to read the images on every epoch
+            batch_augmentation (BatchAugmentation): Augmentations applied to the collated training batches, None if they're applied per sample.
+                                    Enabled by transforms_args["batch"]
+            use_dataset_stats (bool): Normalize with the mean and std of the training dataset, computed on setup, instead of MEAN and STD
+            stats_dir (str): Directory of the cached dataset statistics. Defaults to the cache_dir, or the directory of the csv file, of the custom dataset
+            mean (float): Mean the images are normalized with, folded in the exported models
+            std (float): STD the images are normalized with, folded in the exported models
+            split_seed (int): Seed of the train/val/test split. Fixed, so that every run and the export get the same split, and reuse its cached statistics
     """     
-    def __init__(self, num_classes, transforms_args = {}, custom_ds_info = None, batch_size=128, num_workers=4):
+    def __init__(self, num_classes, transforms_args = {}, custom_ds_info = None, batch_size=128, num_workers=4, cache_dir=None, use_dataset_stats=True, stats_dir=None, split_seed=0):
         super().__init__()
 
         self.batch_size = batch_size
         self.num_workers = num_workers
+        self.cache_dir = cache_dir
+        self.use_dataset_stats = use_dataset_stats
+        self.stats_dir = stats_dir
+        self.split_seed = split_seed
+        self.mean, self.std = MEAN, STD
 
         if custom_ds_info:
             assert list(custom_ds_info.keys()) == ["csv_file", "ds_dir", "split"]
@@ -45,25 +67,40 @@ class FashionDataModule(pl.LightningDataModule):
             self.num_classes = 10
             self.val_split = 0.15
 
-        # Augmentation policy for training set
+        # Shared by the training and test transforms, set to the dataset statistics on setup
+        self.normalize = transforms.Normalize((MEAN,), (STD,))
+
+        # Augmentation policy for training set, applied to whole batches after collation if transforms_args["batch"] is set
+        batch = bool(transforms_args.get("batch"))
         train_transforms = [
             transforms.Grayscale(num_output_channels=1),
             transforms.Resize(size=(28, 28)),
-            transforms.RandomHorizontalFlip(),
             transforms.ToTensor(),
-            transforms.Normalize((0.445,), (0.269,)) # Mean and STD of ImageNet greyscaled
+            self.normalize
             ]
+        if not batch:
+            train_transforms.insert(2, transforms.RandomHorizontalFlip())
 
         # Preprocessing steps applied to validation and test set.
         test_transforms = [
             transforms.Grayscale(num_output_channels=1),
             transforms.Resize(size=(28, 28)),
             transforms.ToTensor(),
-            transforms.Normalize((0.445,), (0.269,)), # Mean and STD of ImageNet greyscaled
+            self.normalize,
             ]
+
+        # Unnormalized images the dataset statistics are computed on
+        self.stats_transform = transforms.Compose(test_transforms[:-1])
         
         # Additional augmentations
-        if transforms_args:
+        self.batch_augmentation = None
+        if batch:
+            self.batch_augmentation = BatchAugmentation(random_affine=transforms_args.get("random_affine", False),
+                                                        random_crop=transforms_args.get("random_crop", False),
+                                                        random_erasing=transforms_args.get("random_erasing", False),
+                                                        random_perspective=transforms_args.get("random_perspective", False),
+                                                        mean=MEAN, std=STD)
+        elif transforms_args:
             if transforms_args["random_affine"]:
                 train_transforms.append(transforms.RandomAffine(degrees=15, translate=(0.1, 0.1)))
             
@@ -88,9 +125,36 @@ class FashionDataModule(pl.LightningDataModule):
         self.augmentation = transforms.Compose(train_transforms)
         self.transform = transforms.Compose(test_transforms)
 
+    def _set_stats(self, mean, std):
+        self.mean, self.std = float(mean[0]), float(std[0]) or 1.
+        self.normalize.mean, self.normalize.std = (self.mean,), (self.std,)
+        if self.batch_augmentation is not None:
+            self.batch_augmentation.mean, self.batch_augmentation.std = self.mean, self.std
+
+    def _setup_stats(self, dataset, train_idx, stats_dir, *paths):
+        """Normalizes with the statistics of the training split only, cached in stats_dir under the fingerprint of the dataset and of the split
+
+        Args:
+            dataset (Dataset): Full dataset
+            train_idx (np.ndarray): Indices of the training split
+            stats_dir (str): Directory of the cached statistics
+            paths (str): Files and directories of the dataset
+        """
+        stats_dataset = copy.copy(dataset)
+        stats_dataset.transform = self.stats_transform
+        stats_file = os.path.join(stats_dir, f"stats-{dataset_fingerprint(*paths, indices=train_idx)}.json")
+        self._set_stats(*compute_dataset_stats(torch.utils.data.Subset(stats_dataset, train_idx), stats_file, num_workers=self.num_workers))
+
     def prepare_data(self):
         pass
 
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        # Training batches only, validation and test batches are left as is
+        if self.batch_augmentation is not None and self.trainer is not None and self.trainer.training:
+            x, y = batch
+            batch = self.batch_augmentation(x), y
+        return batch
+
     def setup(self, stage=None):
         if self.use_MNIST:
             self.setup_MNIST()
@@ -104,19 +168,20 @@ class FashionDataModule(pl.LightningDataModule):
         ds_dir = self.custom_ds_info["ds_dir"]
         split_train, val_split, test_split = self.custom_ds_info["split"]
 
-        train_dataset = FashionDataset(ds_dir=ds_dir, csv_file=csv_file, transform=self.augmentation)
-        val_dataset = FashionDataset(ds_dir=ds_dir, csv_file=csv_file, transform=self.transform)
-        test_dataset = FashionDataset(ds_dir=ds_dir, csv_file=csv_file, transform=self.transform)
+        train_dataset = FashionDataset(ds_dir=ds_dir, csv_file=csv_file, transform=self.augmentation, cache_dir=self.cache_dir)
+        val_dataset = FashionDataset(ds_dir=ds_dir, csv_file=csv_file, transform=self.transform, cache_dir=self.cache_dir)
+        test_dataset = FashionDataset(ds_dir=ds_dir, csv_file=csv_file, transform=self.transform, cache_dir=self.cache_dir)
 
         # Create the index splits for training, validation and test
-        y_full = train_dataset.label_encoder.encode(train_dataset.df.label.values)
-
-        train_idx, remainder = train_test_split(np.arange(len(y_full)), test_size=1-split_train, shuffle=True, stratify=y_full)
+        y_full = train_dataset.labels
 
-        y_remainder = train_dataset.label_encoder.encode(train_dataset.df.iloc[remainder.tolist()].label.values)
+        train_idx, remainder = train_test_split(np.arange(len(y_full)), test_size=1-split_train, shuffle=True, stratify=y_full, random_state=self.split_seed)
 
         new_split_val = 1/((1 - split_train)/val_split)
-        val_idx, test_idx = train_test_split(np.arange(len(y_remainder)), test_size=new_split_val, shuffle=True, stratify=y_remainder)
+        val_idx, test_idx = train_test_split(remainder, test_size=new_split_val, shuffle=True, stratify=y_full[remainder], random_state=self.split_seed)
+
+        if self.use_dataset_stats:
+            self._setup_stats(val_dataset, train_idx, self.stats_dir or self.cache_dir or os.path.dirname(csv_file), csv_file, ds_dir)
 
         train_dataset = torch.utils.data.Subset(train_dataset, train_idx)
         val_dataset = torch.utils.data.Subset(val_dataset, val_idx)
@@ -135,7 +200,10 @@ class FashionDataModule(pl.LightningDataModule):
         y_train = train_dataset.targets
 
         train_idx, val_idx = train_test_split(
-            np.arange(len(y_train)), test_size=self.val_split, shuffle=True, stratify=y_train)
+            np.arange(len(y_train)), test_size=self.val_split, shuffle=True, stratify=y_train, random_state=self.split_seed)
+
+        if self.use_dataset_stats:
+            self._setup_stats(val_dataset, train_idx, self.stats_dir or os.path.dirname(val_dataset.raw_folder), val_dataset.raw_folder)
 
         # Define samplers for obtaining training and validation batches
         train_dataset = torch.utils.data.Subset(train_dataset, train_idx)
@@ -161,37 +229,173 @@ class FashionDataModule(pl.LightningDataModule):
                     batch_size=self.batch_size if self.batch_size is not None else batch_size, 
                     num_workers=self.num_workers if self.num_workers is not None else num_workers)
 
+def dataset_fingerprint(*paths, indices=None):
+    """Fingerprint of a version of a dataset: the content of its files, and the name, size and modification time of the files of its directories
+
+    Args:
+        paths (str): Files and directories of the dataset
+        indices (np.ndarray, optional): Indices of the samples used, None for the whole dataset. Defaults to None.
+
+    Returns:
+        str: Hex digest
+    """
+    h = hashlib.blake2b(digest_size=16)
+    if indices is not None:
+        h.update(np.asarray(indices, dtype=np.int64).tobytes())
+    for path in paths:
+        if os.path.isdir(path):
+            for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+                stat = entry.stat()
+                h.update(f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+        else:
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    h.update(chunk)
+    return h.hexdigest()
+
+def compute_dataset_stats(dataset, stats_file, batch_size=256, num_workers=4):
+    """Per-channel mean and std of the images of a dataset, computed in a single pass and cached in stats_file.
+    The dataloader workers reduce their batches, only their partial statistics are merged in the main process.
+
+    Args:
+        dataset (Dataset): Dataset of unnormalized image tensors and labels
+        stats_file (str): JSON cache of the statistics, named after the fingerprint of the dataset
+        batch_size (int, optional): Images reduced at a time. Defaults to 256.
+        num_workers (int, optional): Dataloader workers. Defaults to 4.
+
+    Returns:
+        tuple: Mean and std, as lists of one value per channel
+    """
+    if os.path.exists(stats_file):
+        with open(stats_file, "r") as file:
+            stats = json.load(file)
+        return stats["mean"], stats["std"]
+
+    print(f"Computing dataset statistics to {stats_file}...")
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, num_workers=num_workers, collate_fn=batch_stats)
+    stats = RunningStats()
+    for partial in loader:
+        stats.merge(partial)
+    mean, std = stats.mean.tolist(), stats.std.tolist()
+
+    os.makedirs(os.path.dirname(stats_file) or ".", exist_ok=True)
+    # Written to a temporary file first, an interrupted run never leaves a partial cache
+    with open(stats_file + ".tmp", "w") as file:
+        json.dump({"mean": mean, "std": std, "count": stats.count}, file)
+    os.replace(stats_file + ".tmp", stats_file)
+    return mean, std
+
+def decode_image(path, size=(28, 28)):
+    """Reads an image as the first transforms of FashionDataModule would: greyscaled and resized
+
+    Args:
+        path (str): Image path
+        size (tuple, optional): Output size. Defaults to (28, 28).
+
+    Returns:
+        np.ndarray: uint8 image of shape size
+    """
+    image = Image.open(path).convert("RGB")
+    image = transforms.Resize(size=size)(transforms.Grayscale(num_output_channels=1)(image))
+    return np.asarray(image, dtype=np.uint8)
+
+def build_image_shards(paths, cache_dir, size=(28, 28), shard_size=10000):
+    """Decodes the images of a dataset once, writing them greyscaled and resized to memory-mappable .npy shards.
+    The labels aren't cached, they're encoded from the csv file on load
+
+    Args:
+        paths (list): Image paths
+        cache_dir (str): Directory to write the shards to
+        size (tuple, optional): Image size. Defaults to (28, 28).
+        shard_size (int, optional): Images per shard. Defaults to 10000.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    for shard, start in enumerate(range(0, len(paths), shard_size)):
+        shard_paths = paths[start:start+shard_size]
+        images = np.lib.format.open_memmap(os.path.join(cache_dir, f"images-{shard:05d}.npy"), mode="w+", dtype=np.uint8, shape=(len(shard_paths),)+tuple(size))
+        for i, path in enumerate(shard_paths):
+            images[i] = decode_image(path, size)
+        images.flush()
+        del images
+
 class FashionDataset(torch.utils.data.Dataset):
-    """Custom Fashion Items dataset."""
+    """Custom Fashion Items dataset. The annotations are kept as numpy arrays of image ids and encoded labels,
+    cheap to index and to pickle to the dataloader workers."""
 
-    def __init__(self, csv_file, ds_dir, transform=None):
+    def __init__(self, csv_file, ds_dir, transform=None, cache_dir=None, shard_size=10000):
         """
         Args:
             csv_file (string): Path to the csv file with annotations.
             ds_dir (string): Directory containing the images.
             transform (callable, optional): Optional transform to be applied on a sample.
+            cache_dir (string, optional): Directory of the image shards. If set, the images are decoded, greyscaled and resized once
+                                          to memory-mapped shards, and read from there instead of from the JPEGs.
+            shard_size (int, optional): Images per shard. Defaults to 10000.
         """
-        self.df = pd.read_csv(csv_file, on_bad_lines="skip")
+        df = pd.read_csv(csv_file, on_bad_lines="skip", dtype=str, keep_default_na=False)
 
         # Process CSV
-        self.df = self.df.astype("string")
+        self.image_ids = df.iloc[:, 0].to_numpy(dtype=str)
         self.ds_dir = ds_dir
         self.transform = transform
         self.label_encoder = LabelEncoder()
-        self.label_encoder.fit(self.df.label.values)
+        self.label_encoder.fit(df.label.to_numpy(dtype=str))
+        self.labels = self.label_encoder.encode(df.label.to_numpy(dtype=str))
+
+        self.cache_dir = cache_dir
+        self.shard_size = shard_size
+        self._shards = None
+        if cache_dir:
+            self._setup_cache(csv_file)
+
+    def _setup_cache(self, csv_file, size=(28, 28)):
+        # Rebuilds the shards if the annotations, the images or the shard layout changed since they were written
+        meta = {
+            "csv_file": os.path.abspath(csv_file),
+            "ds_dir": os.path.abspath(self.ds_dir),
+            "fingerprint": dataset_fingerprint(csv_file, self.ds_dir),
+            "num_samples": len(self.labels),
+            "shard_size": self.shard_size,
+            "size": list(size),
+        }
+        meta_path = os.path.join(self.cache_dir, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as file:
+                if json.load(file) == meta:
+                    return
+
+        print(f"Building image shards under {self.cache_dir}...")
+        paths = [self._path(image_id) for image_id in self.image_ids]
+        build_image_shards(paths, self.cache_dir, size=size, shard_size=self.shard_size)
+        # Written last, an interrupted build is rebuilt on the next run
+        with open(meta_path, "w") as file:
+            json.dump(meta, file)
+
+    def _path(self, image_id):
+        return self.ds_dir + "/" + image_id + ".jpg"
+
+    def __getstate__(self):
+        # Memory maps are reopened by each dataloader worker instead of being pickled
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
 
     def __len__(self):
-        return len(self.df)
+        return len(self.labels)
 
     def __getitem__(self, idx):
         if torch.is_tensor(idx):
             idx = idx.tolist()
 
-        image_id, y = self.df.iloc[idx]
-        
-        y = self.label_encoder.encode([y])[0]
-        path = self.ds_dir + "/" + image_id + ".jpg"
-        image = Image.open(path).convert("RGB")
+        if self.cache_dir:
+            if self._shards is None:
+                num_shards = (len(self.labels) + self.shard_size - 1) // self.shard_size
+                self._shards = [np.load(os.path.join(self.cache_dir, f"images-{shard:05d}.npy"), mmap_mode="r") for shard in range(num_shards)]
+            # Already greyscaled and resized, the transforms doing it are no-ops
+            image = Image.fromarray(np.array(self._shards[idx // self.shard_size][idx % self.shard_size]), mode="L")
+        else:
+            image = Image.open(self._path(self.image_ids[idx])).convert("RGB")
+        y = self.labels[idx]
 
         if self.transform:
             image = self.transform(image)
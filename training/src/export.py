@@ -0,0 +1,182 @@
+import glob
+import os
+import re
+
+import numpy as np
+import onnx
+import torch
+from torch import nn
+import onnxruntime as onnxrt
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+from .data import MEAN, STD
+from .utils import time_runs
+
+INPUT_DTYPES = {"uint8": torch.uint8, "float32": torch.float}
+
+def best_checkpoint(path):
+    """Finds the checkpoint with the lowest validation loss, as saved by train.py as model-{epoch}-{val_loss}.ckpt
+
+    Args:
+        path (str): Checkpoint, or directory to search recursively for checkpoints
+
+    Returns:
+        str: Path of the best checkpoint
+    """
+    if os.path.isfile(path):
+        return path
+    checkpoints = glob.glob(os.path.join(path, "**", "*.ckpt"), recursive=True)
+    if not checkpoints:
+        raise Exception(f"No checkpoint found under {path}")
+
+    def val_loss(ckpt):
+        match = re.search(r"val_loss=([0-9.]+?)(?:-v\d+)?\.ckpt$", os.path.basename(ckpt))
+        return float(match.group(1)) if match else float("inf")
+    return min(checkpoints, key=val_loss)
+
+class NormalizedModel(nn.Module):
+    """Model with the preprocessing of FashionDataModule folded in: takes unnormalized images,
+    raw pixels (uint8, 0-255) or floats in [0, 1] as given by ToTensor, and normalizes them with MEAN and STD.
+    Scaling and normalization are folded in a single multiply-add.
+
+        Attributes:
+            model (nn.Module): Model taking normalized images
+            input_dtype (str): "uint8" or "float32"
+    """
+    def __init__(self, model, input_dtype="uint8", mean=MEAN, std=STD):
+        super().__init__()
+        self.model = model
+        self.input_dtype = input_dtype
+        scale = 1/255 if input_dtype == "uint8" else 1
+        self.register_buffer("scale", torch.tensor(scale / std))
+        self.register_buffer("shift", torch.tensor(-mean / std))
+
+    def forward(self, x):
+        return self.model(x.float() * self.scale + self.shift)
+
+def model_stats(model):
+    """Mean and STD a model has been trained with, saved in its hyperparameters by train.py
+
+    Args:
+        model (nn.Module): Model, as loaded from its checkpoint
+
+    Returns:
+        tuple: Mean and STD, MEAN and STD for models trained before they were saved
+    """
+    hparams = getattr(model, "hparams", {})
+    return hparams.get("mean", MEAN), hparams.get("std", STD)
+
+def to_model_input(imgs, input_dtype="uint8", mean=MEAN, std=STD):
+    """Reverts the normalization of a batch of FashionDataModule images, to feed them to a NormalizedModel
+
+    Args:
+        imgs (torch.Tensor): Normalized images
+        input_dtype (str, optional): "uint8" or "float32". Defaults to "uint8".
+
+    Returns:
+        np.ndarray: Unnormalized images
+    """
+    x = imgs.numpy() * std + mean
+    if input_dtype == "uint8":
+        return np.clip(np.rint(x * 255), 0, 255).astype(np.uint8)
+    return x.astype(np.float32)
+
+def export_onnx(model, path, input_size=[1, 28, 28], opset_version=13, input_dtype="uint8", mean=None, std=None):
+    """Exports a model to ONNX, with a dynamic batch axis and the input normalization folded in the graph.
+    The input dtype and normalization are recorded in the model metadata, read by the model server.
+
+    Args:
+        model (nn.Module): Model
+        path (str): Output path
+        input_size (list, optional): Input size, without the batch axis. Defaults to [1, 28, 28].
+        opset_version (int, optional): ONNX opset. Defaults to 13.
+        input_dtype (str, optional): "uint8" for raw pixels, "float32" for floats in [0, 1]. Defaults to "uint8".
+        mean (float, optional): Mean the model has been trained with. Defaults to the one saved in its checkpoint, see model_stats.
+        std (float, optional): STD the model has been trained with. Defaults to the one saved in its checkpoint, see model_stats.
+    """
+    if input_dtype not in INPUT_DTYPES:
+        raise Exception(f"Unsupported input dtype '{input_dtype}', choose one of {list(INPUT_DTYPES)}")
+    if mean is None or std is None:
+        mean, std = model_stats(model)
+    model.eval()
+    normalized = NormalizedModel(model, input_dtype=input_dtype, mean=mean, std=std).eval()
+    dummy_input = torch.zeros([1]+input_size, dtype=INPUT_DTYPES[input_dtype])
+    with torch.no_grad():
+        torch.onnx.export(normalized, dummy_input, path,
+                          input_names=["input"],
+                          output_names=["logits"],
+                          dynamic_axes={"input": {0: "batch_size"}, "logits": {0: "batch_size"}},
+                          opset_version=opset_version)
+
+    onnx_model = onnx.load(path)
+    onnx.helper.set_model_props(onnx_model, {"preprocessing": "normalize", "input_dtype": input_dtype, "mean": str(mean), "std": str(std)})
+    onnx.save(onnx_model, path)
+
+class LoaderCalibrationReader(CalibrationDataReader):
+    """Feeds batches of a dataloader to the ONNX Runtime static quantization calibration
+
+        Attributes:
+            input_name (str): Model input name
+            _batches (iterator): Remaining calibration batches
+    """
+    def __init__(self, loader, input_name="input", num_batches=10, input_dtype="uint8", mean=MEAN, std=STD):
+        self.input_name = input_name
+        self._batches = (to_model_input(imgs, input_dtype, mean, std) for i, (imgs, _) in enumerate(loader) if i < num_batches)
+
+    def get_next(self):
+        x = next(self._batches, None)
+        return None if x is None else {self.input_name: x}
+
+def quantize_int8(fp32_path, dynamic_path, static_path, calibration_loader, num_batches=10, input_dtype="uint8", mean=MEAN, std=STD):
+    """Quantizes an ONNX model to INT8 weights (dynamic), and to INT8 weights and activations (static, calibrated on calibration_loader)
+
+    Args:
+        fp32_path (str): fp32 ONNX model
+        dynamic_path (str): Output path of the dynamically quantized model
+        static_path (str): Output path of the statically quantized model
+        calibration_loader (DataLoader): Loader of normalized images, as given by FashionDataModule
+        num_batches (int, optional): Calibration batches. Defaults to 10.
+        input_dtype (str, optional): Input dtype the model has been exported with. Defaults to "uint8".
+        mean (float, optional): Mean the calibration images are normalized with. Defaults to MEAN.
+        std (float, optional): STD the calibration images are normalized with. Defaults to STD.
+    """
+    quantize_dynamic(fp32_path, dynamic_path, weight_type=QuantType.QInt8)
+    quantize_static(fp32_path, static_path,
+                    LoaderCalibrationReader(calibration_loader, num_batches=num_batches, input_dtype=input_dtype, mean=mean, std=std),
+                    quant_format=QuantFormat.QOperator,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8)
+
+def onnx_session(path, intra_op_threads=0):
+    options = onnxrt.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    return onnxrt.InferenceSession(path, sess_options=options)
+
+def evaluate_onnx(session, loader, input_dtype="uint8", mean=MEAN, std=STD):
+    """Accuracy of an exported ONNX model over a dataloader of normalized images"""
+    input_name = session.get_inputs()[0].name
+    correct, total = 0, 0
+    for imgs, labels in loader:
+        logits = session.run(None, {input_name: to_model_input(imgs, input_dtype, mean, std)})[0]
+        correct += (np.argmax(logits, axis=1) == labels.numpy()).sum()
+        total += len(labels)
+    return correct / total
+
+def measure_onnx(session, input_size=[1, 28, 28], batch_size=128, repetitions=100, input_dtype="uint8"):
+    """CPU latency (batch of 1) and throughput (batch of batch_size) of an ONNX model
+
+    Returns:
+        dict: Mean, p50 and p99 latency in ms, and throughput in images/s
+    """
+    input_name = session.get_inputs()[0].name
+    single = np.random.randint(0, 256, [1]+input_size).astype(input_dtype)
+    batch = np.random.randint(0, 256, [batch_size]+input_size).astype(input_dtype)
+
+    timings = time_runs(lambda: session.run(None, {input_name: single}), repetitions=repetitions)
+    batch_timings = time_runs(lambda: session.run(None, {input_name: batch}), repetitions=repetitions)
+    return {
+        "latency_mean_ms": float(timings.mean()),
+        "latency_p50_ms": float(np.percentile(timings, 50)),
+        "latency_p99_ms": float(np.percentile(timings, 99)),
+        "throughput": repetitions * batch_size / (batch_timings.sum() / 1000),
+    }
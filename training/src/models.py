@@ -4,14 +4,19 @@ import torchmetrics
 import torchvision.models as models
 import pytorch_lightning as pl
 
+from .data import MEAN, STD
+
 class ResNet18(pl.LightningModule):
-    def __init__(self, num_classes, learning_rate=1e-3, fine_tune=False):
+    def __init__(self, num_classes, learning_rate=1e-3, fine_tune=False, mean=MEAN, std=STD, split_seed=None):
         super().__init__()
         
-        # log hyperparameters
+        # log hyperparameters, the normalization and the dataset split the model is trained with are saved in the checkpoints for the export
         self.learning_rate = learning_rate
         self.num_classes = num_classes
         self.fine_tune = fine_tune
+        self.mean = mean
+        self.std = std
+        self.split_seed = split_seed
         self.save_hyperparameters()
 
         self.accuracy = torchmetrics.Accuracy()
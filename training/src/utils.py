@@ -1,50 +1,50 @@
 import itertools
 import json
+import time
 
 import numpy as np
 import torch
 import wandb
 from pytorch_lightning.callbacks import Callback
 
+def time_runs(fn, repetitions=100, warmup=10):
+    """Wall-clock timings of fn, run warmup times first. Waits for CUDA to finish after each run if it's available
+
+    Args:
+        fn (callable): Function to time, without arguments
+        repetitions (int, optional): Timed runs. Defaults to 100.
+        warmup (int, optional): Untimed runs before. Defaults to 10.
+
+    Returns:
+        np.ndarray: Timing of each run in ms
+    """
+    sync = torch.cuda.synchronize if torch.cuda.is_available() else (lambda: None)
+    for _ in range(warmup):
+        fn()
+    sync()
+    timings = np.zeros(repetitions)
+    for rep in range(repetitions):
+        start = time.perf_counter()
+        fn()
+        sync()
+        timings[rep] = (time.perf_counter() - start) * 1000
+    return timings
+
 def measure_throughput(input_size, model, optimal_batch_size=128):
     # Measuring throughput
-    dummy_input = torch.randn([optimal_batch_size]+input_size, dtype=torch.float)
+    dummy_input = torch.randn([optimal_batch_size]+input_size, dtype=torch.float, device=next(model.parameters()).device)
     repetitions=100
-    total_time = 0
     with torch.no_grad():
-        for rep in range(repetitions):
-            starter, ender = torch.cuda.Event(enable_timing=True),   torch.cuda.Event(enable_timing=True)
-            starter.record()
-            _ = model(dummy_input)
-            ender.record()
-            torch.cuda.synchronize()
-            curr_time = starter.elapsed_time(ender)/1000
-            total_time += curr_time
-    throughput = (repetitions*optimal_batch_size)/total_time
+        timings = time_runs(lambda: model(dummy_input), repetitions=repetitions)
+    throughput = (repetitions*optimal_batch_size)/(timings.sum()/1000)
     return throughput
 
 def measure_inference_time(input_size, model):
     # Measuring inference time
-    dummy_input = torch.randn([1]+input_size, dtype=torch.float)
-
-    starter, ender = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
-    repetitions = 300
-    timings=np.zeros((repetitions,1))
-    # GPU warm-up
-    for _ in range(10):
-        _ = model(dummy_input)
-        
-    # Measuring
+    dummy_input = torch.randn([1]+input_size, dtype=torch.float, device=next(model.parameters()).device)
     with torch.no_grad():
-        for rep in range(repetitions):
-            starter.record()
-            _ = model(dummy_input)
-            ender.record()
-            # GPU Sync
-            torch.cuda.synchronize()
-            curr_time = starter.elapsed_time(ender)
-            timings[rep] = curr_time
-    mean_syn = np.sum(timings) / repetitions
+        timings = time_runs(lambda: model(dummy_input), repetitions=300)
+    mean_syn = timings.mean()
     std_syn = np.std(timings)
     return mean_syn, std_syn
 
@@ -56,37 +56,155 @@ def set_device(cuda=True):
     #     torch.set_default_tensor_type('torch.cuda.FloatTensor')
     return device
 
-def compute_mean_std(loader):
-    """Computes mean and std of a dataset over minibatches"""
-    
-    mean_img = None
-    std_img = None
+class RunningStats(object):
+    """Per-channel mean and variance of images accumulated in a single pass, with Welford's update generalized to batches by Chan et al.
+    Partial results, as computed by batch_stats in the dataloader workers, are merged without loss of precision.
+
+        Attributes:
+            count (int): Number of pixels per channel
+            mean_ (torch.Tensor): Mean of each channel
+            m2 (torch.Tensor): Sum of the squared differences to the mean of each channel
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean_ = None
+        self.m2 = None
+
+    def update(self, imgs):
+        """Accumulates a batch of images, N x C x H x W"""
+        imgs = imgs.double().transpose(0, 1).reshape(imgs.shape[1], -1)
+        batch = RunningStats()
+        batch.count = imgs.shape[1]
+        batch.mean_ = imgs.mean(dim=1)
+        batch.m2 = ((imgs - batch.mean_[:, None])**2).sum(dim=1)
+        return self.merge(batch)
 
+    def merge(self, other):
+        """Merges the statistics of other, of disjoint samples"""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean_, self.m2 = other.count, other.mean_.clone(), other.m2.clone()
+            return self
+        count = self.count + other.count
+        delta = other.mean_ - self.mean_
+        self.mean_ = self.mean_ + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def mean(self):
+        return self.mean_.float()
+
+    @property
+    def std(self):
+        return torch.sqrt(self.m2 / self.count).float()
+
+def batch_stats(batch):
+    """Collate function reducing a batch of (image, label) to its RunningStats, so that the dataloader workers do the reduction"""
+    return RunningStats().update(torch.stack([img for img, _ in batch]))
+
+def compute_mean_std(loader):
+    """Computes per-channel mean and std of a dataset over minibatches"""
+    stats = RunningStats()
     for imgs, _ in loader:
-        if std_img is None:
-            std_img = torch.zeros_like(imgs[0])
-        if mean_img is None:
-            mean_img = torch.zeros_like(imgs[0])
-        std_img += ((imgs - mean_img)**2).sum(dim=0)
-        mean_img += imgs.sum(dim=0)
-
-    mean_img /= len(loader.dataset)
-    std_img /= len(loader.dataset)
-    std_img = torch.sqrt(std_img)
-    std_img[std_img == 0] = 1
-    return mean_img, std_img
+        stats.update(imgs)
+    std = stats.std
+    std[std == 0] = 1
+    return stats.mean, std
 
 def evaluate(model, loader):
     y_true = []
     y_pred = []
-    for imgs, labels in loader:
-        logits = model(imgs)
+    with torch.inference_mode():
+        for imgs, labels in loader:
+            logits = model(imgs)
 
-        y_true.extend(labels)
-        y_pred.extend(logits.detach().numpy())
+            y_true.extend(labels)
+            y_pred.extend(logits.numpy())
 
     return np.array(y_true), np.array(y_pred)
 
+class StreamingMetrics(object):
+    """Classification metrics accumulated batch by batch, in memory independent of the number of samples:
+    a confusion matrix, and histograms of the softmax scores of the positive and negative (sample, class) pairs
+    from which the micro-averaged precision/recall curve is computed, at the resolution of the bins.
+
+        Attributes:
+            num_classes (int): Number of classes
+            num_bins (int): Score bins of the precision/recall curve
+            confusion (torch.Tensor): Count of samples by true (rows) and predicted (columns) class
+            positives (torch.Tensor): Count of the scores of the true class of each sample, by bin
+            negatives (torch.Tensor): Count of the scores of the other classes, by bin
+    """
+    def __init__(self, num_classes, num_bins=1000):
+        self.num_classes = num_classes
+        self.num_bins = num_bins
+        self.confusion = torch.zeros(num_classes, num_classes, dtype=torch.long)
+        self.positives = torch.zeros(num_bins, dtype=torch.long)
+        self.negatives = torch.zeros(num_bins, dtype=torch.long)
+
+    def update(self, logits, labels):
+        """Accumulates a batch
+
+        Args:
+            logits (torch.Tensor): Model outputs, N x num_classes
+            labels (torch.Tensor): True classes, N
+        """
+        logits, labels = logits.detach().float().cpu(), labels.cpu().long()
+        scores = torch.softmax(logits, dim=1)
+        preds = scores.argmax(dim=1)
+        self.confusion += torch.bincount(labels * self.num_classes + preds, minlength=self.num_classes**2).view(self.num_classes, self.num_classes)
+
+        bins = (scores * self.num_bins).long().clamp_(max=self.num_bins - 1)
+        positive = torch.nn.functional.one_hot(labels, self.num_classes).bool()
+        self.positives += torch.bincount(bins[positive], minlength=self.num_bins)
+        self.negatives += torch.bincount(bins[~positive], minlength=self.num_bins)
+
+    @property
+    def accuracy(self):
+        return (self.confusion.trace() / self.confusion.sum().clamp(min=1)).item()
+
+    def precision_recall_curve(self):
+        """Micro-averaged precision/recall curve, as sklearn.metrics.precision_recall_curve over the binarized labels and the scores,
+        with the bin edges as thresholds
+
+        Returns:
+            tuple: Precision, recall and thresholds, as np.ndarray ordered by increasing threshold
+        """
+        # Pairs scored at or above each bin's lower edge
+        tp = self.positives.flip(0).cumsum(0).flip(0).double()
+        fp = self.negatives.flip(0).cumsum(0).flip(0).double()
+        thresholds = torch.arange(self.num_bins, dtype=torch.double) / self.num_bins
+        predicted = (tp + fp) > 0
+        precision = (tp / (tp + fp).clamp(min=1))[predicted]
+        recall = (tp / tp[0].clamp(min=1))[predicted]
+        # Ends at full precision and no recall, as sklearn
+        precision = torch.cat([precision, torch.ones(1, dtype=torch.double)])
+        recall = torch.cat([recall, torch.zeros(1, dtype=torch.double)])
+        return precision.numpy(), recall.numpy(), thresholds[predicted].numpy()
+
+def evaluate_streaming(model, loader, num_classes, num_bins=1000):
+    """Evaluates a model over a dataloader in inference mode, accumulating the metrics batch by batch
+
+    Args:
+        model (nn.Module): Model
+        loader (DataLoader): Loader of images and labels
+        num_classes (int): Number of classes
+        num_bins (int, optional): Score bins of the precision/recall curve. Defaults to 1000.
+
+    Returns:
+        StreamingMetrics: Metrics over the whole loader
+    """
+    model.eval()
+    metrics = StreamingMetrics(num_classes, num_bins=num_bins)
+    device = next(model.parameters()).device
+    with torch.inference_mode():
+        for imgs, labels in loader:
+            metrics.update(model(imgs.to(device)), labels)
+    return metrics
+
 class ImagePredictionLogger(Callback):
     def on_validation_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx):
         if batch_idx == 0:
@@ -99,11 +217,24 @@ class ImagePredictionLogger(Callback):
 # Label encoding (additional save/load)
 
 class LabelEncoder(object):
-    """Label encoder for tag labels."""
-    def __init__(self, class_to_index={}):
-        self.class_to_index = class_to_index
+    """Label encoder for tag labels. Encodes and decodes whole arrays of labels at once."""
+    def __init__(self, class_to_index=None):
+        self.class_to_index = dict(class_to_index) if class_to_index else {}
         self.index_to_class = {v: k for k, v in self.class_to_index.items()}
         self.classes = list(self.class_to_index.keys())
+        self._build_lookup()
+
+    def _build_lookup(self):
+        # Classes sorted for np.searchsorted with their indices, and classes by index
+        classes = np.asarray(self.classes)
+        if classes.dtype == object:
+            classes = classes.astype(str)
+        order = np.argsort(classes, kind="stable")
+        self._sorted_classes = classes[order]
+        self._sorted_indices = np.asarray([self.class_to_index[c] for c in self.classes], dtype=int)[order]
+        self._index_to_class = np.empty(max(self.index_to_class, default=-1) + 1, dtype=object)
+        for index, class_ in self.index_to_class.items():
+            self._index_to_class[index] = class_
 
     def __len__(self):
         return len(self.class_to_index)
@@ -117,19 +248,26 @@ class LabelEncoder(object):
             self.class_to_index[class_] = i
         self.index_to_class = {v: k for k, v in self.class_to_index.items()}
         self.classes = list(self.class_to_index.keys())
+        self._build_lookup()
         return self
 
     def encode(self, y):
-        encoded = np.zeros((len(y)), dtype=int)
-        for i, item in enumerate(y):
-            encoded[i] = self.class_to_index[item]
-        return encoded
+        y = np.asarray(y)
+        if y.dtype == object:
+            y = y.astype(str)
+        if not len(self._sorted_classes):
+            if len(y):
+                raise KeyError(y[0])
+            return np.zeros(0, dtype=int)
+        positions = np.searchsorted(self._sorted_classes, y)
+        positions[positions == len(self._sorted_classes)] = 0
+        unknown = self._sorted_classes[positions] != y
+        if unknown.any():
+            raise KeyError(y[unknown][0])
+        return self._sorted_indices[positions]
 
     def decode(self, y):
-        classes = []
-        for i, item in enumerate(y):
-            classes.append(self.index_to_class[item])
-        return classes
+        return self._index_to_class[np.asarray(y, dtype=int)].tolist()
 
     def save(self, fp):
         with open(fp, 'w') as fp:
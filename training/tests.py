@@ -1,8 +1,16 @@
+import os
+import tempfile
 import unittest
+from unittest.mock import patch
+
+from PIL import Image
 
 from src.models import ResNet18
-from src.data import FashionDataModule
+from src.data import FashionDataModule, FashionDataset, MEAN, STD, compute_dataset_stats, dataset_fingerprint
 from src.utils import *
+from src.export import *
+from src.augment import BatchAugmentation
+from src.benchmark import benchmark
 
 class DataTest(unittest.TestCase):
     def setUp(self):
@@ -33,6 +41,176 @@ class DataTest(unittest.TestCase):
         for _ in loader:
             pass
 
+class ShardCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.ds_dir = os.path.join(self.dir.name, "images")
+        os.makedirs(self.ds_dir)
+        rows = []
+        for i in range(7):
+            image = np.random.randint(0, 256, (40, 30, 3), dtype=np.uint8)
+            Image.fromarray(image).save(os.path.join(self.ds_dir, f"{i}.jpg"))
+            rows.append(f"{i},{['Shirt', 'Bag'][i % 2]}")
+        self.csv_file = os.path.join(self.dir.name, "labels.csv")
+        with open(self.csv_file, "w") as file:
+            file.write("image_id,label\n" + "\n".join(rows))
+        self.cache_dir = os.path.join(self.dir.name, "shards")
+        self.transform = FashionDataModule(num_classes=2).transform
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_annotations(self):
+        dataset = FashionDataset(self.csv_file, self.ds_dir)
+        self.assertEqual([str(i) for i in range(7)], dataset.image_ids.tolist())
+        self.assertEqual(["Shirt", "Bag"] * 3 + ["Shirt"], dataset.label_encoder.decode(dataset.labels))
+        self.assertFalse(hasattr(dataset, "df"))
+
+    def test_same_samples(self):
+        uncached = FashionDataset(self.csv_file, self.ds_dir, transform=self.transform)
+        cached = FashionDataset(self.csv_file, self.ds_dir, transform=self.transform, cache_dir=self.cache_dir, shard_size=3)
+        self.assertEqual(3, len([f for f in os.listdir(self.cache_dir) if f.startswith("images-")]))
+        for i in range(len(uncached)):
+            with self.subTest(idx=i):
+                (x, y), (x_cached, y_cached) = uncached[i], cached[i]
+                self.assertEqual(y, y_cached)
+                self.assertTrue(torch.allclose(x, x_cached))
+
+    def test_reused(self):
+        FashionDataset(self.csv_file, self.ds_dir, cache_dir=self.cache_dir)
+        meta_mtime = os.path.getmtime(os.path.join(self.cache_dir, "meta.json"))
+        with patch("src.data.decode_image") as decode_image: # The images aren't read anymore
+            x, _ = FashionDataset(self.csv_file, self.ds_dir, cache_dir=self.cache_dir)[0]
+        decode_image.assert_not_called()
+        self.assertEqual((28, 28), x.size)
+        self.assertEqual(meta_mtime, os.path.getmtime(os.path.join(self.cache_dir, "meta.json")))
+
+    def test_rebuilt_on_image_change(self):
+        FashionDataset(self.csv_file, self.ds_dir, cache_dir=self.cache_dir)
+        # Replaced with an image of another size, the csv file is unchanged
+        Image.fromarray(np.full((20, 20, 3), 255, dtype=np.uint8)).save(os.path.join(self.ds_dir, "0.jpg"))
+        x, _ = FashionDataset(self.csv_file, self.ds_dir, cache_dir=self.cache_dir)[0]
+        self.assertEqual(255, np.asarray(x).min())
+
+class SplitTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        ds_dir = os.path.join(self.dir.name, "images")
+        os.makedirs(ds_dir)
+        rows = []
+        for i in range(20):
+            Image.fromarray(np.random.randint(0, 256, (28, 28, 3), dtype=np.uint8)).save(os.path.join(ds_dir, f"{i}.jpg"))
+            rows.append(f"{i},{['Shirt', 'Bag'][i % 2]}")
+        csv_file = os.path.join(self.dir.name, "labels.csv")
+        with open(csv_file, "w") as file:
+            file.write("image_id,label\n" + "\n".join(rows))
+        self.custom_ds_info = {"csv_file": csv_file, "ds_dir": ds_dir, "split": [0.6, 0.2, 0.2]}
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_same_split(self):
+        dms = []
+        for seed in [1, 2]:
+            np.random.seed(seed) # As each run of train.py would
+            dm = FashionDataModule(num_classes=2, custom_ds_info=self.custom_ds_info, num_workers=0)
+            dm.setup()
+            dms.append(dm)
+        for split in ["train", "val", "test"]:
+            with self.subTest(split=split):
+                self.assertEqual(getattr(dms[0], split).indices.tolist(), getattr(dms[1], split).indices.tolist())
+        # The statistics of the split are computed once
+        self.assertEqual(1, len([f for f in os.listdir(self.dir.name) if f.startswith("stats-")]))
+        self.assertEqual((dms[0].mean, dms[0].std), (dms[1].mean, dms[1].std))
+
+class DatasetStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.imgs = torch.rand(50, 2, 6, 6) * torch.tensor([1., 10.])[None, :, None, None] + 1000
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_running_stats(self):
+        stats = RunningStats()
+        for imgs in self.imgs.split(7):
+            stats.update(imgs)
+        expected = self.imgs.double().transpose(0, 1).reshape(2, -1)
+        self.assertTrue(torch.allclose(expected.mean(dim=1).float(), stats.mean))
+        self.assertTrue(torch.allclose(expected.std(dim=1, unbiased=False).float(), stats.std, rtol=1e-4))
+
+    def test_merge(self):
+        merged = RunningStats().update(self.imgs[:20]).merge(RunningStats().update(self.imgs[20:]))
+        single = RunningStats().update(self.imgs)
+        self.assertEqual(single.count, merged.count)
+        self.assertTrue(torch.allclose(single.std, merged.std))
+
+    def test_cached(self):
+        dataset = torch.utils.data.TensorDataset(self.imgs, torch.zeros(50))
+        stats_file = os.path.join(self.dir.name, "stats.json")
+        mean, std = compute_dataset_stats(dataset, stats_file, batch_size=8, num_workers=2)
+        self.assertTrue(torch.allclose(RunningStats().update(self.imgs).std, torch.tensor(std)))
+        self.assertEqual((mean, std), compute_dataset_stats(None, stats_file)) # Read from the cache
+
+    def test_fingerprint(self):
+        fingerprint = dataset_fingerprint(self.dir.name)
+        self.assertEqual(fingerprint, dataset_fingerprint(self.dir.name))
+        with open(os.path.join(self.dir.name, "0.jpg"), "w") as file:
+            file.write("image")
+        self.assertNotEqual(fingerprint, dataset_fingerprint(self.dir.name))
+        # Statistics of another split are cached apart
+        train_idx = np.arange(0, 50, 2)
+        self.assertNotEqual(dataset_fingerprint(self.dir.name), dataset_fingerprint(self.dir.name, indices=train_idx))
+        self.assertEqual(dataset_fingerprint(self.dir.name, indices=train_idx), dataset_fingerprint(self.dir.name, indices=list(train_idx)))
+
+class LabelEncoderTest(unittest.TestCase):
+    def setUp(self):
+        self.label_encoder = LabelEncoder().fit(np.array(["Shirt", "Bag", "Dress", "Bag"]))
+
+    def test_encode_decode(self):
+        y = np.array(["Dress", "Bag", "Shirt", "Bag"])
+        encoded = self.label_encoder.encode(y)
+        self.assertEqual([1, 0, 2, 0], encoded.tolist())
+        self.assertEqual(y.tolist(), self.label_encoder.decode(encoded))
+
+    def test_unknown_label(self):
+        with self.assertRaises(KeyError):
+            self.label_encoder.encode(["Shirt", "Shirts"])
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as dir:
+            self.label_encoder.save(os.path.join(dir, "classes.json"))
+            label_encoder = LabelEncoder.load(os.path.join(dir, "classes.json"))
+        self.assertEqual([2, 1], label_encoder.encode(["Shirt", "Dress"]).tolist())
+
+class BatchAugmentationTest(unittest.TestCase):
+    def setUp(self):
+        self.augmentation = BatchAugmentation(random_affine=True, random_crop=True, random_erasing=True, random_perspective=True, mean=MEAN, std=STD)
+
+    def test_shape(self):
+        x = self.augmentation(torch.randn(16, 1, 28, 28))
+        self.assertEqual((16, 1, 24, 24), tuple(x.shape))
+        self.assertTrue(torch.isfinite(x).all())
+
+    def test_uint8(self):
+        x = self.augmentation(torch.randint(0, 256, (4, 1, 28, 28), dtype=torch.uint8))
+        self.assertEqual(torch.float, x.dtype)
+
+    def test_per_sample(self):
+        x = self.augmentation(torch.randn(1, 1, 28, 28).repeat(8, 1, 1, 1))
+        self.assertFalse(all(torch.equal(x[0], x[i]) for i in range(1, 8)))
+
+    def test_flip_only(self):
+        x = torch.randn(32, 1, 28, 28)
+        flipped = BatchAugmentation()(x)
+        for i in range(len(x)):
+            self.assertTrue(torch.equal(x[i], flipped[i]) or torch.equal(x[i].flip(-1), flipped[i]))
+
+    def test_data_module(self):
+        dm = FashionDataModule(num_classes=10, transforms_args={"random_affine": True, "random_crop": False, "random_erasing": False, "random_perspective": False, "batch": True})
+        self.assertIsNotNone(dm.batch_augmentation)
+        self.assertFalse(any(type(t).__name__ in ("RandomAffine", "RandomHorizontalFlip") for t in dm.augmentation.transforms))
+
 class TestResNet(unittest.TestCase):
     def setUp(self):
         self.num_classes = 10
@@ -63,5 +241,109 @@ class TestResNet(unittest.TestCase):
                     self.assertIsNotNone(param.grad)
                     self.assertNotEqual(0., torch.sum(param.grad ** 2))
 
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.model = ResNet18(num_classes=10, fine_tune=False)
+        self.path = os.path.join(self.dir.name, "model.onnx")
+        export_onnx(self.model, self.path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    @torch.no_grad()
+    def test_dynamic_batch(self):
+        session = onnx_session(self.path)
+        for batch_size in [1, 5]:
+            with self.subTest(batch_size=batch_size):
+                x = torch.randint(0, 256, [batch_size, 1, 28, 28], dtype=torch.uint8)
+                logits = session.run(None, {"input": x.numpy()})[0]
+                # Normalized as FashionDataModule
+                expected = self.model((x.float() / 255 - MEAN) / STD)
+                np.testing.assert_allclose(expected.numpy(), logits, rtol=1e-3, atol=1e-4)
+
+    @torch.no_grad()
+    def test_float_input(self):
+        path = os.path.join(self.dir.name, "model-float.onnx")
+        export_onnx(self.model, path, input_dtype="float32")
+        x = torch.rand([2, 1, 28, 28])
+        logits = onnx_session(path).run(None, {"input": x.numpy()})[0]
+        np.testing.assert_allclose(self.model((x - MEAN) / STD).numpy(), logits, rtol=1e-3, atol=1e-4)
+        self.assertEqual("float32", onnx_session(path).get_modelmeta().custom_metadata_map["input_dtype"])
+
+    def test_saved_stats(self):
+        model = ResNet18(num_classes=10, fine_tune=False, mean=0.3, std=0.2, split_seed=3)
+        self.assertEqual((0.3, 0.2), model_stats(model))
+        self.assertEqual(3, model.hparams["split_seed"]) # Read back by export.py to evaluate on the test split of the model
+        self.assertEqual((MEAN, STD), model_stats(self.model))
+        path = os.path.join(self.dir.name, "model-stats.onnx")
+        export_onnx(model, path)
+        meta = onnx_session(path).get_modelmeta().custom_metadata_map
+        self.assertEqual(("0.3", "0.2"), (meta["mean"], meta["std"]))
+
+    def test_quantize(self):
+        loader = [(torch.randn([4, 1, 28, 28]), torch.zeros(4)) for _ in range(2)]
+        dynamic_path, static_path = os.path.join(self.dir.name, "dynamic.onnx"), os.path.join(self.dir.name, "static.onnx")
+        quantize_int8(self.path, dynamic_path, static_path, loader, num_batches=2)
+        for path in [dynamic_path, static_path]:
+            with self.subTest(path=path):
+                self.assertLess(os.path.getsize(path), os.path.getsize(self.path))
+                self.assertEqual((3, 10), onnx_session(path).run(None, {"input": np.random.randint(0, 256, (3, 1, 28, 28), dtype=np.uint8)})[0].shape)
+
+    def test_best_checkpoint(self):
+        for name in ["model-epoch=01-val_loss=0.52.ckpt", "model-epoch=04-val_loss=0.31.ckpt", "model-epoch=07-val_loss=0.40.ckpt"]:
+            open(os.path.join(self.dir.name, name), "w").close()
+        self.assertEqual("model-epoch=04-val_loss=0.31.ckpt", os.path.basename(best_checkpoint(self.dir.name)))
+
+class StreamingMetricsTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.logits = torch.randn(500, 4) + 2 * torch.nn.functional.one_hot(torch.arange(500) % 4, 4)
+        self.labels = torch.arange(500) % 4
+        self.metrics = StreamingMetrics(num_classes=4, num_bins=10000)
+        for logits, labels in zip(self.logits.split(64), self.labels.split(64)):
+            self.metrics.update(logits, labels)
+
+    def test_confusion(self):
+        preds = self.logits.argmax(dim=1)
+        self.assertEqual(500, self.metrics.confusion.sum().item())
+        self.assertEqual(((self.labels == 1) & (preds == 2)).sum().item(), self.metrics.confusion[1, 2].item())
+        self.assertAlmostEqual((preds == self.labels).float().mean().item(), self.metrics.accuracy, places=6)
+
+    def test_precision_recall_curve(self):
+        from sklearn.metrics import auc, precision_recall_curve
+        scores = torch.softmax(self.logits, dim=1)
+        positive = torch.nn.functional.one_hot(self.labels, 4)
+        precision, recall, _ = precision_recall_curve(positive.numpy().ravel(), scores.numpy().ravel())
+        streaming_precision, streaming_recall, thresholds = self.metrics.precision_recall_curve()
+        self.assertEqual(len(thresholds) + 1, len(streaming_precision))
+        self.assertTrue(np.all(np.diff(streaming_recall) <= 0))
+        self.assertAlmostEqual(auc(recall, precision), auc(streaming_recall, streaming_precision), places=2)
+
+class BenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.model = ResNet18(num_classes=10, fine_tune=False)
+        self.path = os.path.join(self.dir.name, "model.onnx")
+        export_onnx(self.model, self.path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_sweep(self):
+        threads = torch.get_num_threads()
+        results = benchmark(self.model, onnx_path=self.path, batch_sizes=[1, 4], threads=[1, 2], repetitions=3, warmup=1)
+        self.assertEqual(threads, torch.get_num_threads())
+        self.assertEqual(2 * 2 * 3, len(results))
+        self.assertEqual({"eager", "torchscript", "onnx"}, {res["backend"] for res in results})
+        for res in results:
+            self.assertLessEqual(res["latency_p50_ms"], res["latency_p99_ms"])
+            self.assertGreater(res["throughput"], 0)
+
+    def test_measure_cpu(self):
+        mean, _ = measure_inference_time([1, 28, 28], self.model.eval())
+        self.assertGreater(mean, 0)
+        self.assertGreater(measure_throughput([1, 28, 28], self.model, optimal_batch_size=8), 0)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
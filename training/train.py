@@ -13,8 +13,6 @@ from pytorch_lightning.callbacks import ModelPruning
 from pytorch_lightning.callbacks import ModelCheckpoint
 from pytorch_lightning import seed_everything
 
-from sklearn.preprocessing import label_binarize
-from sklearn.metrics import precision_recall_curve
 
 import warnings
 warnings.filterwarnings("ignore") # A lot of deprecated warnings in the last version of PyTorch
@@ -49,6 +47,13 @@ parser.add_argument(
     default=False
 )
 
+parser.add_argument(
+    '--batch_augment',
+    help='Specify if you want to apply the data augmentation to whole batches instead of single images',
+    type=bool,
+    default=False
+)
+
 parser.add_argument(
     '--pruning',
     help='Specify if you want to prune the model',
@@ -84,6 +89,13 @@ parser.add_argument(
     default=10
 )
 
+parser.add_argument(
+    '--split_seed',
+    help='Seed of the train/val/test split, the same for every run',
+    type=int,
+    default=0
+)
+
 parser.add_argument(
     '--fast_dev_run',
     help='Test whether everything works',
@@ -106,6 +118,7 @@ if args.json != "":
     EPOCHS = conf["epochs"]
     FINE_TUNE = conf["fine_tune"]
     AUGMENT = conf["augment"]
+    BATCH_AUGMENT = conf.get("batch_augment", False)
     PRUNING = conf["pruning"]
     
     # Custom DS
@@ -113,6 +126,8 @@ if args.json != "":
     CSV_FILE = conf["csv_file"]
     DS_DIR = conf["ds_dir"]
     SPLIT = conf["split"]
+    CACHE_DIR = conf.get("cache_dir") or None
+    SPLIT_SEED = conf.get("split_seed", 0)
 
     # Run files
     RUN_DIR = conf["run_dir"]
@@ -124,6 +139,8 @@ if args.json != "":
 else:
     # If there isn't a JSON config, using Fashion MNIST to train
     CUSTOM_DS = None
+    CACHE_DIR = None
+    SPLIT_SEED = args.split_seed
 
     # Some hyperparameters
     USE_GPU = args.use_gpu
@@ -132,6 +149,7 @@ else:
     EPOCHS = args.epochs
     FINE_TUNE = args.fine_tune
     AUGMENT = args.augment
+    BATCH_AUGMENT = args.batch_augment
     PRUNING = args.pruning
 
     # Run files
@@ -161,6 +179,8 @@ if AUGMENT:
     augmentations["random_erasing"] = True
     augmentations["random_perspective"] = True
     augmentations["random_affine"] = True
+    # Applied to whole batches with tensor ops, instead of one image at a time in the dataloader workers
+    augmentations["batch"] = BATCH_AUGMENT
 
 def train():
     
@@ -173,11 +193,11 @@ def train():
             "split": SPLIT
         }
 
-    dm = FashionDataModule(num_classes=NUM_CLASSES, batch_size=BATCH_SIZE, custom_ds_info=custom_ds_info, transforms_args=augmentations, num_workers=4)
+    dm = FashionDataModule(num_classes=NUM_CLASSES, batch_size=BATCH_SIZE, custom_ds_info=custom_ds_info, transforms_args=augmentations, num_workers=4, cache_dir=CACHE_DIR, split_seed=SPLIT_SEED)
     dm.setup()
 
     ########## Initializing model
-    model = ResNet18(num_classes=NUM_CLASSES, fine_tune=FINE_TUNE)
+    model = ResNet18(num_classes=NUM_CLASSES, fine_tune=FINE_TUNE, mean=dm.mean, std=dm.std, split_seed=dm.split_seed)
 
     ########## Initialize logger for tracking and callbacks
     wandb.login()
@@ -222,6 +242,7 @@ def train():
     wandb.config.update({"learning_rate": model.learning_rate})
     wandb.config.update(augmentations)
     wandb.config.update({"pruning": PRUNING})
+    wandb.config.update({"mean": dm.mean, "std": dm.std, "split_seed": dm.split_seed})
     trainer.fit(model, dm)
 
     ########### Evaluation
@@ -230,16 +251,12 @@ def train():
         best_model = trainer.checkpoint_callback.best_model_path
 
         inference_model = ResNet18.load_from_checkpoint(best_model)
-        y_true, y_pred = evaluate(inference_model, dm.test_dataloader(batch_size=BATCH_SIZE, num_workers=4))
-
-        binary_ground_truth = label_binarize(y_true, classes=[i for i in range(NUM_CLASSES)])
-        precision_micro, recall_micro, _ = precision_recall_curve(binary_ground_truth.ravel(),
-                                                                y_pred.ravel())
-
-        data = [[x, y] for (x, y) in zip(recall_micro, precision_micro)]
-        sample_rate = int(len(data)/10000)
+        metrics = evaluate_streaming(inference_model, dm.test_dataloader(batch_size=BATCH_SIZE, num_workers=4), NUM_CLASSES)
+        precision_micro, recall_micro, _ = metrics.precision_recall_curve()
+        wandb.log({"evaluation_accuracy": metrics.accuracy})
 
-        table = wandb.Table(columns=["recall_micro", "precision_micro"], data=data[::sample_rate])
+        data = np.stack([recall_micro, precision_micro], axis=1).tolist()
+        table = wandb.Table(columns=["recall_micro", "precision_micro"], data=data)
         wandb.log({"precision_recall" : wandb.plot.line(table, 
                                                         "recall_micro", 
                                                         "precision_micro", 